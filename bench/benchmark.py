@@ -0,0 +1,261 @@
+"""Benchmark suite for the storage, reporting and data-tool paths.
+
+    python bench/benchmark.py --sizes 1e3,1e4,1e5 --output results.json
+    python bench/benchmark.py --sizes 1e5 --compare results.json
+
+For every size a throwaway database is filled by a deterministic synthetic
+generator (same --seed, same data) and each operation is timed --repeat
+times with the report cache cleared, so the numbers measure SQLite work
+rather than cache hits. Results are printed as JSON; with --compare the run
+is checked against an earlier result file and exits non-zero when any
+operation's median is more than --threshold times slower.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from source.budget import BudgetManager                       # noqa: E402
+from source.cache import report_cache                         # noqa: E402
+from source.database import SEARCH_BATCH_SQL, Database        # noqa: E402
+from source.reports import ReportGenerator                    # noqa: E402
+from source.transactions import INSERT_SQL, TransactionManager  # noqa: E402
+
+# (category, weight, typical amount in dollars); salary is the only income
+EXPENSE_CATEGORIES = [
+    ('groceries', 30, 60), ('restaurants', 18, 35), ('transport', 15, 20),
+    ('utilities', 6, 120), ('entertainment', 8, 45), ('shopping', 10, 80),
+    ('health', 4, 90), ('travel', 2, 600), ('rent', 3, 1400), ('gifts', 4, 50),
+]
+INCOME_SHARE = 0.08
+BUDGET_CATEGORIES = ('groceries', 'restaurants', 'transport', 'entertainment', 'shopping')
+HISTORY_DAYS = 3 * 365
+END_DATE = date(2024, 12, 31)
+BULK_ROWS = 10000
+NOISE_FLOOR_MS = 0.5   # slowdowns smaller than this are timer noise, not regressions
+
+
+def generate(db, users, rows_per_user, seed=0, batch_size=10000):
+    """Fill db with users, transactions and budgets; returns the user ids.
+
+    Amounts are log-normal around each category's typical value, dates are
+    spread over three years with weekend spending slightly heavier, and
+    every user gets monthly budgets for the most common categories over the
+    final year. The same seed always produces the same database.
+    """
+    rng = random.Random(seed)
+    names, weights, typical = zip(*EXPENSE_CATEGORIES)
+    start = END_DATE - timedelta(days=HISTORY_DAYS - 1)
+    days = [(start + timedelta(days=offset)).isoformat() for offset in range(HISTORY_DAYS)]
+    day_weights = [1.3 if (start + timedelta(days=offset)).weekday() >= 5 else 1.0
+                   for offset in range(HISTORY_DAYS)]
+
+    with db._get_cursor() as cursor:
+        cursor.executemany("INSERT INTO users (username, password) VALUES (?, ?)",
+                           ((f"bench{n}", 'x' * 64) for n in range(users)))
+        user_ids = [row[0] for row in cursor.execute(
+            "SELECT id FROM users WHERE username LIKE 'bench%' ORDER BY id")]
+        cursor.executemany("INSERT INTO categories (user_id, name, key) VALUES (?, ?, ?)",
+                           ((user_id, name, name) for user_id in user_ids
+                            for name in names + ('salary',)))
+        category_ids = {(user_id, name): category_id for category_id, user_id, name
+                        in cursor.execute("SELECT id, user_id, key FROM categories")}
+
+        # Random dates are backdated inserts; build the balances and the
+        # search index once at the end
+        cursor.execute("INSERT INTO maintenance (flag) VALUES ('batching')")
+        batch = []
+        for user_id in user_ids:
+            dates = rng.choices(days, day_weights, k=rows_per_user)
+            picks = rng.choices(range(len(names)), weights, k=rows_per_user)
+            for trans_date, pick in zip(dates, picks):
+                if rng.random() < INCOME_SHARE:
+                    batch.append((user_id, 'income', category_ids[user_id, 'salary'],
+                                  round(rng.lognormvariate(8.0, 0.3) * 100), trans_date, 'payroll'))
+                else:
+                    amount = round(typical[pick] * rng.lognormvariate(0, 0.5) * 100)
+                    batch.append((user_id, 'expense', category_ids[user_id, names[pick]],
+                                  -amount, trans_date, ''))
+                if len(batch) >= batch_size:
+                    cursor.executemany(INSERT_SQL, batch)
+                    batch.clear()
+        cursor.executemany(INSERT_SQL, batch)
+        cursor.execute("DELETE FROM maintenance WHERE flag = 'batching'")
+        cursor.execute(SEARCH_BATCH_SQL, (0,))
+
+        cursor.executemany(
+            "INSERT INTO budget (user_id, category_id, amount, month, year) VALUES (?, ?, ?, ?, ?)",
+            ((user_id, category_ids[user_id, category],
+              typical[names.index(category)] * 100 * 12, month, END_DATE.year)
+             for user_id in user_ids for category in BUDGET_CATEGORIES
+             for month in range(1, 13)))
+    db.rebuild_balances()
+    return user_ids
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        report_cache.clear()
+        with redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'runs': repeat,
+    }
+
+
+def run_size(total_rows, users, repeat, seed, work_dir):
+    db_path = os.path.join(work_dir, f"bench_{total_rows}.db")
+    db = Database(db_path)
+    rows_per_user = max(1, total_rows // users)
+
+    started = time.perf_counter()
+    user_ids = generate(db, users, rows_per_user, seed)
+    generate_seconds = time.perf_counter() - started
+    user_id = user_ids[0]
+    year, month = END_DATE.year, END_DATE.month
+
+    # Writes go to a separate user so repeats don't grow the data being read
+    db.add_user('bench-writer', 'x' * 64)
+    writer = TransactionManager(db.get_user_id('bench-writer'), db)
+    transactions = TransactionManager(user_id, db)
+    reports = ReportGenerator(user_id, db)
+    budgets = BudgetManager(user_id, db)
+    bulk_rng = random.Random(seed + 1)
+    bulk_rows = [('expense', 'groceries', f"{bulk_rng.uniform(1, 200):.2f}",
+                  (END_DATE - timedelta(days=bulk_rng.randrange(HISTORY_DAYS))).isoformat(), '')
+                 for _ in range(BULK_ROWS)]
+    export_file = os.path.join(work_dir, 'export.csv')
+    backup_file = os.path.join(work_dir, 'bench.backup')
+
+    operations = {
+        'add_transaction': lambda: writer.add_transaction(
+            'expense', 'groceries', '12.34', date=END_DATE.isoformat()),
+        'bulk_insert_10k': lambda: writer.add_transactions(bulk_rows),
+        'get_transactions': transactions.get_transactions,
+        'get_transactions_range': lambda: transactions.get_transactions(
+            f"{year}-{month:02d}-01", END_DATE.isoformat()),
+        'get_transactions_page': lambda: transactions.get_transactions_page(limit=50),
+        'get_batch': transactions.get_batch,
+        'summarize': lambda: reports.summarize(year),
+        'monthly_salary': lambda: reports.monthly_salary(month, year),
+        'yearly_salary': lambda: reports.yearly_salary(year),
+        'category_breakdown': lambda: reports.category_breakdown(month, year),
+        'category_breakdown_all': reports.category_breakdown,
+        'totals_between': lambda: reports.totals_between(f"{year}-01-01", END_DATE.isoformat()),
+        'get_positive_total': lambda: reports.get_positive_total(
+            f"{year}-01-01", END_DATE.isoformat()),
+        'get_negative_total': lambda: reports.get_negative_total(
+            f"{year}-01-01", END_DATE.isoformat()),
+        'get_total': reports.get_total,
+        'balance_at': lambda: reports.balance_at(f"{year}-06-15"),
+        'balance_series': lambda: reports.balance_series(
+            f"{year - 2}-01-01", END_DATE.isoformat(), 'week'),
+        'check_budgets': lambda: budgets.check_budgets(month, year),
+        'export': lambda: db.export_transactions(user_id, export_file),
+        'backup': lambda: db.backup_data(backup_file, keep=0),
+    }
+    results = {
+        'rows': users * rows_per_user,
+        'users': users,
+        'rows_per_user': rows_per_user,
+        'generate_rows_per_s': round(users * rows_per_user / generate_seconds),
+        'file_bytes': os.path.getsize(db_path),
+        'operations': {name: measure(function, repeat) for name, function in operations.items()},
+    }
+    db.pool.close_all()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return (size, operation, old_ms, new_ms) for every slowdown over threshold."""
+    regressions = []
+    for size, current in results['sizes'].items():
+        previous = baseline.get('sizes', {}).get(size)
+        if not previous:
+            continue
+        for name, timing in current['operations'].items():
+            old = previous['operations'].get(name)
+            if (old and timing['median_ms'] > old['median_ms'] * threshold
+                    and timing['median_ms'] - old['median_ms'] > NOISE_FLOOR_MS):
+                regressions.append((size, name, old['median_ms'], timing['median_ms']))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(',') if size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('1e3,1e4,1e5'),
+                        help="comma-separated total row counts, e.g. 1e3,1e5,1e7")
+    parser.add_argument('--users', type=int, default=10,
+                        help="users the rows are spread across (per size)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="also write the results to this file")
+    parser.add_argument('--compare', help="earlier result file to check for regressions")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="slowdown ratio that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'sizes': {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            print(f"Benchmarking {size} rows...", file=sys.stderr)
+            results['sizes'][str(size)] = run_size(size, args.users, args.repeat,
+                                                   args.seed, work_dir)
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for size, name, old, new in regressions:
+            print(f"REGRESSION {size} rows {name}: {old} ms -> {new} ms", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Load test for the HTTP/JSON API server.
+
+    python bench/loadtest.py --spawn --users 20 --concurrency 64 --duration 10
+
+With --spawn a server is started on a throwaway database; otherwise point
+--url at a running instance. Each simulated client logs in as one of
+--users users and issues a read-heavy mix of requests over a keep-alive
+connection. Throughput and latency percentiles are printed as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (weight, method, path) - {year}/{month} are filled in per request
+REQUEST_MIX = [
+    (30, 'GET', '/balance'),
+    (20, 'GET', '/transactions?limit=20'),
+    (15, 'GET', '/reports/monthly?month={month}&year={year}'),
+    (10, 'GET', '/reports/yearly?year={year}'),
+    (10, 'GET', '/reports/categories?year={year}'),
+    (5, 'GET', '/budgets?month={month}&year={year}'),
+    (10, 'POST', '/transactions'),
+]
+
+
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None, token=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        if token:
+            head += f"Authorization: Bearer {token}\r\n"
+        self.writer.write(head.encode() + b"\r\n" + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        return status, json.loads(data) if data else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def setup_users(host, port, users, seed_rows):
+    client = Client(host, port)
+    tokens = []
+    for n in range(users):
+        credentials = {'username': f'load{n}', 'password': 'load-pass'}
+        await client.request('POST', '/register', credentials)
+        status, data = await client.request('POST', '/login', credentials)
+        if status != 200:
+            raise RuntimeError(f"login failed: {data}")
+        tokens.append(data['token'])
+        rows = [random_transaction(random.Random(n * 100000 + i)) for i in range(seed_rows)]
+        await client.request('POST', '/transactions', {'transactions': rows}, data['token'])
+    client.close()
+    return tokens
+
+
+def random_transaction(rng):
+    kind = 'income' if rng.random() < 0.2 else 'expense'
+    return {
+        'type': kind,
+        'category': rng.choice(['food', 'rent', 'travel', 'fun', 'salary']),
+        'amount': f"{rng.uniform(1, 500):.2f}",
+        'date': f"{rng.randint(2022, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'description': 'load test',
+    }
+
+
+async def worker(host, port, tokens, deadline, latencies, statuses, rng):
+    client = Client(host, port)
+    weights = [weight for weight, _, _ in REQUEST_MIX]
+    try:
+        while time.perf_counter() < deadline:
+            _, method, path = rng.choices(REQUEST_MIX, weights)[0]
+            path = path.format(month=rng.randint(1, 12), year=rng.randint(2022, 2024))
+            payload = random_transaction(rng) if method == 'POST' else None
+            start = time.perf_counter()
+            status, _ = await client.request(method, path, payload, rng.choice(tokens))
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        client.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run(args, host, port):
+    tokens = await setup_users(host, port, args.users, args.seed_rows)
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(host, port, tokens, deadline, latencies, statuses,
+                                  random.Random(n))
+                           for n in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'latency_ms': {name: round(percentile(latencies, fraction) * 1000, 3)
+                       for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))}
+                      if latencies else {},
+        'status_counts': statuses,
+        'concurrency': args.concurrency,
+        'users': args.users,
+    }
+
+
+def wait_for_port(host, port, timeout=10):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8765')
+    parser.add_argument('--spawn', action='store_true',
+                        help="start a server on a temporary database")
+    parser.add_argument('--workers', type=int, default=8, help="server worker threads (--spawn)")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed-rows', type=int, default=500,
+                        help="transactions created per user before the run")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    server = None
+    temp_dir = None
+    if args.spawn:
+        temp_dir = tempfile.TemporaryDirectory()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'source.server', '--host', host, '--port', str(port),
+             '--db', os.path.join(temp_dir.name, 'load.db'), '--workers', str(args.workers)],
+            cwd=ROOT, stdout=subprocess.DEVNULL)
+        wait_for_port(host, port)
+    try:
+        result = asyncio.run(run(args, host, port))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            temp_dir.cleanup()
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,11 @@
 import sys
+
+# One-shot subcommands (python main.py report ...) skip the interactive menu
+# and its heavier imports; see source/cli.py.
+if __name__ == "__main__" and len(sys.argv) > 1:
+    from source.cli import main
+    sys.exit(main(sys.argv[1:]))
+
 from datetime import datetime
 from decimal import Decimal
 from colorama import Fore, Style, init
@@ -7,14 +14,15 @@ from source.auth import AuthManager
 from source.transactions import TransactionManager
 from source.reports import ReportGenerator
 from source.budget import BudgetManager
-from source.database import Database
+from source.database import get_database
+from source.importer import Importer
 
 init()
 
 class FinanceManager():
     def __init__(self):
-        self.auth = AuthManager()
-        self.db = Database()
+        self.db = get_database()
+        self.auth = AuthManager(self.db)
         self.current_user = None
         self.user_id = None
 
@@ -51,23 +59,79 @@ class FinanceManager():
         headers = ["ID", "Type", "Category", "Amount", "Date", "Description"]
         table_data=[]
         for t in transactions:
-            color = Fore.GREEN if t[2] == 'income' else Fore.RED
-            amount_color = Fore.GREEN if float(t[4]) >= 0 else Fore.RED
-
-            table_data.append([t[0], 
-                               color + t[2] + Style.RESET_ALL, 
-                               t[3], amount_color + f"${float(t[4]):.2f}" + Style.RESET_ALL, 
-                               t[5], 
-                               t[6]])
+            color = Fore.GREEN if t.type == 'income' else Fore.RED
+
+            table_data.append([t.id, 
+                               color + t.type + Style.RESET_ALL, 
+                               t.category, color + f"${t.amount:.2f}" + Style.RESET_ALL, 
+                               t.iso_date, 
+                               t.description])
             
         print(tabulate(table_data, headers=headers, tablefmt="grid"))
 
 
+    def get_transaction_filters(self):
+        filters = {}
+        trans_type = input("Type (income/expense, blank for all): ").strip().lower()
+        if trans_type in ('income', 'expense'):
+            filters['trans_type'] = trans_type
+        category = input("Category (blank for all): ").strip()
+        if category:
+            filters['category'] = category
+        for key, prompt in (('min_amount', "Minimum amount: $"),
+                            ('max_amount', "Maximum amount: $")):
+            value = input(f"{prompt}").strip()
+            if value:
+                try:
+                    filters[key] = Decimal(value)
+                except ArithmeticError:
+                    print(f"{Fore.RED}Ignoring invalid amount.{Style.RESET_ALL}")
+        for key, prompt in (('start_date', "From date (YYYY-MM-DD): "),
+                            ('end_date', "To date (YYYY-MM-DD): ")):
+            value = input(prompt).strip()
+            if value:
+                filters[key] = value
+        return filters
+
+    def page_transactions(self, trans_manager, filters):
+        # Stack of page-start cursors so we can page back without offsets
+        cursors = [None]
+        while True:
+            self.clear_screen()
+            self.print_header(f"Your Transactions (page {len(cursors)})")
+            try:
+                transactions, next_cursor = trans_manager.get_transactions_page(
+                    after=cursors[-1], **filters)
+            except ValueError as error:
+                print(f"{Fore.RED}Invalid filter: {error}{Style.RESET_ALL}")
+                input("\nPress Enter to continue...")
+                return
+            self.show_transactions(transactions)
+
+            options = []
+            if next_cursor:
+                options.append("[n]ext")
+            if len(cursors) > 1:
+                options.append("[p]revious")
+            options.append("[q]uit")
+            choice = input(f"\n{' '.join(options)}: ").strip().lower()
+
+            if choice == 'n' and next_cursor:
+                cursors.append(next_cursor)
+            elif choice == 'p' and len(cursors) > 1:
+                cursors.pop()
+            elif choice in ('q', ''):
+                return
+
     def show_report(self, report, period_type):
         self.print_header(f"{period_type.capitalize()} Report")
 
         if period_type == "month":
             print(f"Period: {report['month']}/{report['year']}")
+        elif period_type == "quarter":
+            print(f"Period: Q{report['quarter']} {report['year']}")
+        elif period_type == "custom":
+            print(f"Period: {report['start_date']} to {report['end_date']}")
         else:
             print(f"Period: {report['year']}")
         
@@ -114,6 +178,37 @@ class FinanceManager():
         print(f"Net Balance: ${total_income - total_expenses:.2f}")
                 
 
+    def show_trends(self):
+        try:
+            from source.analytics import Analytics
+        except ImportError:
+            print(f"{Fore.RED}Trend reports require numpy (pip install numpy).{Style.RESET_ALL}")
+            return
+
+        analytics = Analytics(self.user_id, self.db)
+        trends = analytics.load().trends()
+        if not trends['months']:
+            print(f"{Fore.YELLOW}No transactions found.{Style.RESET_ALL}")
+            return
+
+        def money(value):
+            return "" if value != value else f"${value:,.2f}"  # NaN -> blank
+
+        self.print_header("Last 12 Months")
+        rows = list(zip(trends['months'], trends['income'], trends['expenses'], trends['net'],
+                        trends['rolling_3'], trends['rolling_12'], trends['mom_delta']))[-12:]
+        print(tabulate([[month] + [money(value) for value in values] for month, *values in rows],
+                       headers=["Month", "Income", "Expenses", "Net", "3-mo avg",
+                                "12-mo avg", "Change"], tablefmt="grid"))
+
+        forecast = analytics.forecast()
+        if forecast['months']:
+            self.print_header("Forecast")
+            print(tabulate([[month, money(net), money(balance)] for month, net, balance
+                            in zip(forecast['months'], forecast['net'], forecast['balance'])],
+                           headers=["Month", "Projected net", "Projected balance"],
+                           tablefmt="grid"))
+
     def show_budget_alerts(self, alerts):
         if not alerts:
             print(f"{Fore.GREEN} All budgets are within limits! {Style.RESET_ALL}")
@@ -139,9 +234,9 @@ class FinanceManager():
         print(f"\n{Fore.GREEN}3.{Style.RESET_ALL} Exit")
 
 
-    def user_menu(self):
+    def user_menu(self, report_gen):
         self.clear_screen()
-        balance = ReportGenerator(self.user_id).get_total()
+        balance = report_gen.get_total()
         balance_color = Fore.GREEN if balance >= 0 else Fore.RED
         print(f"\nWelcome, {Fore.YELLOW}{self.current_user}{Style.RESET_ALL}")
         print(f"Current balance: {balance_color}${abs(balance):.2f}{Style.RESET_ALL}")
@@ -175,12 +270,12 @@ class FinanceManager():
                 sys.exit()
     
     def user_session(self):
-        trans_manager = TransactionManager(self.user_id)
-        report_gen = ReportGenerator(self.user_id)
-        budget_manager = BudgetManager(self.user_id)
+        trans_manager = TransactionManager(self.user_id, self.db)
+        report_gen = ReportGenerator(self.user_id, self.db)
+        budget_manager = BudgetManager(self.user_id, self.db)
 
         while True:
-            self.user_menu()
+            self.user_menu(report_gen)
             choice = self.get_valid_input("Choose an option (1-6): ", int, range(1, 7))
 
             if choice == 1:
@@ -190,18 +285,28 @@ class FinanceManager():
                 category = input("Category: ").strip()
                 amount = self.get_valid_input("Amount: $", "decimal")
                 description = input("Descriptional(optional): ").strip()
+                trans_date = input("Date (YYYY-MM-DD, blank for today): ").strip() or None
 
-                if trans_manager.add_transaction(trans_type, category, amount, description):
+                if trans_manager.add_transaction(trans_type, category, amount, description,
+                                                 trans_date):
                     print(f"{Fore.GREEN}✓ Transaction recorded!{Style.RESET_ALL}")
                 input("\nPress Enter to continue...")
 
             elif choice == 2:
                 self.clear_screen()
                 self.print_header("Your Transactions")
-                transactions = trans_manager.get_transactions()
-                self.show_transactions(transactions)
-
-                input("\nPress Enter to continue...")
+                filters = {}
+                text = input("Search text (blank to browse): ").strip()
+                if input("Filter transactions? (y/N): ").strip().lower() == 'y':
+                    filters = self.get_transaction_filters()
+                if text:
+                    try:
+                        self.show_transactions(trans_manager.search(text, limit=50, **filters))
+                    except ValueError as error:
+                        print(f"{Fore.RED}Invalid search: {error}{Style.RESET_ALL}")
+                    input("\nPress Enter to continue...")
+                else:
+                    self.page_transactions(trans_manager, filters)
 
             elif choice == 3:
                 self.clear_screen()
@@ -209,7 +314,15 @@ class FinanceManager():
                 print(f"{Fore.GREEN}1.{Style.RESET_ALL} Monthly Report")
                 print(f"{Fore.GREEN}2.{Style.RESET_ALL} Yearly Report")
                 print(f"{Fore.GREEN}3.{Style.RESET_ALL} Category Breakdown")
-                report_choice = self.get_valid_input("Choose report type (1-3): ", int, [1, 2, 3])
+                print(f"{Fore.GREEN}4.{Style.RESET_ALL} Trends & Forecast")
+                print(f"{Fore.GREEN}5.{Style.RESET_ALL} Quarterly Report")
+                print(f"{Fore.GREEN}6.{Style.RESET_ALL} Custom Period Report")
+                report_choice = self.get_valid_input("Choose report type (1-6): ", int, range(1, 7))
+
+                if report_choice == 4:
+                    self.show_trends()
+                    input("\nPress Enter to continue...")
+                    continue
 
                 if report_choice == 1:
                     month = self.get_valid_input("Month(1-12): ", int, range(1, 13))
@@ -218,6 +331,19 @@ class FinanceManager():
                 elif report_choice == 2:
                     year = self.get_valid_input("Year: ", int)
                     report = report_gen.yearly_salary(year)
+                elif report_choice == 5:
+                    quarter = self.get_valid_input("Quarter (1-4): ", int, range(1, 5))
+                    year = self.get_valid_input("Year: ", int)
+                    report = report_gen.quarterly_report(quarter, year)
+                elif report_choice == 6:
+                    start_date = input("From date (YYYY-MM-DD): ").strip()
+                    end_date = input("To date (YYYY-MM-DD): ").strip()
+                    try:
+                        report = report_gen.custom_report(start_date, end_date)
+                    except ValueError as error:
+                        print(f"{Fore.RED}Invalid period: {error}{Style.RESET_ALL}")
+                        input("\nPress Enter to continue...")
+                        continue
                 else:
                     print("\nBreakdown for:")
                     print(f"{Fore.GREEN}1.{Style.RESET_ALL} Specific Month")
@@ -232,7 +358,11 @@ class FinanceManager():
                         year = self.get_valid_input("Year: ", int)
                         report = report_gen.category_breakdown(year=year)
     
-                self.show_report(report, "month" if report_choice == 1 else "year" if report_choice == 2 else "category")
+                if report_choice == 3:
+                    self._show_category_breakdown(report)
+                else:
+                    period_types = {1: "month", 2: "year", 5: "quarter", 6: "custom"}
+                    self.show_report(report, period_types[report_choice])
                 input("\nPress Enter to continue...")
 
             elif choice == 4:
@@ -259,16 +389,30 @@ class FinanceManager():
                 print(f"{Fore.GREEN}1.{Style.RESET_ALL} Backup Data")
                 print(f"{Fore.GREEN}2.{Style.RESET_ALL} Restore Data")
                 print(f"{Fore.GREEN}3.{Style.RESET_ALL} Export Transactions")
-                data_choice = self.get_valid_input("Choose an option (1-3): ", int, [1, 2, 3])
+                print(f"{Fore.GREEN}4.{Style.RESET_ALL} Import Bank Statement")
+                print(f"{Fore.GREEN}5.{Style.RESET_ALL} Rebuild Report Summaries")
+                data_choice = self.get_valid_input("Choose an option (1-5): ", int, range(1, 6))
 
                 if data_choice == 1:
                     self.db.backup_data()
                 elif data_choice == 2:
                     self.db.restore_data()
-                else:
+                elif data_choice == 5:
+                    self.db.rebuild_rollups(self.user_id)
+                elif data_choice == 3:
                     filename = input("Export filename (default: transactions.csv): ").strip() or "transactions.csv"
                     self.db.export_transactions(self.user_id, filename)
                     print(f"{Fore.GREEN}✓ Data exported to {filename}{Style.RESET_ALL}")
+                else:
+                    filename = input("Statement file (CSV, OFX, QIF): ").strip()
+                    try:
+                        result = Importer(self.user_id, self.db).import_file(filename)
+                        print(f"{Fore.GREEN}✓ Imported {result['inserted']} transactions "
+                              f"({result['duplicates']} duplicates skipped){Style.RESET_ALL}")
+                        if result['errors']:
+                            print(f"{Fore.YELLOW}{len(result['errors'])} rows could not be read.{Style.RESET_ALL}")
+                    except (OSError, ValueError) as error:
+                        print(f"{Fore.RED}Import failed: {error}{Style.RESET_ALL}")
 
                 input("\nPress Enter to continue...")
 
@@ -0,0 +1,128 @@
+"""Vectorized trend analytics over a user's full transaction history.
+
+The history is loaded once into NumPy column arrays (day numbers, int64
+cents and category codes) and every statistic is computed with array
+operations instead of one SQL query per period.
+"""
+import numpy as np
+from source.database import get_database
+from source.transactions import TransactionManager
+
+
+class Analytics:
+    def __init__(self, user_id, db=None):
+        self.user_id = user_id
+        self.db = db or get_database()
+        self.days = None
+        self.amounts = None
+        self.category_codes = None
+        self.categories = None
+
+    def load(self):
+        """Read the user's transactions into column arrays; returns self."""
+        batch = TransactionManager(self.user_id, self.db).get_batch()
+        # The batch's array('q') columns are wrapped without copying
+        self.days = np.frombuffer(batch.days, dtype=np.int64)
+        self.amounts = np.frombuffer(batch.amounts, dtype=np.int64)
+        self.categories = list(batch.categories)
+        self.category_codes = np.frombuffer(batch.category_codes, dtype=np.int64).astype(np.int32)
+        return self
+
+    def _ensure_loaded(self):
+        if self.days is None:
+            self.load()
+
+    def _month_index(self):
+        """Months since 1970-01 for every transaction."""
+        return self.days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+    def monthly_series(self):
+        """Dense per-month income, expense and net totals in cents.
+
+        Returns (months, income, expenses, net) where months holds
+        datetime64[M] values from the first to the last active month.
+        """
+        self._ensure_loaded()
+        if not self.days.size:
+            empty = np.zeros(0, dtype=np.int64)
+            return np.zeros(0, dtype='datetime64[M]'), empty, empty, empty
+
+        month_index = self._month_index()
+        first = month_index.min()
+        offsets = month_index - first
+        length = offsets.max() + 1
+        income = np.bincount(offsets, weights=np.where(self.amounts > 0, self.amounts, 0),
+                             minlength=length).astype(np.int64)
+        expenses = -np.bincount(offsets, weights=np.where(self.amounts < 0, self.amounts, 0),
+                                minlength=length).astype(np.int64)
+        months = (first + np.arange(length)).astype('datetime64[M]')
+        return months, income, expenses, income - expenses
+
+    @staticmethod
+    def rolling_average(values, window):
+        """Trailing moving average; NaN until a full window is available."""
+        values = np.asarray(values, dtype=np.float64)
+        result = np.full(values.shape, np.nan)
+        if values.size >= window:
+            sums = np.cumsum(np.concatenate(([0.0], values)))
+            result[window - 1:] = (sums[window:] - sums[:-window]) / window
+        return result
+
+    def trends(self):
+        """Per-month net cash flow with rolling averages and MoM deltas."""
+        months, income, expenses, net = self.monthly_series()
+        return {
+            'months': [str(month) for month in months],
+            'income': income / 100,
+            'expenses': expenses / 100,
+            'net': net / 100,
+            'rolling_3': self.rolling_average(net, 3) / 100,
+            'rolling_12': self.rolling_average(net, 12) / 100,
+            'mom_delta': np.concatenate(([np.nan], np.diff(net) / 100)),
+        }
+
+    def seasonality(self):
+        """Average expense per calendar month for every category.
+
+        Returns {category: array of 12 averages}, averaging over the number
+        of times each calendar month occurs in the history's span.
+        """
+        self._ensure_loaded()
+        if not self.days.size:
+            return {}
+
+        month_index = self._month_index()
+        calendar_month = month_index % 12
+        expense = self.amounts < 0
+        buckets = self.category_codes[expense].astype(np.int64) * 12 + calendar_month[expense]
+        totals = np.bincount(buckets, weights=-self.amounts[expense],
+                             minlength=len(self.categories) * 12).reshape(-1, 12)
+
+        span = np.arange(month_index.min(), month_index.max() + 1)
+        occurrences = np.maximum(np.bincount(span % 12, minlength=12), 1)
+        averages = totals / occurrences / 100
+        return {category: averages[code]
+                for code, category in enumerate(self.categories)
+                if totals[code].any()}
+
+    def forecast(self, months_ahead=6):
+        """Project net cash flow and balance with a least-squares line.
+
+        Returns {'months', 'net', 'balance'} for the months after the last
+        recorded one; needs at least two months of history.
+        """
+        months, _, _, net = self.monthly_series()
+        if months.size < 2:
+            return {'months': [], 'net': np.zeros(0), 'balance': np.zeros(0)}
+
+        x = np.arange(months.size)
+        slope, intercept = np.polyfit(x, net, 1)
+        future_x = np.arange(months.size, months.size + months_ahead)
+        projected = slope * future_x + intercept
+        balance = self.amounts.sum() + np.cumsum(projected)
+        future_months = months[-1] + np.arange(1, months_ahead + 1)
+        return {
+            'months': [str(month) for month in future_months],
+            'net': projected / 100,
+            'balance': balance / 100,
+        }
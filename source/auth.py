@@ -1,10 +1,10 @@
 import sys
 import hashlib
-from source.database import Database
+from source.database import get_database
 
 class AuthManager:
-    def __init__(self):
-        self.db = Database()
+    def __init__(self, db=None):
+        self.db = db or get_database()
     
     def _get_password(self, prompt="Password: "):
         password = []
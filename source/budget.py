@@ -1,11 +1,52 @@
-from source.database import Database
+from source.categories import CategoryManager, canonical_category
+from source.database import get_database
 from datetime import datetime
 from decimal import Decimal
+from source.money import to_cents, from_cents
+from source.periods import month_range
+
+WARNING_RATIO = Decimal('0.8')
+
+# (category_id, id of it or any subcategory below it), for the categories
+# in `roots`; a parent's budget covers spending in all its subcategories
+SUBTREE_CTE = '''WITH RECURSIVE subtree(root, category_id) AS (
+                    SELECT id, id FROM categories WHERE {roots}
+                    UNION ALL
+                    SELECT subtree.root, c.id FROM subtree
+                    JOIN categories c ON c.parent_id = subtree.category_id
+                )'''
+
+
+def format_budget_alerts(statuses):
+    """Render evaluate_budgets() results as the lines check_budgets shows."""
+    alerts = []
+    for status in statuses:
+        category = status['category']
+        if status['status'] == 'exceeded':
+            alerts.append(
+                f"{category}: EXCEEDED by ${-status['remaining']:.2f} "
+                f"(Budget: ${status['budget']:.2f}, Spent: ${status['spent']:.2f})"
+            )
+        elif status['status'] == 'warning':
+            alerts.append(
+                f"{category}: WARNING - Nearing limit. "
+                f"(${status['remaining']:.2f} remaining)"
+            )
+        else:
+            alerts.append(
+                f"{category}: Within budget. "
+                f"(${status['remaining']:.2f} remaining)"
+            )
+
+    if statuses and all(status['status'] == 'ok' for status in statuses):
+        alerts.append("All budgets are within limits!")
+    return alerts
+
 
 class BudgetManager:
-    def __init__(self, user_id):
+    def __init__(self, user_id, db=None):
         self.user_id = user_id
-        self.db = Database()
+        self.db = db or get_database()
 
     def set_budget(self, category, amount, month=None, year=None):
         try:
@@ -13,8 +54,8 @@ class BudgetManager:
             if not category:
                 raise ValueError("Category cannot be empty.")
             
-            amount = Decimal(str(amount)).quantize(Decimal('0.00'))
-            if amount <= Decimal('0'):
+            cents = to_cents(amount)
+            if cents <= 0:
                 raise ValueError("Amount must be positive.")
             
             month = month if month is not None else datetime.now().month
@@ -24,23 +65,25 @@ class BudgetManager:
                 raise ValueError("Month must be between 1 and 12.")
 
             with self.db._get_cursor() as cursor:
+                category_id = CategoryManager(self.user_id, self.db).resolve(
+                    cursor, [category])[category]
                 exists = cursor.execute('''SELECT 1 from budget WHERE 
-                                        user_id = ? AND category = ? 
+                                        user_id = ? AND category_id = ? 
                                         AND month = ? AND year = ?''', 
-                                        (self.user_id, category, month, year)).fetchone()
+                                        (self.user_id, category_id, month, year)).fetchone()
                 
                 if exists:
                     cursor.execute('''UPDATE budget SET amount = ? 
-                                    WHERE user_id = ? AND category = ? 
+                                    WHERE user_id = ? AND category_id = ? 
                                     AND month = ? AND year = ?''', 
-                                    (str(amount), self.user_id, category, month, year))
+                                    (cents, self.user_id, category_id, month, year))
                     print(f"Updated budget for {category} ({month}/{year}).")
 
                 else:
                     cursor.execute('''INSERT INTO budget 
-                                    (user_id, category, amount, month, year) 
+                                    (user_id, category_id, amount, month, year) 
                                     VALUES (?, ?, ?, ?, ?)''', 
-                                    (self.user_id, category, str(amount), month, year))
+                                    (self.user_id, category_id, cents, month, year))
                     print(f"Created new budget for {category} ({month}/{year}).")
                 
             print("Budget set successfully.")
@@ -57,80 +100,99 @@ class BudgetManager:
     
     def check_budgets(self, month=None, year=None):
         try:
-            month = month or datetime.now().month
-            year = year or datetime.now().year
-
-            alerts = []
-            budgets = self.get_budgets(month, year)
+            statuses = self.evaluate_budgets(month, year)
 
-            if not budgets:
+            if not statuses:
                 return ["No budgets set for this period."]
 
-            any_exceeded = False
-            any_warnings = False
-
-            for budget in budgets:
-                category = budget['category']
-                spent = abs(Decimal(str(self.get_category_spending(category, month, year))))
-                budget_amount = Decimal(str(budget['amount']))
-                remaining = budget_amount - spent
-
-                if spent > budget_amount:
-                    alerts.append(
-                        f"{category}: EXCEEDED by ${(spent - budget_amount):.2f} "
-                        f"(Budget: ${budget_amount:.2f}, Spent: ${spent:.2f})"
-                    )
-                    any_exceeded = True
-                elif spent > Decimal('0.8') * budget_amount:
-                    alerts.append(
-                        f"{category}: WARNING - Nearing limit. "
-                        f"(${remaining:.2f} remaining)"
-                    )
-                    any_warnings = True
-                else:
-                    alerts.append(
-                        f"{category}: Within budget. "
-                        f"(${remaining:.2f} remaining)"
-                    )
-
-            if not any_exceeded and not any_warnings:
-                alerts.append("All budgets are within limits!")
-            
-            return alerts
+            return format_budget_alerts(statuses)
 
         except Exception as error:
             return [f"ERROR: Budget check failed - {str(error)}"]
+
+
+    def evaluate_budgets(self, month=None, year=None):
+        """Return spending against every budget of the period in one query.
+
+        Each entry is a dict with category, budget, spent, remaining and a
+        status of 'ok', 'warning' (over WARNING_RATIO of the budget) or
+        'exceeded'. Spending in subcategories counts against the budget.
+        """
+        month = month or datetime.now().month
+        year = year or datetime.now().year
+        start_date, next_start = month_range(month, year)
+
+        roots = '''id IN (SELECT category_id FROM budget
+                          WHERE user_id = ? AND month = ? AND year = ?)'''
+        with self.db._get_cursor() as cursor:
+            source = self.db.transactions_source(cursor, start_date, next_start)
+            results = cursor.execute(SUBTREE_CTE.format(roots=roots) + f'''
+                SELECT c.name, b.amount, COALESCE(-SUM(t.amount), 0)
+                FROM budget b
+                JOIN categories c ON c.id = b.category_id
+                JOIN subtree s ON s.root = b.category_id
+                LEFT JOIN {source} t
+                    ON t.user_id = b.user_id
+                    AND t.type = 'expense'
+                    AND t.category_id = s.category_id
+                    AND t.date >= ? AND t.date < ?
+                WHERE b.user_id = ? AND b.month = ? AND b.year = ?
+                GROUP BY b.id
+                ORDER BY c.key
+                ''',
+                (self.user_id, month, year, start_date, next_start, self.user_id, month, year)
+            ).fetchall()
+
+        statuses = []
+        for category, budget_cents, spent_cents in results:
+            budget_amount = from_cents(budget_cents)
+            spent = from_cents(spent_cents)
+            if spent > budget_amount:
+                status = 'exceeded'
+            elif spent > WARNING_RATIO * budget_amount:
+                status = 'warning'
+            else:
+                status = 'ok'
+            statuses.append({
+                'category': category,
+                'budget': budget_amount,
+                'spent': spent,
+                'remaining': budget_amount - spent,
+                'status': status
+            })
+        return statuses
             
 
     def get_budgets(self, month, year):
         with self.db._get_cursor() as cursor:
             results = cursor.execute('''
-                SELECT category, amount 
-                FROM budget
-                WHERE user_id = ? AND month = ? AND year = ?
+                SELECT c.name, b.amount 
+                FROM budget b JOIN categories c ON c.id = b.category_id
+                WHERE b.user_id = ? AND b.month = ? AND b.year = ?
                 ''',
                 (self.user_id, month, year)
             ).fetchall()
 
             return [{
                 'category': row[0],
-                'amount': Decimal(str(row[1]))
+                'amount': from_cents(row[1])
             } for row in results]
 
     def get_category_spending(self, category, month, year):
-        start_date = f"{year}-{month:02d}-01"
-        end_date = f"{year}-{month:02d}-31"
+        start_date, next_start = month_range(month, year)
 
         with self.db._get_cursor() as cursor:
-            result = cursor.execute('''
+            source = self.db.transactions_source(cursor, start_date, next_start)
+            result = cursor.execute(SUBTREE_CTE.format(roots="user_id = ? AND key = ?") + f'''
                 SELECT COALESCE(SUM(amount), 0)
-                FROM transactions 
+                FROM {source} AS transactions 
                 WHERE user_id = ? 
                 AND type = 'expense'
-                AND category = ? 
-                AND date BETWEEN ? AND ?
+                AND category_id IN (SELECT category_id FROM subtree) 
+                AND date >= ? AND date < ?
                 ''',
-                (self.user_id, category, start_date, end_date)
+                (self.user_id, canonical_category(category), self.user_id,
+                 start_date, next_start)
             ).fetchone()
             
-            return Decimal(str(result[0]))  # Ensure Decimal return type
\ No newline at end of file
+            return from_cents(result[0])
\ No newline at end of file
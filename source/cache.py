@@ -0,0 +1,94 @@
+"""In-process report cache with per-user data versions.
+
+Cached values are tagged with the user's data version at the time they were
+computed. TransactionManager bumps the version on every insert and delete,
+so a stale entry is never returned; entries are also evicted LRU-first once
+the cache is full.
+"""
+import functools
+import threading
+from collections import OrderedDict
+
+REPORT_CACHE_SIZE = 512
+
+
+class LRUCache:
+    def __init__(self, maxsize=REPORT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+_generation = 0
+
+
+def data_version(db, user_id):
+    """Return the current data version for a user of a Database."""
+    return _generation, _versions.get((db.pool, user_id), 0)
+
+
+def bump_data_version(db, user_id):
+    """Mark a user's data as changed, invalidating their cached reports."""
+    with _versions_lock:
+        key = (db.pool, user_id)
+        _versions[key] = _versions.get(key, 0) + 1
+
+
+def invalidate_all():
+    """Invalidate every cached report, e.g. after restoring a backup."""
+    global _generation
+    with _versions_lock:
+        _generation += 1
+
+
+report_cache = LRUCache()
+
+
+def cached_report(method):
+    """Memoize a ReportGenerator method per (user, report, arguments).
+
+    The version also carries the pool's external_version, built from
+    SQLite's per-connection PRAGMA data_version, so commits made by other
+    connections or processes invalidate entries as well. Cached results
+    are shared between callers and must be treated as read-only.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.db._get_cursor() as cursor:
+            external = self.db.pool.external_version(cursor)
+        version = (data_version(self.db, self.user_id), external)
+        key = (self.db.pool, self.user_id, method.__name__, args,
+               tuple(sorted(kwargs.items())))
+
+        entry = report_cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        result = method(self, *args, **kwargs)
+        report_cache.put(key, (version, result))
+        return result
+
+    return wrapper
@@ -0,0 +1,128 @@
+"""Per-user categories with canonical names and an optional hierarchy.
+
+Transactions and budgets reference a category by integer id. Names are
+matched on their canonical key (whitespace collapsed, case folded), so
+"Food" and "food " are one category, displayed with the spelling first
+used. A category may have a parent; reports and budgets can roll a
+category's subcategories up into it.
+"""
+from source.cache import bump_data_version
+from source.database import get_database
+
+
+def display_name(name):
+    return ' '.join(str(name or '').split())
+
+
+def canonical_category(name):
+    """Key categories are matched on; '' means uncategorized."""
+    return display_name(name).casefold()
+
+
+class CategoryManager:
+    def __init__(self, user_id, db=None):
+        self.user_id = user_id
+        self.db = db or get_database()
+
+    def resolve(self, cursor, names):
+        """Map each name to its category id inside an open write cursor.
+
+        Unknown categories are created, named after their first spelling
+        in `names`; blank names map to None.
+        """
+        ids = {}
+        for name in dict.fromkeys(names):
+            key = canonical_category(name)
+            if not key:
+                ids[name] = None
+                continue
+            row = cursor.execute("SELECT id FROM categories WHERE user_id = ? AND key = ?",
+                                 (self.user_id, key)).fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO categories (user_id, name, key) VALUES (?, ?, ?)",
+                               (self.user_id, display_name(name), key))
+                ids[name] = cursor.lastrowid
+            else:
+                ids[name] = row[0]
+        return ids
+
+    def get_categories(self):
+        """Every category as {id, name, parent}, sorted by name."""
+        with self.db._get_cursor() as cursor:
+            rows = cursor.execute('''SELECT c.id, c.name, p.name
+                                     FROM categories c
+                                     LEFT JOIN categories p ON p.id = c.parent_id
+                                     WHERE c.user_id = ?
+                                     ORDER BY c.key''', (self.user_id,)).fetchall()
+        return [{'id': row[0], 'name': row[1], 'parent': row[2]} for row in rows]
+
+    def root_names(self):
+        """{name: name of its top-level ancestor} for every category."""
+        with self.db._get_cursor() as cursor:
+            rows = cursor.execute('''
+                WITH RECURSIVE tree(id, root) AS (
+                    SELECT id, name FROM categories
+                    WHERE user_id = ? AND parent_id IS NULL
+                    UNION ALL
+                    SELECT c.id, tree.root FROM categories c JOIN tree ON c.parent_id = tree.id
+                )
+                SELECT c.name, tree.root FROM tree JOIN categories c ON c.id = tree.id
+                ''', (self.user_id,)).fetchall()
+        return dict(rows)
+
+    def set_parent(self, name, parent=None):
+        """Make name a subcategory of parent (None: a top-level category)."""
+        try:
+            with self.db._get_cursor() as cursor:
+                category_id = self._existing_id(cursor, name)
+                parent_id = None
+                if parent:
+                    parent_id = self.resolve(cursor, [parent])[parent]
+                    ancestor = parent_id
+                    while ancestor is not None:
+                        if ancestor == category_id:
+                            raise ValueError(f"{parent} is already under {name}.")
+                        ancestor = cursor.execute("SELECT parent_id FROM categories WHERE id = ?",
+                                                  (ancestor,)).fetchone()[0]
+                cursor.execute("UPDATE categories SET parent_id = ? WHERE id = ?",
+                               (parent_id, category_id))
+            bump_data_version(self.db, self.user_id)
+            print(f"{display_name(name)} is now under {display_name(parent)}." if parent
+                  else f"{display_name(name)} is now a top-level category.")
+            return True
+
+        except ValueError as error:
+            print(f"Error: {error}")
+            return False
+
+    def rename(self, name, new_name):
+        """Rename a category; the new name may only differ in spelling or
+        be unused, since two categories cannot share a key."""
+        try:
+            new_key = canonical_category(new_name)
+            if not new_key:
+                raise ValueError("Category cannot be empty.")
+            with self.db._get_cursor() as cursor:
+                category_id = self._existing_id(cursor, name)
+                clash = cursor.execute('''SELECT 1 FROM categories
+                                          WHERE user_id = ? AND key = ? AND id != ?''',
+                                       (self.user_id, new_key, category_id)).fetchone()
+                if clash:
+                    raise ValueError(f"A category named {display_name(new_name)} already exists.")
+                cursor.execute("UPDATE categories SET name = ?, key = ? WHERE id = ?",
+                               (display_name(new_name), new_key, category_id))
+            bump_data_version(self.db, self.user_id)
+            print(f"Renamed {display_name(name)} to {display_name(new_name)}.")
+            return True
+
+        except ValueError as error:
+            print(f"Error: {error}")
+            return False
+
+    def _existing_id(self, cursor, name):
+        row = cursor.execute("SELECT id FROM categories WHERE user_id = ? AND key = ?",
+                             (self.user_id, canonical_category(name))).fetchone()
+        if row is None:
+            raise ValueError(f"No category named {display_name(name)!r}.")
+        return row[0]
+
@@ -0,0 +1,529 @@
+"""Non-interactive command line interface.
+
+    python main.py [--db PATH] [--format json|csv] COMMAND ...
+
+Commands authenticate with an API token (FINANCE_TOKEN or --token, issued
+by `python main.py token`) or with FINANCE_USER and FINANCE_PASSWORD, so
+they can run from scripts and cron without the menu or a password prompt.
+Only the modules a command needs are imported, to keep cold start fast.
+"""
+import argparse
+import os
+import sys
+
+
+class CLIError(Exception):
+    pass
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, 'handler', None):
+        parser.print_help()
+        return 2
+
+    try:
+        result = args.handler(args)
+    except CLIError as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    if result is not None:
+        emit(result, args.format)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='main.py', description="Personal Finance Manager")
+    parser.add_argument('--db', default=os.environ.get('FINANCE_DB'),
+                        help="database file (default: $FINANCE_DB or finance.db)")
+    parser.add_argument('--token', default=os.environ.get('FINANCE_TOKEN'),
+                        help="API token (default: $FINANCE_TOKEN)")
+    parser.add_argument('--format', choices=('json', 'csv'), default='json',
+                        help="output format")
+    commands = parser.add_subparsers(title='commands', metavar='COMMAND')
+
+    token = commands.add_parser('token', help="issue an API token (prompts for password)")
+    token.add_argument('username')
+    token.set_defaults(handler=cmd_token)
+
+    add = commands.add_parser('add', help="record a transaction")
+    add.add_argument('type', choices=('income', 'expense'))
+    add.add_argument('category')
+    add.add_argument('amount')
+    add.add_argument('--date', help="YYYY-MM-DD (default: today)")
+    add.add_argument('--description', default='')
+    add.set_defaults(handler=cmd_add)
+
+    listing = commands.add_parser('list', help="list transactions, newest first")
+    listing.add_argument('--limit', type=int, default=50)
+    listing.add_argument('--after', help="cursor from a previous page (DATE:ID)")
+    listing.add_argument('--type', dest='trans_type', choices=('income', 'expense'))
+    listing.add_argument('--category')
+    listing.add_argument('--min', dest='min_amount')
+    listing.add_argument('--max', dest='max_amount')
+    listing.add_argument('--from', dest='start_date')
+    listing.add_argument('--to', dest='end_date')
+    listing.set_defaults(handler=cmd_list)
+
+    search = commands.add_parser('search', help="full-text search, best matches first")
+    search.add_argument('query', help='words, "exact phrases" and prefix* terms')
+    search.add_argument('--limit', type=int, default=50)
+    search.add_argument('--type', dest='trans_type', choices=('income', 'expense'))
+    search.add_argument('--category')
+    search.add_argument('--min', dest='min_amount')
+    search.add_argument('--max', dest='max_amount')
+    search.add_argument('--from', dest='start_date')
+    search.add_argument('--to', dest='end_date')
+    search.set_defaults(handler=cmd_search)
+
+    report = commands.add_parser('report', help="financial reports")
+    report.add_argument('kind', choices=('monthly', 'quarterly', 'yearly', 'custom',
+                                         'categories', 'balance', 'trends'))
+    report.add_argument('--month', type=int)
+    report.add_argument('--quarter', type=int, choices=(1, 2, 3, 4))
+    report.add_argument('--year', type=int)
+    report.add_argument('--from', dest='start_date', help="custom, balance: first day (YYYY-MM-DD)")
+    report.add_argument('--to', dest='end_date', help="custom, balance: last day, inclusive")
+    report.add_argument('--rollup', action='store_true',
+                        help="categories: add subcategories into their top-level category")
+    report.add_argument('--on', dest='on_date',
+                        help="balance: balance at the end of this day (default: all to date)")
+    report.add_argument('--step', choices=('day', 'week', 'month'), default='month',
+                        help="balance with --from/--to: one point per step (default month)")
+    report.set_defaults(handler=cmd_report)
+
+    categories = commands.add_parser('categories', help="list, nest or rename categories")
+    categories.add_argument('action', choices=('list', 'parent', 'rename'))
+    categories.add_argument('name', nargs='?')
+    categories.add_argument('target', nargs='?',
+                            help="parent: new parent (omit for top level); rename: new name")
+    categories.set_defaults(handler=cmd_categories)
+
+    budget = commands.add_parser('budget', help="set or check budgets")
+    budget.add_argument('action', choices=('set', 'check'))
+    budget.add_argument('category', nargs='?')
+    budget.add_argument('amount', nargs='?')
+    budget.add_argument('--month', type=int)
+    budget.add_argument('--year', type=int)
+    budget.set_defaults(handler=cmd_budget)
+
+    export = commands.add_parser('export', help="export transactions to CSV")
+    export.add_argument('filename')
+    export.add_argument('--from', dest='start_date')
+    export.add_argument('--to', dest='end_date')
+    export.add_argument('--columns', help="comma-separated column list")
+    export.add_argument('--gzip', action='store_true', default=None)
+    export.set_defaults(handler=cmd_export)
+
+    importer = commands.add_parser('import', help="import bank statement files")
+    importer.add_argument('files', nargs='+')
+    importer.add_argument('--statement-format', dest='file_format',
+                          help="override format detection (csv, ofx, qif)")
+    importer.add_argument('--date-order', choices=('mdy', 'dmy'),
+                          help="how to read slashed dates (default: detect per file)")
+    importer.set_defaults(handler=cmd_import)
+
+    backup = commands.add_parser('backup', help="take an online backup")
+    backup.add_argument('filename', nargs='?')
+    backup.add_argument('--compress', action='store_true')
+    backup.add_argument('--keep', type=int, default=5)
+    backup.set_defaults(handler=cmd_backup)
+
+    archive = commands.add_parser('archive',
+                                  help="move closed years into per-year archive files")
+    archive.add_argument('--before', type=int,
+                         help="archive years before this one (default: the current year)")
+    archive.add_argument('--vacuum', action='store_true',
+                         help="shrink the main database file afterwards")
+    archive.set_defaults(handler=cmd_archive)
+
+    restore = commands.add_parser('restore', help="restore the database from a backup")
+    restore.add_argument('filename', nargs='?')
+    restore.set_defaults(handler=cmd_restore)
+
+    serve = commands.add_parser('serve', help="run the local HTTP/JSON API server")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--workers', type=int)
+    serve.add_argument('--max-pending', type=int)
+    serve.set_defaults(handler=cmd_serve)
+
+    stats = commands.add_parser('stats',
+                                help="profile the report, budget and listing queries")
+    stats.add_argument('--month', type=int)
+    stats.add_argument('--year', type=int)
+    stats.add_argument('--repeat', type=int, default=3)
+    stats.add_argument('--slow-ms', type=float, help="slow-query threshold (default: 100)")
+    stats.add_argument('--slow-log', help="append slow statements and their plans here")
+    stats.set_defaults(handler=cmd_stats)
+
+    statements = commands.add_parser('statements',
+                                     help="write monthly statements for every user")
+    statements.add_argument('--month', type=int)
+    statements.add_argument('--year', type=int)
+    statements.add_argument('--out', default='statements', help="output directory")
+    statements.add_argument('--statement-format', dest='fmt', choices=('txt', 'csv', 'json'),
+                            default='txt')
+    statements.add_argument('--workers', type=int)
+    statements.add_argument('--chunk-size', type=int)
+    statements.set_defaults(handler=cmd_statements)
+
+    return parser
+
+
+# --- helpers ----------------------------------------------------------------
+
+def open_db(args):
+    from source.database import get_database
+    return get_database(args.db)
+
+
+def authenticate(args, db):
+    """Resolve the acting user from a token or FINANCE_USER/FINANCE_PASSWORD."""
+    if args.token:
+        user_id = db.user_for_token(args.token)
+        if user_id is None:
+            raise CLIError("invalid API token")
+        return user_id
+
+    username = os.environ.get('FINANCE_USER')
+    password = os.environ.get('FINANCE_PASSWORD')
+    if username and password:
+        import hashlib
+        if db.verify_user(username, hashlib.sha256(password.encode()).hexdigest()):
+            return db.get_user_id(username)
+        raise CLIError("invalid credentials")
+
+    raise CLIError("set FINANCE_TOKEN (see 'main.py token') or FINANCE_USER and FINANCE_PASSWORD")
+
+
+def quietly(function, *args, **kwargs):
+    """Call a manager method, sending its status messages to stderr."""
+    from contextlib import redirect_stdout
+    with redirect_stdout(sys.stderr):
+        return function(*args, **kwargs)
+
+
+def check_month(month):
+    if month is not None and not 1 <= month <= 12:
+        raise ValueError("Month must be between 1 and 12.")
+
+
+def emit(data, fmt):
+    if fmt == 'csv':
+        import csv
+        writer = csv.writer(sys.stdout)
+        rows = data if isinstance(data, list) else [data]
+        if rows and isinstance(rows[0], dict):
+            writer.writerow(rows[0].keys())
+            writer.writerows([_plain(value) for value in row.values()] for row in rows)
+        else:
+            writer.writerows(rows)
+    else:
+        import json
+        json.dump(data, sys.stdout, default=_plain, indent=2)
+        sys.stdout.write('\n')
+
+
+def _plain(value):
+    """JSON/CSV fallback: Decimals as strings, NumPy arrays as lists."""
+    if hasattr(value, 'tolist'):
+        return [None if item != item else item for item in value.tolist()]  # NaN -> null
+    if isinstance(value, (list, tuple, dict)):
+        return value
+    return str(value)
+
+
+# --- commands ---------------------------------------------------------------
+
+def cmd_token(args):
+    import getpass
+    import hashlib
+    db = open_db(args)
+    password = os.environ.get('FINANCE_PASSWORD') or getpass.getpass("Password: ")
+    if not db.verify_user(args.username, hashlib.sha256(password.encode()).hexdigest()):
+        raise CLIError("invalid credentials")
+    return {'token': db.create_token(db.get_user_id(args.username))}
+
+
+def cmd_add(args):
+    from source.transactions import TransactionManager
+    db = open_db(args)
+    manager = TransactionManager(authenticate(args, db), db)
+    result = manager.add_transactions([(args.type, args.category, args.amount,
+                                        args.date, args.description)])
+    if result['errors']:
+        raise CLIError(result['errors'][0][1])
+    return {'inserted': result['inserted']}
+
+
+def cmd_list(args):
+    from source.transactions import TransactionManager
+    db = open_db(args)
+    manager = TransactionManager(authenticate(args, db), db)
+
+    after = None
+    if args.after:
+        date, _, trans_id = args.after.rpartition(':')
+        if not date or not trans_id.isdigit():
+            raise CLIError("--after must look like DATE:ID")
+        after = (date, int(trans_id))
+    try:
+        rows, cursor = manager.get_transactions_page(
+            after=after, limit=args.limit, trans_type=args.trans_type,
+            category=args.category, min_amount=args.min_amount,
+            max_amount=args.max_amount, start_date=args.start_date,
+            end_date=args.end_date)
+    except (ValueError, ArithmeticError) as error:
+        raise CLIError(str(error))
+
+    transactions = [row.to_dict() for row in rows]
+    if args.format == 'csv':
+        return transactions
+    return {
+        'transactions': transactions,
+        'next': f"{cursor[0]}:{cursor[1]}" if cursor else None,
+    }
+
+
+def cmd_search(args):
+    from source.transactions import TransactionManager
+    db = open_db(args)
+    manager = TransactionManager(authenticate(args, db), db)
+    try:
+        rows = manager.search(args.query, limit=args.limit, trans_type=args.trans_type,
+                              category=args.category, min_amount=args.min_amount,
+                              max_amount=args.max_amount, start_date=args.start_date,
+                              end_date=args.end_date)
+    except (ValueError, ArithmeticError) as error:
+        raise CLIError(str(error))
+    return [row.to_dict() for row in rows]
+
+
+def cmd_report(args):
+    from datetime import datetime
+    db = open_db(args)
+    user_id = authenticate(args, db)
+    now = datetime.now()
+    year = args.year or now.year
+
+    if args.kind == 'trends':
+        try:
+            from source.analytics import Analytics
+        except ImportError:
+            raise CLIError("trend reports require numpy (pip install numpy)")
+        analytics = Analytics(user_id, db)
+        analytics.load()
+        return {'trends': analytics.trends(), 'forecast': analytics.forecast()}
+
+    from source.periods import parse_date, quarter_of
+    from source.reports import ReportGenerator
+    reports = ReportGenerator(user_id, db)
+    try:
+        check_month(args.month)
+    except ValueError as error:
+        raise CLIError(str(error))
+    if args.kind == 'monthly':
+        return reports.monthly_salary(args.month or now.month, year)
+    if args.kind == 'quarterly':
+        return reports.quarterly_report(args.quarter or quarter_of(now.month), year)
+    if args.kind == 'yearly':
+        return reports.yearly_salary(year)
+    if args.kind == 'custom':
+        if not args.start_date or not args.end_date:
+            raise CLIError("custom reports need --from and --to")
+        try:
+            return reports.custom_report(args.start_date, args.end_date)
+        except ValueError as error:
+            raise CLIError(str(error))
+    if args.kind == 'categories':
+        # A month alone means that month this year, as for the other kinds
+        return reports.category_breakdown(args.month, year if args.month else args.year,
+                                          rollup=args.rollup)
+    try:
+        if args.start_date or args.end_date:
+            if not args.start_date or not args.end_date:
+                raise CLIError("a balance history needs --from and --to")
+            return [{'date': day, 'balance': balance} for day, balance
+                    in reports.balance_series(args.start_date, args.end_date, args.step)]
+        if args.on_date:
+            return {'date': parse_date(args.on_date), 'balance': reports.balance_at(args.on_date)}
+    except ValueError as error:
+        raise CLIError(str(error))
+    return {'balance': reports.get_total()}
+
+
+def cmd_categories(args):
+    from source.categories import CategoryManager
+    db = open_db(args)
+    manager = CategoryManager(authenticate(args, db), db)
+
+    if args.action == 'list':
+        return manager.get_categories()
+    if not args.name:
+        raise CLIError(f"categories {args.action} needs a category NAME")
+    if args.action == 'parent':
+        if not quietly(manager.set_parent, args.name, args.target):
+            raise CLIError("category could not be moved")
+        return {'category': args.name, 'parent': args.target}
+    if not args.target:
+        raise CLIError("categories rename needs NAME and NEW_NAME")
+    if not quietly(manager.rename, args.name, args.target):
+        raise CLIError("category could not be renamed")
+    return {'category': args.target}
+
+
+def cmd_budget(args):
+    from source.budget import BudgetManager
+    db = open_db(args)
+    manager = BudgetManager(authenticate(args, db), db)
+
+    try:
+        check_month(args.month)
+        if args.action == 'set':
+            if not args.category or not args.amount:
+                raise CLIError("budget set needs CATEGORY and AMOUNT")
+            if not quietly(manager.set_budget, args.category, args.amount, args.month, args.year):
+                raise CLIError("budget could not be saved")
+            return {'category': args.category, 'amount': args.amount}
+        return manager.evaluate_budgets(args.month, args.year)
+    except (ValueError, ArithmeticError) as error:
+        raise CLIError(str(error))
+
+
+def cmd_export(args):
+    db = open_db(args)
+    user_id = authenticate(args, db)
+    columns = args.columns.split(',') if args.columns else None
+    try:
+        written = quietly(db.export_transactions, user_id, args.filename,
+                          start_date=args.start_date, end_date=args.end_date,
+                          columns=columns, compress=args.gzip)
+    except (ValueError, OSError) as error:
+        raise CLIError(str(error))
+    return {'filename': args.filename, 'rows': written}
+
+
+def cmd_import(args):
+    from source.importer import Importer
+    db = open_db(args)
+    importer = Importer(authenticate(args, db), db)
+    results = []
+    for path in args.files:
+        try:
+            result = importer.import_file(path, args.file_format,
+                                          date_order=args.date_order)
+        except (OSError, ValueError) as error:
+            raise CLIError(f"{path}: {error}")
+        results.append({'file': path, 'inserted': result['inserted'],
+                        'duplicates': result['duplicates'],
+                        'errors': [{'record': index, 'message': message}
+                                   for index, message in result['errors']]})
+    return results
+
+
+def cmd_backup(args):
+    db = open_db(args)
+    authenticate(args, db)
+    filename = quietly(db.backup_data, args.filename, compress=args.compress, keep=args.keep)
+    return {'backup': filename}
+
+
+def cmd_archive(args):
+    import sqlite3
+    db = open_db(args)
+    authenticate(args, db)
+    try:
+        moved = quietly(db.archive_before, args.before, vacuum=args.vacuum)
+    except (ValueError, sqlite3.Error) as error:
+        raise CLIError(str(error))
+    return [{'year': year, 'moved': rows, 'archive': db.archive_path(year)}
+            for year, rows in moved.items()]
+
+
+def cmd_restore(args):
+    db = open_db(args)
+    authenticate(args, db)
+    if not quietly(db.restore_data, args.filename):
+        raise CLIError("restore failed")
+    return {'restored': args.filename or f"{db.db_path}.backup"}
+
+
+def cmd_stats(args):
+    """Run the read paths for the current user and report per-statement timings."""
+    from calendar import monthrange
+    from datetime import datetime
+    from source.periods import quarter_of
+    from source.budget import BudgetManager
+    from source.cache import report_cache
+    from source.querystats import query_stats
+    from source.reports import ReportGenerator
+    from source.transactions import TransactionManager
+    db = open_db(args)
+    user_id = authenticate(args, db)
+    try:
+        check_month(args.month)
+    except ValueError as error:
+        raise CLIError(str(error))
+    now = datetime.now()
+    month, year = args.month or now.month, args.year or now.year
+
+    reports = ReportGenerator(user_id, db)
+    budgets = BudgetManager(user_id, db)
+    transactions = TransactionManager(user_id, db)
+    query_stats.reset()
+    query_stats.enable(args.slow_ms, args.slow_log)
+    try:
+        for _ in range(args.repeat):
+            report_cache.clear()   # measure the queries, not cache hits
+            reports.monthly_salary(month, year)
+            reports.yearly_salary(year)
+            reports.category_breakdown(month, year)
+            reports.quarterly_report(quarter_of(month), year)
+            reports.get_positive_total(f"{year}-01-01", f"{year}-12-31")
+            reports.get_total()
+            budgets.check_budgets(month, year)
+            transactions.get_transactions_page()
+            transactions.get_transactions(f"{year}-{month:02d}-01",
+                                          f"{year}-{month:02d}-{monthrange(year, month)[1]}")
+    finally:
+        query_stats.disable()
+    return query_stats.snapshot()
+
+
+def cmd_statements(args):
+    from datetime import datetime
+    from source import statements
+    now = datetime.now()
+    options = {}
+    if args.workers:
+        options['workers'] = args.workers
+    if args.chunk_size:
+        options['chunk_size'] = args.chunk_size
+
+    def report(done, total):
+        print(f"\rStatements: {done}/{total} users", end='', file=sys.stderr, flush=True)
+
+    try:
+        result = statements.generate_statements(args.db, args.month or now.month,
+                                                args.year or now.year, args.out, args.fmt,
+                                                progress=report, **options)
+    except (ValueError, OSError) as error:
+        raise CLIError(str(error))
+    print(file=sys.stderr)
+    return {'users': result['users'], 'written': result['written'], 'out': args.out,
+            'failures': [{'user': user, 'message': message}
+                         for user, message in result['failures']]}
+
+
+def cmd_serve(args):
+    from source import server
+    argv = ['--host', args.host, '--port', str(args.port)]
+    if args.db:
+        argv += ['--db', args.db]
+    if args.workers:
+        argv += ['--workers', str(args.workers)]
+    if args.max_pending:
+        argv += ['--max-pending', str(args.max_pending)]
+    server.main(argv)
@@ -1,50 +1,772 @@
 from contextlib import contextmanager
+import os
 import sqlite3
+import sys
+import threading
+from urllib.parse import quote
+from source.cache import invalidate_all
+from source.money import from_cents
+from source.periods import custom_range, year_range
+from source.querystats import TimedCursor, query_stats
+
+WRITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+)
+PRAGMAS = (
+    "PRAGMA cache_size=-16000",      # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+)
+
+STATEMENT_CACHE_SIZE = 256
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_HEADERS = {
+    'id': 'ID',
+    'type': 'Type',
+    'category': 'Category',
+    'amount': 'Amount',
+    'date': 'Date',
+    'description': 'Description',
+}
+DEFAULT_EXPORT_COLUMNS = ('type', 'category', 'amount', 'date', 'description')
+EXPORT_EXPRESSIONS = {'category': "COALESCE(c.name, '')"}   # others are t.<column>
+
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_MAX_RESTARTS = 3
+BACKUP_KEEP = 5
+
+# Closed years can be moved to one archive file per year (archive_year).
+# Archives hold a copy of the transactions table without triggers or the
+# search index; queries attach the ones their date range needs.
+ARCHIVE_COLUMNS = 'id, user_id, type, category_id, amount, date, description'
+ARCHIVE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS {schema}.transactions
+       (id INTEGER PRIMARY KEY,
+       user_id INTEGER,
+       type TEXT,
+       category_id INTEGER,
+       amount INTEGER NOT NULL,
+       date TEXT NOT NULL,
+       description TEXT)''',
+    '''CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_user_date
+       ON transactions(user_id, date, amount)''',
+    '''CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_user_type_category_date
+       ON transactions(user_id, type, category_id, date, amount)''',
+)
+MAX_ATTACHED_ARCHIVES = 10   # SQLite's default SQLITE_MAX_ATTACHED
+
+# Rebuilds read totals window by window (see transaction_windows) and write
+# them in one go, since archives cannot be attached inside a transaction
+ROLLUP_TOTALS_SQL = '''SELECT user_id, CAST(substr(date, 1, 4) AS INTEGER),
+                  CAST(substr(date, 6, 2) AS INTEGER), type, COALESCE(category_id, 0),
+                  SUM(amount), COUNT(*)
+           FROM {source} AS transactions
+           WHERE user_id IS NOT NULL{where}
+           GROUP BY 1, 2, 3, 4, 5'''
+BALANCE_DAYS_SQL = '''SELECT user_id, date, SUM(amount)
+           FROM {source} AS transactions
+           WHERE user_id IS NOT NULL{where}
+           GROUP BY user_id, date'''
+
+
+def date_filter(start, next_start, column='t.date'):
+    """' AND ...' conditions and params for [start, next_start); None is open."""
+    sql, params = '', []
+    if start:
+        sql += f" AND {column} >= ?"
+        params.append(start)
+    if next_start:
+        sql += f" AND {column} < ?"
+        params.append(next_start)
+    return sql, params
+
+
+def rollup_sql(category, column, delete_when=''):
+    """Triggers and rebuild query keeping monthly_rollup in step with
+    transactions, keyed on the transactions.{category} column as the
+    rollup's {column}. Migrations before 9 keyed on category text;
+    delete_when is an optional WHEN clause for the delete trigger."""
+    missing = "''" if column == 'category' else '0'
+    key = f'''{{row}}.user_id, CAST(substr({{row}}.date, 1, 4) AS INTEGER),
+           CAST(substr({{row}}.date, 6, 2) AS INTEGER), {{row}}.type,
+           COALESCE({{row}}.{category}, {missing})'''
+    add = f'''INSERT INTO monthly_rollup (user_id, year, month, type, {column}, total, count)
+           VALUES ({key.format(row='NEW')}, NEW.amount, 1)
+           ON CONFLICT(user_id, year, month, type, {column})
+           DO UPDATE SET total = total + excluded.total, count = count + 1;'''
+    remove = f'''UPDATE monthly_rollup SET total = total - OLD.amount, count = count - 1
+           WHERE (user_id, year, month, type, {column}) = ({key.format(row='OLD')});
+           DELETE FROM monthly_rollup
+           WHERE (user_id, year, month, type, {column}) = ({key.format(row='OLD')})
+           AND count <= 0;'''
+    triggers = (
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_insert AFTER INSERT ON transactions
+       BEGIN
+           {add}
+       END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_delete AFTER DELETE ON transactions
+       {delete_when}BEGIN
+           {remove}
+       END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_rollup_update
+       AFTER UPDATE OF user_id, type, {category}, amount, date ON transactions
+       BEGIN
+           {remove}
+           {add}
+       END''',
+    )
+    rebuild = f'''INSERT INTO monthly_rollup (user_id, year, month, type, {column}, total, count)
+           SELECT user_id, CAST(substr(date, 1, 4) AS INTEGER),
+                  CAST(substr(date, 6, 2) AS INTEGER), type, COALESCE({category}, {missing}),
+                  SUM(amount), COUNT(*)
+           FROM transactions
+           {{where}}
+           GROUP BY 1, 2, 3, 4, 5'''
+    return triggers, rebuild
+
+
+ROLLUP_TRIGGERS, ROLLUP_REBUILD_SQL = rollup_sql('category', 'category')
+CATEGORY_ROLLUP_TRIGGERS, CATEGORY_ROLLUP_REBUILD_SQL = rollup_sql('category_id', 'category_id')
+
+# Rows moved to an archive keep their totals: the rollup covers all history
+ARCHIVING = "EXISTS (SELECT 1 FROM maintenance WHERE flag = 'archiving')"
+ARCHIVE_ROLLUP_TRIGGERS, _ = rollup_sql('category_id', 'category_id',
+                                        f"WHEN NOT {ARCHIVING}\n       ")
+
+
+# balance_checkpoints holds each user's running balance at the end of every
+# day they have transactions, so the balance on any date is one seek for
+# the last checkpoint on or before it. A row dated d adds its amount to
+# every checkpoint from d on; _insert_batch sets BATCHING and updates the
+# checkpoints (and the search index) once per batch instead of once per row.
+BATCHING = "EXISTS (SELECT 1 FROM maintenance WHERE flag = 'batching')"
+
+BALANCE_SEED_SQL = '''INSERT INTO balance_checkpoints (user_id, day, balance)
+           VALUES ({user}, {day},
+                   COALESCE((SELECT balance FROM balance_checkpoints
+                             WHERE user_id = {user} AND day < {day}
+                             ORDER BY day DESC LIMIT 1), 0))
+           ON CONFLICT(user_id, day) DO NOTHING'''
+
+BALANCE_ADD = f'''{BALANCE_SEED_SQL.format(user='NEW.user_id', day='NEW.date')};
+           UPDATE balance_checkpoints SET balance = balance + NEW.amount
+           WHERE user_id = NEW.user_id AND day >= NEW.date;'''
+
+BALANCE_REMOVE = '''UPDATE balance_checkpoints SET balance = balance - OLD.amount
+           WHERE user_id = OLD.user_id AND day >= OLD.date;'''
+
+BALANCE_TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS trg_balance_insert AFTER INSERT ON transactions
+       WHEN NOT {BATCHING}
+       BEGIN
+           {BALANCE_ADD}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_balance_delete AFTER DELETE ON transactions
+       WHEN NOT {ARCHIVING}
+       BEGIN
+           {BALANCE_REMOVE}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_balance_update
+       AFTER UPDATE OF user_id, amount, date ON transactions
+       BEGIN
+           {BALANCE_REMOVE}
+           {BALANCE_ADD}
+       END''',
+)
+
+BALANCE_REBUILD_SQL = '''INSERT INTO balance_checkpoints (user_id, day, balance)
+           SELECT user_id, date, SUM(SUM(amount)) OVER (PARTITION BY user_id ORDER BY date)
+           FROM transactions
+           WHERE user_id IS NOT NULL {and_where}
+           GROUP BY user_id, date'''
+
+
+# Contentless FTS5 index; rows are read back from transactions. Its rowid
+# is user_id * SEARCH_ROWID_SPAN + id, so one user's entries form a single
+# rowid range in every doclist and a search seeks straight to them.
+SEARCH_ROWID_SPAN = 1 << 32
+
+SEARCH_SCHEMA = (
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+           description, category,
+           content='', prefix='2 3 4', tokenize='unicode61 remove_diacritics 2')''',
+)
+
+SEARCH_ADD = f'''INSERT INTO transactions_fts (rowid, description, category)
+           VALUES (NEW.user_id * {SEARCH_ROWID_SPAN} + NEW.id,
+                   COALESCE(NEW.description, ''), COALESCE(NEW.category, ''));'''
+
+SEARCH_REMOVE = f'''INSERT INTO transactions_fts (transactions_fts, rowid, description, category)
+           VALUES ('delete', OLD.user_id * {SEARCH_ROWID_SPAN} + OLD.id,
+                   COALESCE(OLD.description, ''), COALESCE(OLD.category, ''));'''
+
+SEARCH_TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS trg_search_insert AFTER INSERT ON transactions
+       BEGIN
+           {SEARCH_ADD}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_search_delete AFTER DELETE ON transactions
+       BEGIN
+           {SEARCH_REMOVE}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_search_update
+       AFTER UPDATE OF user_id, description, category ON transactions
+       BEGIN
+           {SEARCH_REMOVE}
+           {SEARCH_ADD}
+       END''',
+)
+
+SEARCH_REBUILD_SQL = f'''INSERT INTO transactions_fts (rowid, description, category)
+           SELECT user_id * {SEARCH_ROWID_SPAN} + id, COALESCE(description, ''),
+                  COALESCE(category, '')
+           FROM transactions'''
+
+
+# Since migration 9 transactions reference a category by id. The index
+# still holds the category's name, and a rename re-indexes its rows.
+SEARCH_CATEGORY = "COALESCE((SELECT name FROM categories WHERE id = {row}.category_id), '')"
+
+CATEGORY_SEARCH_ADD = f'''INSERT INTO transactions_fts (rowid, description, category)
+           VALUES (NEW.user_id * {SEARCH_ROWID_SPAN} + NEW.id,
+                   COALESCE(NEW.description, ''), {SEARCH_CATEGORY.format(row='NEW')});'''
+
+CATEGORY_SEARCH_REMOVE = f'''INSERT INTO transactions_fts (transactions_fts, rowid, description, category)
+           VALUES ('delete', OLD.user_id * {SEARCH_ROWID_SPAN} + OLD.id,
+                   COALESCE(OLD.description, ''), {SEARCH_CATEGORY.format(row='OLD')});'''
+
+CATEGORY_SEARCH_TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS trg_search_insert AFTER INSERT ON transactions
+       BEGIN
+           {CATEGORY_SEARCH_ADD}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_search_delete AFTER DELETE ON transactions
+       BEGIN
+           {CATEGORY_SEARCH_REMOVE}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_search_update
+       AFTER UPDATE OF user_id, description, category_id ON transactions
+       BEGIN
+           {CATEGORY_SEARCH_REMOVE}
+           {CATEGORY_SEARCH_ADD}
+       END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_search_category_rename
+       AFTER UPDATE OF name ON categories
+       BEGIN
+           INSERT INTO transactions_fts (transactions_fts, rowid, description, category)
+           SELECT 'delete', user_id * {SEARCH_ROWID_SPAN} + id, COALESCE(description, ''), OLD.name
+           FROM transactions WHERE category_id = OLD.id;
+           INSERT INTO transactions_fts (rowid, description, category)
+           SELECT user_id * {SEARCH_ROWID_SPAN} + id, COALESCE(description, ''), NEW.name
+           FROM transactions WHERE category_id = NEW.id;
+       END''',
+)
+
+CATEGORY_SEARCH_REBUILD_SQL = f'''INSERT INTO transactions_fts (rowid, description, category)
+           SELECT t.user_id * {SEARCH_ROWID_SPAN} + t.id, COALESCE(t.description, ''),
+                  COALESCE(c.name, '')
+           FROM transactions t LEFT JOIN categories c ON c.id = t.category_id'''
+
+# While BATCHING is set the insert trigger stands aside and _insert_batch
+# indexes the whole batch with one INSERT ... SELECT of the new ids
+BATCH_SEARCH_INSERT_TRIGGER = f'''CREATE TRIGGER IF NOT EXISTS trg_search_insert
+       AFTER INSERT ON transactions
+       WHEN NOT {BATCHING}
+       BEGIN
+           {CATEGORY_SEARCH_ADD}
+       END'''
+
+SEARCH_BATCH_SQL = CATEGORY_SEARCH_REBUILD_SQL + " WHERE t.id > ?"
+
+
+# Date spellings migration 7 can read: ISO dates with or without a time,
+# YYYY/MM/DD, YYYYMMDD and DD.MM.YYYY. Anything else, and impossible days
+# such as 2024-02-30, gives NULL.
+LEGACY_DATE_CANDIDATES = (
+    '''CASE WHEN length(trim(date)) = 10 OR substr(trim(date), 11, 1) IN (' ', 'T')
+       THEN replace(substr(trim(date), 1, 10), '/', '-') END''',
+    '''CASE WHEN trim(date) GLOB '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'
+       THEN substr(trim(date), 1, 4) || '-' || substr(trim(date), 5, 2) || '-'
+            || substr(trim(date), 7, 2) END''',
+    '''CASE WHEN trim(date) GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'
+       THEN substr(trim(date), 7, 4) || '-' || substr(trim(date), 4, 2) || '-'
+            || substr(trim(date), 1, 2) END''',
+)
+LEGACY_DATE_SQL = "COALESCE({})".format(", ".join(
+    f"CASE WHEN date({iso}, '+0 days') IS {iso} THEN {iso} END"
+    for iso in LEGACY_DATE_CANDIDATES))
+
+
+# Schema migrations, applied in order. Entry N upgrades a database from
+# PRAGMA user_version N to N + 1; never edit a migration once released.
+MIGRATIONS = [
+    # 1: base schema
+    [
+        '''CREATE TABLE IF NOT EXISTS users
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           username TEXT UNIQUE,
+           password TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS transactions
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           type TEXT CHECK(type IN ('income', 'expense')),
+           category TEXT,
+           amount DECIMAL(10,2) NOT NULL,
+           date TEXT NOT NULL,
+           description TEXT,
+           FOREIGN KEY(user_id) REFERENCES users(id))''',
+        '''CREATE TABLE IF NOT EXISTS budget
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           category TEXT NOT NULL,
+           amount DECIMAL(10,2) NOT NULL,
+           month INTEGER CHECK(month BETWEEN 1 AND 12),
+           year INTEGER NOT NULL,
+           FOREIGN KEY(user_id) REFERENCES users(id),
+           UNIQUE(user_id, category, month, year))''',
+    ],
+    # 2: covering indexes for per-user report and budget queries
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_date
+           ON transactions(user_id, date, amount)''',
+        '''CREATE INDEX IF NOT EXISTS idx_transactions_user_type_category_date
+           ON transactions(user_id, type, category, date, amount)''',
+        '''CREATE INDEX IF NOT EXISTS idx_budget_user_period
+           ON budget(user_id, year, month)''',
+        "ANALYZE",
+    ],
+    # 3: store amounts as INTEGER cents instead of DECIMAL text
+    [
+        '''CREATE TABLE transactions_new
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           type TEXT CHECK(type IN ('income', 'expense')),
+           category TEXT,
+           amount INTEGER NOT NULL,
+           date TEXT NOT NULL,
+           description TEXT,
+           FOREIGN KEY(user_id) REFERENCES users(id))''',
+        '''INSERT INTO transactions_new
+           SELECT id, user_id, type, category, CAST(ROUND(amount * 100) AS INTEGER),
+                  date, description
+           FROM transactions''',
+        '''UPDATE sqlite_sequence
+           SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'transactions')
+           WHERE name = 'transactions_new'
+           AND EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transactions')''',
+        "DROP TABLE transactions",
+        "ALTER TABLE transactions_new RENAME TO transactions",
+        '''CREATE INDEX idx_transactions_user_date
+           ON transactions(user_id, date, amount)''',
+        '''CREATE INDEX idx_transactions_user_type_category_date
+           ON transactions(user_id, type, category, date, amount)''',
+        '''CREATE TABLE budget_new
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           category TEXT NOT NULL,
+           amount INTEGER NOT NULL,
+           month INTEGER CHECK(month BETWEEN 1 AND 12),
+           year INTEGER NOT NULL,
+           FOREIGN KEY(user_id) REFERENCES users(id),
+           UNIQUE(user_id, category, month, year))''',
+        '''INSERT INTO budget_new
+           SELECT id, user_id, category, CAST(ROUND(amount * 100) AS INTEGER), month, year
+           FROM budget''',
+        '''UPDATE sqlite_sequence
+           SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'budget')
+           WHERE name = 'budget_new'
+           AND EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'budget')''',
+        "DROP TABLE budget",
+        "ALTER TABLE budget_new RENAME TO budget",
+        '''CREATE INDEX idx_budget_user_period
+           ON budget(user_id, year, month)''',
+    ],
+    # 4: content hashes of imported statement rows, for duplicate detection
+    [
+        '''CREATE TABLE IF NOT EXISTS import_log
+           (user_id INTEGER NOT NULL,
+           hash TEXT NOT NULL,
+           PRIMARY KEY(user_id, hash)) WITHOUT ROWID''',
+    ],
+    # 5: per-month rollup of transaction totals, maintained by triggers
+    [
+        '''CREATE TABLE IF NOT EXISTS monthly_rollup
+           (user_id INTEGER NOT NULL,
+           year INTEGER NOT NULL,
+           month INTEGER NOT NULL,
+           type TEXT NOT NULL,
+           category TEXT NOT NULL,
+           total INTEGER NOT NULL,
+           count INTEGER NOT NULL,
+           PRIMARY KEY(user_id, year, month, type, category)) WITHOUT ROWID''',
+        *ROLLUP_TRIGGERS,
+        ROLLUP_REBUILD_SQL.format(where=''),
+    ],
+    # 6: API tokens for non-interactive access (only SHA-256 hashes are stored)
+    [
+        '''CREATE TABLE IF NOT EXISTS api_tokens
+           (token_hash TEXT PRIMARY KEY,
+           user_id INTEGER NOT NULL,
+           created TEXT NOT NULL,
+           FOREIGN KEY(user_id) REFERENCES users(id))''',
+    ],
+    # 7: only canonical YYYY-MM-DD dates, so text order is date order and
+    #    half-open range seeks are exact. Rows whose date cannot be read
+    #    are kept, unchanged, in rejected_transactions.
+    [
+        f'''CREATE TABLE rejected_transactions AS
+            SELECT * FROM transactions WHERE {LEGACY_DATE_SQL} IS NULL''',
+        '''CREATE TABLE transactions_new
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           type TEXT CHECK(type IN ('income', 'expense')),
+           category TEXT,
+           amount INTEGER NOT NULL,
+           date TEXT NOT NULL CHECK(date IS date(date, '+0 days')),
+           description TEXT,
+           FOREIGN KEY(user_id) REFERENCES users(id))''',
+        f'''INSERT INTO transactions_new
+            SELECT id, user_id, type, category, amount, {LEGACY_DATE_SQL}, description
+            FROM transactions WHERE {LEGACY_DATE_SQL} IS NOT NULL''',
+        '''UPDATE sqlite_sequence
+           SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'transactions')
+           WHERE name = 'transactions_new'
+           AND EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transactions')''',
+        "DROP TABLE transactions",
+        "ALTER TABLE transactions_new RENAME TO transactions",
+        '''CREATE INDEX idx_transactions_user_date
+           ON transactions(user_id, date, amount)''',
+        '''CREATE INDEX idx_transactions_user_type_category_date
+           ON transactions(user_id, type, category, date, amount)''',
+        *ROLLUP_TRIGGERS,
+        "DELETE FROM monthly_rollup",
+        ROLLUP_REBUILD_SQL.format(where=''),
+        "ANALYZE",
+    ],
+    # 8: full-text index over description and category, maintained by triggers
+    [
+        *SEARCH_SCHEMA,
+        *SEARCH_TRIGGERS,
+        SEARCH_REBUILD_SQL,
+    ],
+    # 9: categories become per-user rows with canonical names and an optional
+    #    parent; transactions, budgets and the rollup reference them by id.
+    #    canonical_category() and display_category() are registered on every
+    #    connection by ConnectionPool.
+    [
+        '''CREATE TABLE categories
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           name TEXT NOT NULL,
+           key TEXT NOT NULL,
+           parent_id INTEGER,
+           FOREIGN KEY(user_id) REFERENCES users(id),
+           FOREIGN KEY(parent_id) REFERENCES categories(id),
+           UNIQUE(user_id, key))''',
+        '''CREATE INDEX idx_categories_parent ON categories(parent_id)''',
+        # Each category is named after its first spelling: the one on the
+        # oldest transaction, else on the oldest budget
+        '''INSERT INTO categories (user_id, name, key)
+           SELECT user_id, name, key
+           FROM (SELECT user_id, name, key,
+                        ROW_NUMBER() OVER (PARTITION BY user_id, key
+                                           ORDER BY origin, id) AS spelling
+                 FROM (SELECT user_id, display_category(category) AS name,
+                              canonical_category(category) AS key, 0 AS origin, id
+                       FROM transactions
+                       UNION ALL
+                       SELECT user_id, display_category(category),
+                              canonical_category(category), 1, id
+                       FROM budget)
+                 WHERE key != '')
+           WHERE spelling = 1
+           ORDER BY user_id, key''',
+        '''CREATE TABLE transactions_new
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           type TEXT CHECK(type IN ('income', 'expense')),
+           category_id INTEGER,
+           amount INTEGER NOT NULL,
+           date TEXT NOT NULL CHECK(date IS date(date, '+0 days')),
+           description TEXT,
+           FOREIGN KEY(user_id) REFERENCES users(id),
+           FOREIGN KEY(category_id) REFERENCES categories(id))''',
+        '''INSERT INTO transactions_new
+           SELECT t.id, t.user_id, t.type, c.id, t.amount, t.date, t.description
+           FROM transactions t
+           LEFT JOIN categories c
+               ON c.user_id IS t.user_id AND c.key = canonical_category(t.category)''',
+        '''UPDATE sqlite_sequence
+           SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'transactions')
+           WHERE name = 'transactions_new'
+           AND EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transactions')''',
+        "DROP TABLE transactions",
+        "ALTER TABLE transactions_new RENAME TO transactions",
+        '''CREATE INDEX idx_transactions_user_date
+           ON transactions(user_id, date, amount)''',
+        '''CREATE INDEX idx_transactions_user_type_category_date
+           ON transactions(user_id, type, category_id, date, amount)''',
+        # Budgets for spellings that now share a category are added together
+        '''CREATE TABLE budget_new
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER,
+           category_id INTEGER NOT NULL,
+           amount INTEGER NOT NULL,
+           month INTEGER CHECK(month BETWEEN 1 AND 12),
+           year INTEGER NOT NULL,
+           FOREIGN KEY(user_id) REFERENCES users(id),
+           FOREIGN KEY(category_id) REFERENCES categories(id),
+           UNIQUE(user_id, category_id, month, year))''',
+        '''INSERT INTO budget_new
+           SELECT MIN(b.id), b.user_id, c.id, SUM(b.amount), b.month, b.year
+           FROM budget b
+           JOIN categories c
+               ON c.user_id IS b.user_id AND c.key = canonical_category(b.category)
+           GROUP BY b.user_id, c.id, b.month, b.year''',
+        '''UPDATE sqlite_sequence
+           SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'budget')
+           WHERE name = 'budget_new'
+           AND EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'budget')''',
+        "DROP TABLE budget",
+        "ALTER TABLE budget_new RENAME TO budget",
+        '''CREATE INDEX idx_budget_user_period
+           ON budget(user_id, year, month)''',
+        "DROP TABLE monthly_rollup",
+        '''CREATE TABLE monthly_rollup
+           (user_id INTEGER NOT NULL,
+           year INTEGER NOT NULL,
+           month INTEGER NOT NULL,
+           type TEXT NOT NULL,
+           category_id INTEGER NOT NULL,
+           total INTEGER NOT NULL,
+           count INTEGER NOT NULL,
+           PRIMARY KEY(user_id, year, month, type, category_id)) WITHOUT ROWID''',
+        *CATEGORY_ROLLUP_TRIGGERS,
+        CATEGORY_ROLLUP_REBUILD_SQL.format(where=''),
+        "INSERT INTO transactions_fts (transactions_fts) VALUES ('delete-all')",
+        *CATEGORY_SEARCH_TRIGGERS,
+        CATEGORY_SEARCH_REBUILD_SQL,
+        "ANALYZE",
+    ],
+    # 10: registry of closed years moved to archive files, and a flag that
+    #     keeps their rollup totals while the rows are moved out
+    [
+        '''CREATE TABLE archives
+           (year INTEGER PRIMARY KEY,
+           path TEXT NOT NULL,
+           rows INTEGER NOT NULL,
+           archived TEXT NOT NULL)''',
+        '''CREATE TABLE maintenance
+           (flag TEXT PRIMARY KEY) WITHOUT ROWID''',
+        "DROP TRIGGER trg_rollup_delete",
+        ARCHIVE_ROLLUP_TRIGGERS[1],
+    ],
+    # 11: running balance checkpoints; archived years are only readable
+    #     outside a transaction, so their rows are added after migrating
+    [
+        '''CREATE TABLE balance_checkpoints
+           (user_id INTEGER NOT NULL,
+           day TEXT NOT NULL,
+           balance INTEGER NOT NULL,
+           PRIMARY KEY(user_id, day)) WITHOUT ROWID''',
+        *BALANCE_TRIGGERS,
+        BALANCE_REBUILD_SQL.format(and_where=''),
+        '''INSERT INTO maintenance (flag)
+           SELECT 'rebuild_balances' WHERE EXISTS (SELECT 1 FROM archives)''',
+    ],
+    # 12: batch inserts index their rows in one statement, not per row
+    [
+        "DROP TRIGGER trg_search_insert",
+        BATCH_SEARCH_INSERT_TRIGGER,
+    ],
+]
+
+
+DEFAULT_DB_PATH = 'finance.db'
+
+
+class _BackupRestarted(Exception):
+    """Raised from the backup progress callback to stop a stepped backup."""
+
+
+class ConnectionPool:
+    """Keeps one open connection per thread for a database file.
+
+    Connections are created lazily, configured once with PRAGMAS and reused
+    for the lifetime of the process, so prepared statements stay cached.
+    """
+
+    def __init__(self, db_path, read_only=False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self.schema_checked = False
+        self.external_writes = 0
+
+    def external_version(self, cursor):
+        """Counter that moves whenever this thread's connection sees a commit
+        it may not know about.
+
+        PRAGMA data_version only compares with earlier values read on the
+        same connection, so each thread's connection remembers its own. A
+        change, or a connection's first reading, bumps the pool's counter.
+        """
+        version = cursor.execute("PRAGMA data_version").fetchone()[0]
+        if getattr(self._local, 'data_version', None) != version:
+            self._local.data_version = version
+            with self._lock:
+                self.external_writes += 1
+        return self.external_writes
+
+    def attached(self):
+        """{archive year: schema name} attached to this thread's connection."""
+        attached = getattr(self._local, 'attached', None)
+        if attached is None:
+            attached = self._local.attached = {}
+        return attached
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.db_path))}?mode=ro",
+                                       uri=True, cached_statements=STATEMENT_CACHE_SIZE,
+                                       check_same_thread=False)
+                pragmas = PRAGMAS + ("PRAGMA query_only=1",)
+            else:
+                conn = sqlite3.connect(self.db_path,
+                                       cached_statements=STATEMENT_CACHE_SIZE,
+                                       check_same_thread=False)
+                pragmas = WRITE_PRAGMAS + PRAGMAS
+            for pragma in pragmas:
+                conn.execute(pragma)
+            from source.categories import canonical_category, display_name
+            conn.create_function('canonical_category', 1, canonical_category, deterministic=True)
+            conn.create_function('display_category', 1, display_name, deterministic=True)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+        # The file may be replaced while closed (e.g. restore), so re-check
+        self.schema_checked = False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, read_only=False):
+    key = (db_path if db_path == ':memory:' else os.path.abspath(db_path), read_only)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path, read_only)
+        return pool
+
+
+_databases = {}
+
+
+def get_database(db_path=None):
+    """Return the process-wide Database for db_path.
+
+    db_path defaults to $FINANCE_DB or DEFAULT_DB_PATH. Managers share this
+    instance unless one is injected, so the schema is checked once per
+    process and every component honours the same path.
+    """
+    db_path = db_path or os.environ.get('FINANCE_DB', DEFAULT_DB_PATH)
+    pool = get_pool(db_path)
+    with _pools_lock:
+        db = _databases.get(pool)
+    if db is None:
+        db = Database(db_path)
+        with _pools_lock:
+            db = _databases.setdefault(pool, db)
+    return db
+
 
 class Database:
-    def __init__(self, db_path='finance.db'):
+    def __init__(self, db_path=DEFAULT_DB_PATH, read_only=False):
+        """Open db_path; read_only connections never write or migrate."""
         self.db_path = db_path
-        self._init_db()
+        self.read_only = read_only
+        self.pool = get_pool(db_path, read_only)
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        if self.pool.schema_checked:
+            return
+        self.pool.schema_checked = True
+        try:
+            if self.read_only:
+                self._check_schema_version()
+            else:
+                self._init_db()
+        except BaseException:
+            self.pool.schema_checked = False
+            raise
 
     @contextmanager
     def _get_cursor(self):
-        conn = sqlite3.connect(self.db_path)
+        if not self.pool.schema_checked:
+            self._ensure_schema()
+        conn = self.pool.get()
         cursor = conn.cursor()
+        if query_stats.enabled:
+            cursor = TimedCursor(cursor, query_stats)
         try:
             yield cursor
             conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
         finally:
-            conn.close()
+            cursor.close()
+
+    def _check_schema_version(self):
+        with self._get_cursor() as cursor:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version != len(MIGRATIONS):
+            raise sqlite3.DatabaseError(
+                f"{self.db_path} is at schema version {version}, expected "
+                f"{len(MIGRATIONS)}; open it read-write once to migrate it")
 
     def _init_db(self):
         with self._get_cursor() as cursor:
-            # Users table
-            cursor.execute('''CREATE TABLE IF NOT EXISTS users
-                           (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                           username TEXT UNIQUE, 
-                           password TEXT)''')
-            
-            # Transactions table
-            cursor.execute('''CREATE TABLE IF NOT EXISTS transactions
-                           (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                           user_id INTEGER, 
-                           type TEXT CHECK(type IN ('income', 'expense')),
-                           category TEXT,
-                           amount DECIMAL(10,2) NOT NULL, 
-                           date TEXT NOT NULL, 
-                           description TEXT, 
-                           FOREIGN KEY(user_id) REFERENCES users(id))''')
-            
-            # Budget table
-            cursor.execute('''CREATE TABLE IF NOT EXISTS budget
-                           (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                           user_id INTEGER, 
-                           category TEXT NOT NULL,
-                           amount DECIMAL(10,2) NOT NULL,
-                           month INTEGER CHECK(month BETWEEN 1 AND 12),
-                           year INTEGER NOT NULL,
-                           FOREIGN KEY(user_id) REFERENCES users(id),
-                           UNIQUE(user_id, category, month, year))''')
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(MIGRATIONS):
+                # Take the write lock before re-reading so concurrent processes
+                # cannot apply the same migration twice
+                cursor.execute("BEGIN IMMEDIATE")
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                for target, steps in enumerate(MIGRATIONS[version:], start=version + 1):
+                    for step in steps:
+                        cursor.execute(step)
+                    cursor.execute(f"PRAGMA user_version = {target}")
+                    if target == 7:
+                        rejected = cursor.execute(
+                            "SELECT COUNT(*) FROM rejected_transactions").fetchone()[0]
+                        if rejected:
+                            print(f"Warning: {rejected} transactions with unreadable dates "
+                                  f"were moved to the rejected_transactions table.",
+                                  file=sys.stderr)
+        # Left by migration 11 until the archived years are in the balances
+        with self._get_cursor() as cursor:
+            pending = cursor.execute("SELECT 1 FROM maintenance WHERE flag = 'rebuild_balances'"
+                                     ).fetchone()
+        if pending:
+            self.rebuild_balances()
 
     def user_exists(self, username):
         with self._get_cursor() as cursor:
@@ -68,30 +790,417 @@ class Database:
             result = cursor.fetchone()
             return result[0] if result else None
         
-    def backup_data(self, backup_file='finance.db'):
+    def create_token(self, user_id):
+        """Issue a new API token for a user and return it.
+
+        Only the token's SHA-256 hash is stored, like user passwords.
+        """
+        import hashlib
+        import secrets
+        from datetime import datetime
+
+        token = secrets.token_hex(32)   # hex: never starts with "-", so safe after --token
+        with self._get_cursor() as cursor:
+            cursor.execute("INSERT INTO api_tokens (token_hash, user_id, created) VALUES (?, ?, ?)",
+                           (hashlib.sha256(token.encode()).hexdigest(), user_id,
+                            datetime.now().isoformat(timespec='seconds')))
+        return token
+
+    def user_for_token(self, token):
+        import hashlib
+        with self._get_cursor() as cursor:
+            cursor.execute("SELECT user_id FROM api_tokens WHERE token_hash=?",
+                           (hashlib.sha256(token.encode()).hexdigest(),))
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    def rebuild_rollups(self, user_id=None):
+        """Recompute monthly_rollup from the transactions table.
+
+        The triggers keep the rollup current; this is for recovering from
+        manual edits or verifying it.
+        """
+        user_filter, params = (" AND user_id = ?", [user_id]) if user_id is not None else ("", [])
+        with self._get_cursor() as cursor:
+            totals = []
+            for source, start, next_start in self.transaction_windows(cursor):
+                bounds, bound_params = date_filter(start, next_start, 'date')
+                totals += cursor.execute(
+                    ROLLUP_TOTALS_SQL.format(source=source, where=user_filter + bounds),
+                    params + bound_params).fetchall()
+            cursor.execute(f"DELETE FROM monthly_rollup WHERE user_id IS NOT NULL{user_filter}",
+                           params)
+            cursor.executemany('''INSERT INTO monthly_rollup
+                                  (user_id, year, month, type, category_id, total, count)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?)''', totals)
+        invalidate_all()
+        print("Report summaries rebuilt.")
+
+    def rebuild_balances(self, user_id=None):
+        """Recompute balance_checkpoints from every transaction, archived
+        years included."""
+        user_filter, params = (" AND user_id = ?", [user_id]) if user_id is not None else ("", [])
+        with self._get_cursor() as cursor:
+            days = []
+            for source, start, next_start in self.transaction_windows(cursor):
+                bounds, bound_params = date_filter(start, next_start, 'date')
+                days += cursor.execute(
+                    BALANCE_DAYS_SQL.format(source=source, where=user_filter + bounds),
+                    params + bound_params).fetchall()
+            checkpoints, current, balance = [], None, 0
+            for user, day, net in sorted(days):
+                if user != current:
+                    current, balance = user, 0
+                balance += net
+                checkpoints.append((user, day, balance))
+            cursor.execute(f"DELETE FROM balance_checkpoints WHERE user_id IS NOT NULL{user_filter}",
+                           params)
+            cursor.executemany("INSERT INTO balance_checkpoints (user_id, day, balance) "
+                               "VALUES (?, ?, ?)", checkpoints)
+            cursor.execute("DELETE FROM maintenance WHERE flag = 'rebuild_balances'")
+        invalidate_all()
+
+    def add_to_balances(self, cursor, user_id, deltas):
+        """Apply {day: net cents} to a user's balance checkpoints inside an
+        open write cursor.
+
+        Each checkpoint on or after the earliest day is updated once, by
+        the sum of the deltas up to it, however many days the batch spans.
+        """
+        days = sorted(deltas)
+        cursor.executemany(BALANCE_SEED_SQL.format(user='?', day='?'),
+                           [(user_id, day, user_id, day) for day in days])
+        running = 0
+        segments = []
+        for day, next_day in zip(days, days[1:]):
+            running += deltas[day]
+            segments.append((running, user_id, day, next_day))
+        cursor.executemany('''UPDATE balance_checkpoints SET balance = balance + ?
+                              WHERE user_id = ? AND day >= ? AND day < ?''', segments)
+        if days:
+            cursor.execute('''UPDATE balance_checkpoints SET balance = balance + ?
+                              WHERE user_id = ? AND day >= ?''',
+                           (running + deltas[days[-1]], user_id, days[-1]))
+
+    def archive_path(self, year):
+        return f"{os.path.splitext(self.db_path)[0]}.{year}.archive.db"
+
+    def archive_year(self, year, vacuum=False):
+        """Move a closed year's transactions into its own archive file.
+
+        Rows are first copied into the archive and committed there, then
+        deleted here in one transaction that also records the archive, so
+        every row is always readable and a run that stops part way is
+        completed by running it again. Monthly totals stay in the rollup,
+        so summaries never need the archive. Archived rows are read-only
+        and are not full-text searched. vacuum shrinks this file afterwards.
+        Returns the number of rows moved.
+        """
+        from datetime import datetime
+        if year >= datetime.now().year:
+            raise ValueError("Only closed years can be archived.")
+        start, next_start = year_range(year)
+        path = self.archive_path(year)
+        schema = f"archive_{year}"
+
+        try:
+            with self._get_cursor() as cursor:
+                self._attach(cursor, year, path)
+                for statement in ARCHIVE_SCHEMA:
+                    cursor.execute(statement.format(schema=schema))
+                cursor.execute(f'''INSERT OR REPLACE INTO {schema}.transactions
+                                   SELECT {ARCHIVE_COLUMNS} FROM main.transactions
+                                   WHERE date >= ? AND date < ?''', (start, next_start))
+                cursor.execute(f"ANALYZE {schema}")
+
+            with self._get_cursor() as cursor:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("INSERT INTO maintenance (flag) VALUES ('archiving')")
+                cursor.execute(f'''DELETE FROM main.transactions
+                                   WHERE date >= ? AND date < ?
+                                   AND id IN (SELECT id FROM {schema}.transactions)''',
+                               (start, next_start))
+                moved = cursor.rowcount
+                cursor.execute(f'''INSERT INTO archives (year, path, rows, archived)
+                                   VALUES (?, ?, (SELECT COUNT(*) FROM {schema}.transactions), ?)
+                                   ON CONFLICT(year) DO UPDATE
+                                   SET rows = excluded.rows, archived = excluded.archived''',
+                               (year, os.path.basename(path),
+                                datetime.now().isoformat(timespec='seconds')))
+                cursor.execute("DELETE FROM maintenance WHERE flag = 'archiving'")
+        finally:
+            # Archiving many years must not use up the attachment slots
+            if year in self.pool.attached():
+                with self._get_cursor() as cursor:
+                    self._detach(cursor, year)
+
+        if vacuum:
+            with self._get_cursor() as cursor:
+                cursor.execute("VACUUM")
+        invalidate_all()
+        print(f"Archived {moved} transactions from {year} to {path}")
+        return moved
+
+    def archive_before(self, year=None, vacuum=False):
+        """Archive every year before `year` (default: the current year) that
+        still has transactions here; returns {year: rows moved}."""
+        from datetime import datetime
+        year = year or datetime.now().year
+        with self._get_cursor() as cursor:
+            years = [row[0] for row in cursor.execute(
+                '''SELECT DISTINCT CAST(substr(date, 1, 4) AS INTEGER) FROM transactions
+                   WHERE date < ? ORDER BY 1''', (f"{year}-01-01",)).fetchall()]
+        moved = {closed: self.archive_year(closed) for closed in years}
+        if vacuum and years:
+            with self._get_cursor() as cursor:
+                cursor.execute("VACUUM")
+        return moved
+
+    def archived_years(self, cursor, start=None, next_start=None):
+        """[(year, path)] of archives overlapping [start, next_start), newest first."""
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        return [(year, os.path.join(directory, path)) for year, path in cursor.execute(
+                    "SELECT year, path FROM archives ORDER BY year DESC").fetchall()
+                if (start is None or start < f"{year + 1}-01-01")
+                and (next_start is None or next_start > f"{year}-01-01")]
+
+    def transaction_windows(self, cursor, start=None, next_start=None, newest_first=False):
+        """Yield (source, window_start, window_next) covering [start, next_start).
+
+        The range is cut at year boundaries into windows that each reach at
+        most MAX_ATTACHED_ARCHIVES archived years; source is the window's
+        FROM-clause source, as from transactions_source, and the bounds are
+        None where the range is open. Windows come in date order (newest
+        first if asked) and never share a month, so their rows concatenate
+        in order and per-month or per-day totals simply add up. A window's
+        archives are attached when it is reached: read its results fully
+        before advancing, and do not write in between.
+        """
+        archives = self.archived_years(cursor, start, next_start)[::-1]
+        groups = [archives[first:first + MAX_ATTACHED_ARCHIVES]
+                  for first in range(0, len(archives), MAX_ATTACHED_ARCHIVES)] or [[]]
+        bounds = [start] + [f"{group[0][0]}-01-01" for group in groups[1:]] + [next_start]
+        windows = [(group, bounds[n], bounds[n + 1]) for n, group in enumerate(groups)]
+        if newest_first:
+            windows.reverse()
+        for group, window_start, window_next in windows:
+            yield self._union_source(cursor, group), window_start, window_next
+
+    def transactions_source(self, cursor, start=None, next_start=None):
+        """FROM-clause source of the transactions dated in [start, next_start).
+
+        Plain "transactions" unless the range reaches archived years, which
+        are then attached to the cursor's connection and combined with it
+        in a UNION ALL subquery. Call it before the cursor starts writing:
+        SQLite cannot attach inside a transaction. Meant for ranges within
+        a year, such as a budget month; use transaction_windows for any
+        range that may reach more than MAX_ATTACHED_ARCHIVES archives.
+        """
+        archives = self.archived_years(cursor, start, next_start)
+        if len(archives) > MAX_ATTACHED_ARCHIVES:
+            raise ValueError(f"The date range spans {len(archives)} archived years; "
+                             f"use transaction_windows.")
+        return self._union_source(cursor, archives)
+
+    def _union_source(self, cursor, archives):
+        if not archives:
+            return "transactions"
+        keep = {year for year, _ in archives}
+        selects = [f"SELECT {ARCHIVE_COLUMNS} FROM main.transactions"]
+        for year, path in archives:
+            if not os.path.exists(path):
+                raise sqlite3.DatabaseError(f"archive {path} for {year} is missing")
+            schema = self._attach(cursor, year, path, keep)
+            selects.append(f"SELECT {ARCHIVE_COLUMNS} FROM {schema}.transactions")
+        return f"({' UNION ALL '.join(selects)})"
+
+    def _attach(self, cursor, year, path, keep=()):
+        """Attach a year's archive, detaching others not in keep for room."""
+        attached = self.pool.attached()
+        if year in attached:
+            return attached[year]
+        for other in [other for other in attached if other not in keep]:
+            if len(attached) < MAX_ATTACHED_ARCHIVES:
+                break
+            self._detach(cursor, other)
+        if self.read_only:
+            path = f"file:{quote(os.path.abspath(path))}?mode=ro"
+        cursor.execute("ATTACH DATABASE ? AS ?", (path, f"archive_{year}"))
+        attached[year] = f"archive_{year}"
+        return attached[year]
+
+    def _detach(self, cursor, year):
+        cursor.execute(f"DETACH DATABASE {self.pool.attached().pop(year)}")
+
+    def backup_data(self, backup_file=None, compress=False, keep=BACKUP_KEEP,
+                    progress=None, pages=None):
+        """Take a consistent online backup with the SQLite backup API.
+
+        In WAL mode the copy is a single step reading one snapshot, so
+        other connections keep reading and writing throughout. Otherwise
+        pages are copied `pages` at a time (default BACKUP_PAGES_PER_STEP).
+        SQLite restarts a stepped backup whenever another connection
+        commits, so after BACKUP_MAX_RESTARTS restarts the rest is copied
+        in one step. Older backups are rotated to numbered files
+        (backup.1, backup.2, ...), keeping `keep` in total.
+        progress(copied_pages, total_pages) is called after every step.
+        """
+        import gzip
         import shutil
-        shutil.copy2('finance.db', backup_file)
+
+        backup_file = backup_file or f"{self.db_path}.backup"
+        if compress and not backup_file.endswith('.gz'):
+            backup_file += '.gz'
+
+        raw_file = backup_file + '.tmp'
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(raw_file)
+        try:
+            if pages is None:
+                wal = source.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+                pages = -1 if wal else BACKUP_PAGES_PER_STEP
+            copied, restarts = 0, 0
+
+            def report(status, remaining, total):
+                nonlocal copied, restarts
+                if copied and total - remaining <= copied:   # started over
+                    restarts += 1
+                copied = total - remaining
+                if progress:
+                    progress(copied, total)
+                if restarts > BACKUP_MAX_RESTARTS and pages != -1:
+                    raise _BackupRestarted()
+
+            try:
+                source.backup(target, pages=pages, progress=report)
+            except _BackupRestarted:
+                pages = -1
+                source.backup(target, pages=-1, progress=report)
+        finally:
+            target.close()
+            source.close()
+
+        if compress:
+            packed_file = backup_file + '.part'
+            with open(raw_file, 'rb') as src, gzip.open(packed_file, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(raw_file)
+            raw_file = packed_file
+
+        self._rotate_backups(backup_file, keep)
+        os.replace(raw_file, backup_file)
         print(f"Backup created at {backup_file}")
+        return backup_file
+
+    def _rotate_backups(self, backup_file, keep):
+        def numbered(n):
+            if n == 0:
+                return backup_file
+            if backup_file.endswith('.gz'):
+                return f"{backup_file[:-3]}.{n}.gz"
+            return f"{backup_file}.{n}"
+
+        for n in range(keep - 1, 0, -1):
+            if os.path.exists(numbered(n - 1)):
+                os.replace(numbered(n - 1), numbered(n))
+
+    def restore_data(self, backup_file=None):
+        """Atomically replace the database with a backup (plain or .gz).
 
-    def restore_data(self, backup_file='finance.db'):
+        The backup is unpacked to a temporary file next to the database,
+        integrity-checked and then renamed over it, so a failed restore
+        never leaves a half-written database behind.
+        """
+        import gzip
         import shutil
-        shutil.copy2(backup_file, 'finance.db')
-        print("Data restored from backup.")
+        import tempfile
 
-    def export_transactions(self, user_id, filename='transactions.csv'):
-        import csv
-        with self._get_cursor() as cursor:
-            cursor.execute('''SELECT type, category, amount, date, description 
-                           FROM transactions WHERE user_id=?''', (user_id,))
-            transactions = cursor.fetchall()
+        backup_file = backup_file or f"{self.db_path}.backup"
+        if not os.path.exists(backup_file):
+            print(f"Error: backup file {backup_file} not found.")
+            return False
 
-            with open(filename, 'w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(['Type', 'Category', 'Amount', 'Date', 'Description'])
-                writer.writerows(transactions)
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        fd, temp_file = tempfile.mkstemp(dir=directory, suffix='.restore')
+        try:
+            opener = gzip.open if backup_file.endswith('.gz') else open
+            with opener(backup_file, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
 
-            print(f"Transactions exported to {filename}")
+            check = sqlite3.connect(temp_file)
+            try:
+                status = check.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                check.close()
+            if status != 'ok':
+                raise sqlite3.DatabaseError(f"backup failed integrity check: {status}")
+
+            # Pooled connections must not outlive the file they point to, and
+            # a leftover WAL would be replayed onto the restored database
+            self.pool.close_all()
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
+            os.replace(temp_file, self.db_path)
+
+        except (OSError, sqlite3.DatabaseError) as error:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            print(f"Error: restore failed - {error}")
+            return False
+
+        self._ensure_schema()
+        invalidate_all()
+        print("Data restored from backup.")
+        return True
+
+    def export_transactions(self, user_id, filename='transactions.csv', start_date=None,
+                            end_date=None, columns=None, compress=None, progress=None,
+                            chunk_size=EXPORT_CHUNK_SIZE):
+        """Write a user's transactions to CSV in constant memory.
+
+        Rows are streamed from the cursor in chunk_size batches. columns
+        selects a subset of EXPORT_HEADERS; compress defaults to gzip when
+        filename ends in '.gz'; progress(rows_written) is called per chunk.
+        """
+        import csv
+        import gzip
 
+        columns = list(columns or DEFAULT_EXPORT_COLUMNS)
+        unknown = [column for column in columns if column not in EXPORT_HEADERS]
+        if unknown:
+            raise ValueError(f"Unknown export columns: {', '.join(unknown)}")
+        if compress is None:
+            compress = filename.endswith('.gz')
 
+        selected = [EXPORT_EXPRESSIONS.get(column, f"t.{column}") for column in columns]
+        start, next_start = custom_range(start_date, end_date)
+        query = f'''SELECT {', '.join(selected)} FROM {{source}} t
+                    LEFT JOIN categories c ON c.id = t.category_id
+                    WHERE t.user_id=?{{bounds}} ORDER BY t.date, t.id'''
 
+        amount_index = columns.index('amount') if 'amount' in columns else None
+        opener = gzip.open if compress else open
+        written = 0
+        with self._get_cursor() as cursor, \
+                opener(filename, 'wt', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow([EXPORT_HEADERS[column] for column in columns])
+            for source, window_start, window_next in self.transaction_windows(
+                    cursor, start, next_start):
+                bounds, params = date_filter(window_start, window_next)
+                cursor.execute(query.format(source=source, bounds=bounds), [user_id] + params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if amount_index is not None:
+                        rows = [row[:amount_index] + (from_cents(row[amount_index]),)
+                                + row[amount_index + 1:] for row in rows]
+                    writer.writerows(rows)
+                    written += len(rows)
+                    if progress:
+                        progress(written)
 
+        print(f"Transactions exported to {filename}")
+        return written
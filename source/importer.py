@@ -0,0 +1,328 @@
+"""Streaming importer for CSV, OFX/QFX and QIF bank statements.
+
+Files are processed as a chain of generators (parse -> normalize ->
+dedupe -> batch insert) so memory stays bounded regardless of file size.
+Every imported row is recorded in import_log by content hash, so
+re-importing overlapping statements skips rows that are already stored.
+
+Non-interactive use (e.g. from cron):
+    python -m source.importer --user alice statement.csv other.ofx
+"""
+import argparse
+import csv
+import hashlib
+import os
+import re
+import sys
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from source.cache import bump_data_version
+from source.database import get_database
+from source.transactions import TransactionManager, BATCH_SIZE
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%Y%m%d')
+# Slashed dates are month-first in some banks' exports and day-first in
+# others; the order is fixed per file (see detect_date_order)
+SLASH_DATE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})$')
+DATE_ORDERS = ('mdy', 'dmy')
+# Banks' own Type column values that say which way the money went; any
+# other value (POS, ATM, CHECK, ...) is ignored and the sign decides
+BANK_TYPES = {
+    'income': 'income', 'credit': 'income', 'deposit': 'income', 'dep': 'income',
+    'directdep': 'income',
+    'expense': 'expense', 'debit': 'expense', 'withdrawal': 'expense',
+    'directdebit': 'expense',
+}
+DEFAULT_CATEGORY = 'Uncategorized'
+CHUNK_SIZE = 64 * 1024
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+# --- parse stages: yield raw records as dicts ------------------------------
+
+def parse_csv(path):
+    """Yield records from a CSV file with a header row.
+
+    Understands this app's own export format as well as common bank layouts
+    (a signed Amount column or separate Debit/Credit columns).
+    """
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            row = {(key or '').strip().lower(): (value or '').strip()
+                   for key, value in row.items()}
+            record = {
+                'date': row.get('date') or row.get('posted date', ''),
+                'amount': row.get('amount', ''),
+                'type': row.get('type', ''),
+                'category': row.get('category', ''),
+                'description': (row.get('description') or row.get('memo')
+                                or row.get('payee') or row.get('name', '')),
+            }
+            if not record['amount'] and ('debit' in row or 'credit' in row):
+                # Raw cells; normalize parses them so a bad one fails only its row
+                record['debit'] = row.get('debit', '')
+                record['credit'] = row.get('credit', '')
+            yield record
+
+
+def parse_ofx(path):
+    """Yield <STMTTRN> records from an OFX/QFX file (SGML or XML flavour)."""
+    record = None
+    for closing, tag, text in _ofx_tokens(path):
+        tag = tag.upper()
+        if tag == 'STMTTRN':
+            if closing and record is not None:
+                yield {
+                    'date': record.get('DTPOSTED', '')[:8],
+                    'amount': record.get('TRNAMT', ''),
+                    'type': '',
+                    'category': '',
+                    'description': record.get('NAME') or record.get('MEMO', ''),
+                    'id': record.get('FITID'),
+                }
+                record = None
+            elif not closing:
+                record = {}
+        elif record is not None and not closing and text.strip():
+            record[tag] = text.strip()
+
+
+def _ofx_tokens(path):
+    with open(path, encoding='utf-8', errors='replace') as file:
+        buffer = ''
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            buffer += chunk
+            # Keep a possibly incomplete trailing tag for the next chunk
+            cut = max(buffer.rfind('<'), 0) if chunk else len(buffer)
+            for match in OFX_TAG.finditer(buffer, 0, cut):
+                yield match.groups()
+            if not chunk:
+                break
+            buffer = buffer[cut:]
+
+
+def parse_qif(path):
+    """Yield records from a QIF file; each record ends with a '^' line."""
+    record = {}
+    with open(path, encoding='utf-8', errors='replace') as file:
+        for line in file:
+            line = line.rstrip('\r\n')
+            if not line or line.startswith('!'):
+                continue
+            code, value = line[0], line[1:].strip()
+            if code == '^':
+                if record:
+                    yield {
+                        'date': record.get('D', ''),
+                        'amount': record.get('T') or record.get('U', ''),
+                        'type': '',
+                        'category': record.get('L', ''),
+                        'description': record.get('P') or record.get('M', ''),
+                    }
+                record = {}
+            else:
+                record.setdefault(code, value)
+
+
+PARSERS = {
+    '.csv': parse_csv,
+    '.ofx': parse_ofx,
+    '.qfx': parse_ofx,
+    '.qif': parse_qif,
+}
+
+
+# --- normalize / dedupe / batch stages --------------------------------------
+
+def detect_date_order(records):
+    """'mdy' or 'dmy' from the first slashed date that can only be read one
+    way, or None if every slashed date fits both."""
+    for record in records:
+        match = SLASH_DATE.match(record['date'].strip().replace("'", '/'))
+        if match:
+            first, second = int(match.group(1)), int(match.group(2))
+            if first > 12 >= second:
+                return 'dmy'
+            if second > 12 >= first:
+                return 'mdy'
+    return None
+
+
+def normalize(records, manager, errors, date_order=None):
+    """Validate raw records, yielding (record_id, row) for TransactionManager.
+
+    Records are classified by the amount's sign unless their type is one
+    of BANK_TYPES. Slashed dates are read in date_order; without one,
+    those that fit both orders are rejected. Invalid records are appended
+    to errors as (record_index, message).
+    """
+    for index, record in enumerate(records):
+        try:
+            if 'debit' in record or 'credit' in record:
+                amount = (_parse_amount(record.get('credit') or '0')
+                          - abs(_parse_amount(record.get('debit') or '0')))
+            else:
+                amount = _parse_amount(record['amount'])
+            trans_type = (BANK_TYPES.get(record.get('type', '').lower())
+                          or ('income' if amount > 0 else 'expense'))
+            row = manager._validate(trans_type, record.get('category') or DEFAULT_CATEGORY,
+                                    abs(amount), _parse_bank_date(record['date'], date_order),
+                                    record.get('description', ''))
+        except ValueError as error:
+            errors.append((index, str(error)))
+            continue
+        yield record.get('id'), row
+
+
+def dedupe(rows, cursor, user_id, stats):
+    """Drop rows already recorded in import_log, logging the new ones.
+
+    Rows are identified by the bank's transaction id when present, else by
+    date, amount, description and their occurrence count in the file, so
+    genuine repeats within one statement are kept even when the statement
+    is not sorted by date.
+    """
+    seen = {}
+    for record_id, row in rows:
+        if record_id:
+            key = f"id|{record_id}"
+        else:
+            date, amount, description = row[4], row[3], row[5]
+            content = f"{date}|{amount}|{description.lower()}"
+            seen[content] = occurrence = seen.get(content, 0) + 1
+            key = f"{content}|{occurrence}"
+
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        cursor.execute("INSERT OR IGNORE INTO import_log (user_id, hash) VALUES (?, ?)",
+                       (user_id, digest))
+        if cursor.rowcount == 1:
+            yield row
+        else:
+            stats['duplicates'] += 1
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Importer:
+    def __init__(self, user_id, db=None):
+        self.user_id = user_id
+        self.manager = TransactionManager(user_id, db)
+        self.db = self.manager.db
+
+    def import_file(self, path, file_format=None, batch_size=BATCH_SIZE, date_order=None):
+        """Import one statement file and return a summary dict.
+
+        date_order ('mdy' or 'dmy') says how to read slashed dates such as
+        03/04/2024; by default it is taken from the file's first date that
+        can only be read one way.
+        """
+        if date_order is not None and date_order not in DATE_ORDERS:
+            raise ValueError(f"Date order must be one of: {', '.join(DATE_ORDERS)}")
+        file_format = (file_format or os.path.splitext(path)[1]).lower()
+        if not file_format.startswith('.'):
+            file_format = '.' + file_format
+        parser = PARSERS.get(file_format)
+        if parser is None:
+            raise ValueError(f"Unsupported file format: {file_format}")
+
+        date_order = date_order or detect_date_order(parser(path))
+        errors = []
+        stats = {'inserted': 0, 'duplicates': 0}
+        with self.db._get_cursor() as cursor:
+            rows = normalize(parser(path), self.manager, errors, date_order)
+            fresh = dedupe(rows, cursor, self.user_id, stats)
+            for batch in batched(fresh, batch_size):
+                stats['inserted'] += self.manager._insert_batch(cursor, batch)
+
+        if stats['inserted']:
+            bump_data_version(self.db, self.user_id)
+
+        stats['errors'] = errors
+        return stats
+
+
+@lru_cache(maxsize=4096)
+def _parse_bank_date(text, order=None):
+    text = text.strip().replace("'", '/')
+    match = SLASH_DATE.match(text)
+    if match:
+        first, second, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        if order is None and first != second:
+            if first <= 12 and second <= 12:
+                raise ValueError(f"Ambiguous date {text!r}: give the date order (mdy or dmy)")
+            order = 'dmy' if first > 12 else 'mdy'
+        fmt = ('%d/%m/' if order == 'dmy' else '%m/%d/') + ('%Y' if len(year) == 4 else '%y')
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            raise ValueError(f"Unrecognized date: {text!r}")
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date: {text!r}")
+
+
+def _parse_amount(text):
+    if isinstance(text, Decimal):
+        return text
+    text = str(text).strip().replace(',', '').replace('$', '')
+    negative = text.startswith('(') and text.endswith(')')
+    try:
+        amount = Decimal(text.strip('()'))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {text!r}")
+    return -amount if negative else amount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import bank statement files.")
+    parser.add_argument('files', nargs='+', help="CSV, OFX/QFX or QIF statement files")
+    parser.add_argument('--user', required=True, help="username to import for")
+    parser.add_argument('--db', help="database file (default: $FINANCE_DB or finance.db)")
+    parser.add_argument('--format', help="override format detection (csv, ofx, qif)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--date-order', choices=DATE_ORDERS,
+                        help="how to read slashed dates (default: detect per file)")
+    args = parser.parse_args(argv)
+
+    db = get_database(args.db)
+    user_id = db.get_user_id(args.user)
+    if user_id is None:
+        print(f"Error: unknown user {args.user!r}", file=sys.stderr)
+        return 1
+
+    importer = Importer(user_id, db)
+    status = 0
+    for path in args.files:
+        try:
+            result = importer.import_file(path, args.format, args.batch_size,
+                                          args.date_order)
+        except (OSError, ValueError) as error:
+            print(f"{path}: {error}", file=sys.stderr)
+            status = 1
+            continue
+        print(f"{path}: {result['inserted']} imported, "
+              f"{result['duplicates']} duplicates skipped, "
+              f"{len(result['errors'])} invalid rows")
+        for index, message in result['errors']:
+            print(f"  record {index}: {message}", file=sys.stderr)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+    """Convert an amount (str, int, float or Decimal) to integer cents.
+
+    Amounts are stored as INTEGER cents so SQLite can aggregate them
+    exactly without per-row type conversion.
+    """
+    amount = Decimal(str(amount))
+    return int((amount * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Convert integer cents from the database back to a Decimal amount."""
+    return (Decimal(cents or 0) / 100).quantize(CENT)
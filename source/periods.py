@@ -0,0 +1,95 @@
+"""Date parsing and half-open reporting periods.
+
+Transaction dates are stored as validated 'YYYY-MM-DD' text, which sorts
+and compares like the dates themselves. Every period is returned as a
+(start, next_start) pair for `date >= ? AND date < ?`, so queries are plain
+index range seeks and never depend on how many days a month has.
+"""
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+
+def parse_date(value):
+    """Normalize a date, datetime or 'YYYY-MM-DD' string; None means today."""
+    if value is None or value == '':
+        return datetime.now().date().isoformat()
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return _parse_iso_date(str(value).strip())
+
+
+@lru_cache(maxsize=4096)
+def _parse_iso_date(value):
+    # Bulk imports repeat the same few dates many times over
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r} (expected YYYY-MM-DD)")
+
+
+def month_range(month, year):
+    if not 1 <= month <= 12:
+        raise ValueError("Month must be between 1 and 12.")
+    if month == 12:
+        return f"{year}-12-01", f"{year + 1}-01-01"
+    return f"{year}-{month:02d}-01", f"{year}-{month + 1:02d}-01"
+
+
+def quarter_months(quarter):
+    """Half-open [first month, first month of next quarter) of a quarter."""
+    if not 1 <= quarter <= 4:
+        raise ValueError("Quarter must be between 1 and 4.")
+    return 3 * quarter - 2, 3 * quarter + 1
+
+
+def quarter_range(quarter, year):
+    first_month, next_month = quarter_months(quarter)
+    return month_range(first_month, year)[0], month_range(next_month - 1, year)[1]
+
+
+def year_range(year):
+    return f"{year}-01-01", f"{year + 1}-01-01"
+
+
+def custom_range(start_date=None, end_date=None):
+    """Half-open bounds for an inclusive start..end span; either may be None."""
+    start = parse_date(start_date) if start_date else None
+    next_start = None
+    if end_date:
+        next_start = (date.fromisoformat(parse_date(end_date)) + timedelta(days=1)).isoformat()
+    if start and next_start and start >= next_start:
+        raise ValueError("Start date must not be after end date.")
+    return start, next_start
+
+
+def quarter_of(month):
+    return (month - 1) // 3 + 1
+
+
+STEPS = ('day', 'week', 'month')
+
+
+def period_ends(start_date, end_date, step='month'):
+    """Last day of each step-long period from start to end, inclusive.
+
+    Days and weeks are counted from the start date; months are calendar
+    months. The final period is cut short at the end date.
+    """
+    if step not in STEPS:
+        raise ValueError(f"Step must be one of: {', '.join(STEPS)}.")
+    start, next_start = custom_range(start_date, end_date)
+    if not start or not next_start:
+        raise ValueError("A balance series needs both a start and an end date.")
+    current = date.fromisoformat(start)
+    end = date.fromisoformat(next_start) - timedelta(days=1)
+    ends = []
+    while current <= end:
+        if step == 'month':
+            following = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+        else:
+            following = current + timedelta(days=1 if step == 'day' else 7)
+        ends.append(min(following - timedelta(days=1), end).isoformat())
+        current = following
+    return ends
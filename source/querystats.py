@@ -0,0 +1,193 @@
+"""Per-statement query instrumentation.
+
+Off by default. When enabled, Database._get_cursor hands out a
+TimedCursor that records, for every distinct SQL statement, how often it
+ran, its total and p95 time (execute plus fetching the results) and the
+rows it returned or changed. Statements slower than the threshold are
+appended to a slow-query log together with their EXPLAIN QUERY PLAN.
+
+Enable it in code with query_stats.enable(...), or for any process by
+setting FINANCE_QUERY_STATS=1 (FINANCE_SLOW_QUERY_MS and
+FINANCE_SLOW_QUERY_LOG set the threshold and the log file). When disabled
+the only cost is one attribute check per _get_cursor call.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+SAMPLES_PER_STATEMENT = 1000   # p95 is computed over the most recent runs
+DEFAULT_SLOW_MS = 100.0
+
+
+def normalize_sql(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class StatementStats:
+    __slots__ = ('count', 'total', 'rows', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLES_PER_STATEMENT)
+
+
+class QueryStats:
+    def __init__(self):
+        self.enabled = False
+        self.slow_ms = DEFAULT_SLOW_MS
+        self.slow_log = None
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def enable(self, slow_ms=None, slow_log=None):
+        """Start recording; slow_log is a file path (None: don't log)."""
+        if slow_ms is not None:
+            self.slow_ms = float(slow_ms)
+        self.slow_log = slow_log
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def record(self, sql, seconds, rows):
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = StatementStats()
+            stats.count += 1
+            stats.total += seconds
+            stats.rows += rows
+            stats.samples.append(seconds)
+
+    def snapshot(self):
+        """Return one dict per statement, slowest total time first."""
+        with self._lock:
+            items = [(sql, stats.count, stats.total, stats.rows, sorted(stats.samples))
+                     for sql, stats in self._stats.items()]
+        report = []
+        for sql, count, total, rows, samples in items:
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            report.append({
+                'sql': sql,
+                'count': count,
+                'total_ms': round(total * 1000, 3),
+                'mean_ms': round(total / count * 1000, 3),
+                'p95_ms': round(p95 * 1000, 3),
+                'rows': rows,
+            })
+        report.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return report
+
+    def log_slow(self, connection, sql, params, seconds):
+        if not self.slow_log:
+            return
+        try:
+            plan = [row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}",
+                                                          params or ())]
+        except Exception as error:   # not every statement can be explained
+            plan = [f"(no plan: {error})"]
+        lines = [f"-- {datetime.now().isoformat(timespec='seconds')} "
+                 f"{seconds * 1000:.1f} ms",
+                 normalize_sql(sql)]
+        lines += [f"--   {step}" for step in plan]
+        with self._lock, open(self.slow_log, 'a', encoding='utf-8') as log:
+            log.write("\n".join(lines) + "\n\n")
+
+
+class TimedCursor:
+    """sqlite3 cursor wrapper that reports each statement to QueryStats.
+
+    A statement's time covers its execute() call and every fetch until the
+    next statement runs or the cursor is closed, since SQLite produces rows
+    lazily as they are fetched.
+    """
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+        self._sql = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _begin(self, sql, params):
+        self._finish()
+        self._sql = sql
+        self._params = params
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        rows = self._rows + max(self._cursor.rowcount, 0)
+        self._stats.record(self._sql, self._elapsed, rows)
+        if self._elapsed * 1000 >= self._stats.slow_ms:
+            self._stats.log_slow(self._cursor.connection, self._sql, self._params, self._elapsed)
+        self._sql = None
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql, params=()):
+        self._begin(sql, params)
+        self._timed(self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._begin(sql, None)
+        self._timed(self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def executescript(self, script):
+        self._begin(script, None)
+        self._timed(self._cursor.executescript, script)
+        return self
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(self._cursor.fetchmany, size or self._cursor.arraysize)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+
+query_stats = QueryStats()
+
+if os.environ.get('FINANCE_QUERY_STATS'):
+    query_stats.enable(os.environ.get('FINANCE_SLOW_QUERY_MS'),
+                       os.environ.get('FINANCE_SLOW_QUERY_LOG'))
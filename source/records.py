@@ -0,0 +1,152 @@
+"""Typed transaction records.
+
+Transaction is one row with its amount in integer cents and its date as a
+datetime.date. It still indexes like the (id, user_id, type, category,
+amount, date, description) tuples the managers used to return, so t[4]
+is the cents and t[5] the ISO date string.
+
+TransactionBatch holds many rows column by column: ids, amounts, day
+numbers (days since 1970-01-01) and category codes in parallel
+array('q') columns, eight bytes per value. Large result sets take a
+predictable amount of memory, and the columns can be summed directly or
+handed to NumPy without copying.
+"""
+from array import array
+from datetime import date as Date
+from source.money import from_cents
+
+EPOCH_ORDINAL = Date(1970, 1, 1).toordinal()
+
+# Attribute behind each position of the legacy row tuple
+ROW_FIELDS = ('id', 'user_id', 'type', 'category', 'cents', 'iso_date', 'description')
+
+
+class Transaction:
+    __slots__ = ('id', 'user_id', 'type', 'category', 'cents', 'date', 'description')
+
+    def __init__(self, id, user_id, type, category, cents, date, description=''):
+        self.id = id
+        self.user_id = user_id
+        self.type = type
+        self.category = category
+        self.cents = cents
+        self.date = date if isinstance(date, Date) else Date.fromisoformat(date)
+        self.description = description or ''
+
+    @classmethod
+    def from_row(cls, row):
+        """Build from a (id, user_id, type, category, cents, date, description) row."""
+        return cls(*row)
+
+    @property
+    def amount(self):
+        """Signed amount as a Decimal (negative for expenses)."""
+        return from_cents(self.cents)
+
+    @property
+    def iso_date(self):
+        return self.date.isoformat()
+
+    @property
+    def day(self):
+        """Days since 1970-01-01, as stored in TransactionBatch.days."""
+        return self.date.toordinal() - EPOCH_ORDINAL
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'category': self.category,
+            'amount': self.amount,
+            'date': self.iso_date,
+            'description': self.description,
+        }
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(getattr(self, field) for field in ROW_FIELDS[index])
+        return getattr(self, ROW_FIELDS[index])
+
+    def __len__(self):
+        return len(ROW_FIELDS)
+
+    def __iter__(self):
+        return (getattr(self, field) for field in ROW_FIELDS)
+
+    def __eq__(self, other):
+        if isinstance(other, (Transaction, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return (f"Transaction(id={self.id}, type={self.type!r}, category={self.category!r}, "
+                f"amount={self.amount}, date={self.iso_date})")
+
+
+class TransactionBatch:
+    """One user's transactions stored column by column.
+
+    Category codes index into `categories`, which lists each name once
+    in order of first appearance. The type follows from the sign of the
+    amount. Indexing or iterating yields Transaction records.
+    """
+
+    __slots__ = ('user_id', 'ids', 'amounts', 'days', 'category_codes', 'categories',
+                 'descriptions', '_codes')
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+        self.ids = array('q')
+        self.amounts = array('q')
+        self.days = array('q')
+        self.category_codes = array('q')
+        self.categories = []
+        self.descriptions = []
+        self._codes = {}
+
+    @classmethod
+    def from_rows(cls, rows, user_id=None):
+        """Build from (id, cents, day, category, description) rows."""
+        batch = cls(user_id)
+        for row in rows:
+            batch.append(*row)
+        return batch
+
+    def append(self, trans_id, cents, day, category='', description=''):
+        code = self._codes.get(category)
+        if code is None:
+            code = self._codes[category] = len(self.categories)
+            self.categories.append(category)
+        self.ids.append(trans_id)
+        self.amounts.append(cents)
+        self.days.append(day)
+        self.category_codes.append(code)
+        self.descriptions.append(description or '')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        cents = self.amounts[index]
+        return Transaction(self.ids[index], self.user_id,
+                           'income' if cents > 0 else 'expense',
+                           self.categories[self.category_codes[index]], cents,
+                           Date.fromordinal(self.days[index] + EPOCH_ORDINAL),
+                           self.descriptions[index])
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def total(self):
+        """Net of all amounts, in cents."""
+        return sum(self.amounts)
+
+    def totals_by_category(self):
+        """{category: net cents}, summed straight from the columns."""
+        totals = [0] * len(self.categories)
+        for code, cents in zip(self.category_codes, self.amounts):
+            totals[code] += cents
+        return dict(zip(self.categories, totals))
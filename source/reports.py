@@ -1,146 +1,218 @@
 from datetime import datetime
-from source.database import Database
-from decimal import Decimal
+from source.categories import CategoryManager
+from source.database import date_filter, get_database
+from source.money import from_cents
+from source.cache import cached_report
+from source.periods import custom_range, parse_date, period_ends, quarter_months
 
 class ReportGenerator:
-    def __init__(self, user_id):
+    def __init__(self, user_id, db=None):
         self.user_id = user_id
-        self.db = Database()
+        self.db = db or get_database()
 
-    def monthly_salary(self, month, year):
-        start_date = f"{year}-{month:02d}-01"
-        end_date = f"{year}-{month:02d}-31"
-        
-        with self.db._get_cursor() as c:
-            c.execute('''SELECT COALESCE(SUM(amount), 0) 
-                    FROM transactions 
-                    WHERE user_id=? AND amount > 0
-                    AND date BETWEEN ? AND ?''',
-                    (self.user_id, start_date, end_date))
-            income = float(c.fetchone()[0])
-            
-            c.execute('''SELECT COALESCE(SUM(amount), 0) 
-                    FROM transactions 
-                    WHERE user_id=? AND amount < 0
-                    AND date BETWEEN ? AND ?''',
-                    (self.user_id, start_date, end_date))
-            expenses = abs(float(c.fetchone()[0]))
-            
-            balance = income - expenses
-            savings_rate = (balance / income * 100) if income > 0 else 0
-            
+    @cached_report
+    def summarize(self, year=None, month=None, quarter=None):
+        """Aggregate a period in a single GROUP BY pass over monthly_rollup.
+
+        Returns income, expenses, balance and savings rate for the period
+        together with per-month and per-category breakdowns; every report
+        method is derived from this. Omitting year covers all history.
+        """
+        period_filter = ""
+        params = [self.user_id]
+        if year:
+            period_filter += " AND r.year = ?"
+            params.append(year)
+            if month:
+                period_filter += " AND r.month = ?"
+                params.append(month)
+            elif quarter:
+                period_filter += " AND r.month >= ? AND r.month < ?"
+                params.extend(quarter_months(quarter))
+
+        with self.db._get_cursor() as cursor:
+            cursor.execute(f'''SELECT r.year, r.month, COALESCE(c.name, ''),
+                        SUM(CASE WHEN r.type = 'income' THEN r.total ELSE 0 END),
+                        SUM(CASE WHEN r.type = 'expense' THEN r.total ELSE 0 END)
+                    FROM monthly_rollup r
+                    LEFT JOIN categories c ON c.id = r.category_id
+                    WHERE r.user_id=? {period_filter}
+                    GROUP BY r.year, r.month, r.category_id''', params)
+            rows = cursor.fetchall()
+        return self._summary_from_rows(rows)
+
+    @staticmethod
+    def _summary_from_rows(rows):
+        income_cents = expense_cents = 0
+        by_month = {}
+        income_by_category = {}
+        expenses_by_category = {}
+        for row_year, row_month, category, income, expense in rows:
+            income_cents += income
+            expense_cents += expense
+            month_totals = by_month.setdefault((row_year, row_month), [0, 0])
+            month_totals[0] += income
+            month_totals[1] += expense
+            if income:
+                income_by_category[category] = income_by_category.get(category, 0) + income
+            if expense:
+                expenses_by_category[category] = expenses_by_category.get(category, 0) + expense
+
+        income = from_cents(income_cents)
+        expenses = from_cents(-expense_cents)
+        balance = income - expenses
         return {
             'income': income,
             'expenses': expenses,
             'balance': balance,
-            'savings_rate': savings_rate,
+            'savings_rate': float(balance / income * 100) if income > 0 else 0.0,
+            'monthly_breakdown': [(f"{key[1]:02d}", from_cents(totals[0]), from_cents(-totals[1]))
+                                  for key, totals in sorted(by_month.items())],
+            'income_by_category': {category: from_cents(total)
+                                   for category, total in income_by_category.items()},
+            'expenses_by_category': {category: from_cents(-total)
+                                     for category, total in expenses_by_category.items()},
+        }
+
+    def monthly_salary(self, month, year):
+        summary = self.summarize(year, month)
+        return {
+            'income': summary['income'],
+            'expenses': summary['expenses'],
+            'balance': summary['balance'],
+            'savings_rate': summary['savings_rate'],
             'month': month,
             'year': year
         }
 
     def yearly_salary(self, year):
-        start_date = f"{year}-01-01"
-        end_date = f"{year}-12-31"
-        
-        with self.db._get_cursor() as c:
-            c.execute('''SELECT COALESCE(SUM(amount), 0) 
-                    FROM transactions 
-                    WHERE user_id=? AND amount > 0
-                    AND date BETWEEN ? AND ?''',
-                    (self.user_id, start_date, end_date))
-            income = float(c.fetchone()[0])
-            
-            c.execute('''SELECT COALESCE(SUM(amount), 0) 
-                    FROM transactions 
-                    WHERE user_id=? AND amount < 0
-                    AND date BETWEEN ? AND ?''',
-                    (self.user_id, start_date, end_date))
-            expenses = abs(float(c.fetchone()[0]))
-            
-            balance = income - expenses
-            savings_rate = (balance / income * 100) if income > 0 else 0
-            
-            c.execute('''SELECT strftime('%m', date) as month,
-                        SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) as income,
-                        ABS(SUM(CASE WHEN amount < 0 THEN amount ELSE 0 END)) as expenses
-                        FROM transactions 
-                        WHERE user_id=? AND date BETWEEN ? AND ?
-                        GROUP BY month''',
-                    (self.user_id, start_date, end_date))
-            monthly_data = c.fetchall()
-            
+        summary = self.summarize(year)
         return {
-            'income': income,
-            'expenses': expenses,
-            'balance': balance,
-            'savings_rate': savings_rate,
+            'income': summary['income'],
+            'expenses': summary['expenses'],
+            'balance': summary['balance'],
+            'savings_rate': summary['savings_rate'],
             'year': year,
-            'monthly_breakdown': monthly_data
+            'monthly_breakdown': list(summary['monthly_breakdown'])
         }
     
-    def category_breakdown(self, month=None, year=None):
-        date_filter = ""
-        params = [self.user_id]
-        
-        if month and year:
-            start_date = f"{year}-{month:02d}-01"
-            end_date = f"{year}-{month:02d}-31"
-            date_filter = "AND date BETWEEN ? AND ?"
-            params.extend([start_date, end_date])
-        elif year:
-            start_date = f"{year}-01-01"
-            end_date = f"{year}-12-31"
-            date_filter = "AND date BETWEEN ? AND ?"
-            params.extend([start_date, end_date])
+    def quarterly_report(self, quarter, year):
+        summary = self.summarize(year, quarter=quarter)
+        return {
+            'income': summary['income'],
+            'expenses': summary['expenses'],
+            'balance': summary['balance'],
+            'savings_rate': summary['savings_rate'],
+            'quarter': quarter,
+            'year': year,
+            'monthly_breakdown': list(summary['monthly_breakdown'])
+        }
 
+    @cached_report
+    def custom_report(self, start_date, end_date):
+        """Summary for an arbitrary inclusive date span, down to the day.
+
+        Uses the transactions table over a half-open [start, end + 1 day)
+        range, since the span need not line up with whole months.
+        """
+        if not start_date or not end_date:
+            raise ValueError("A custom report needs both a start and an end date.")
+        start, next_start = custom_range(start_date, end_date)
+        rows = []
         with self.db._get_cursor() as cursor:
-            cursor.execute(f'''SELECT category, SUM(amount) as total
-                    FROM transactions
-                    WHERE user_id=? AND amount > 0 {date_filter}
-                    GROUP BY category''', params)
-            income_by_category = {row[0]: row[1] for row in cursor.fetchall()}
-            
-            cursor.execute(f'''SELECT category, ABS(SUM(amount)) as total
-                    FROM transactions
-                    WHERE user_id=? AND amount < 0 {date_filter}
-                    GROUP BY category''', params)
-            expenses_by_category = {row[0]: row[1] for row in cursor.fetchall()}
-            
+            # Windows never share a month, so their groups do not overlap
+            for source, window_start, window_next in self.db.transaction_windows(
+                    cursor, start, next_start):
+                bounds, params = date_filter(window_start, window_next)
+                cursor.execute(f'''SELECT CAST(substr(t.date, 1, 4) AS INTEGER),
+                            CAST(substr(t.date, 6, 2) AS INTEGER), COALESCE(c.name, ''),
+                            SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE 0 END),
+                            SUM(CASE WHEN t.type = 'expense' THEN t.amount ELSE 0 END)
+                        FROM {source} t
+                        LEFT JOIN categories c ON c.id = t.category_id
+                        WHERE t.user_id = ?{bounds}
+                        GROUP BY 1, 2, t.category_id
+                        ''', [self.user_id] + params)
+                rows += cursor.fetchall()
+        summary = self._summary_from_rows(rows)
+        summary['start_date'] = start
+        summary['end_date'] = parse_date(end_date)
+        return summary
+
+    def category_breakdown(self, month=None, year=None, rollup=False):
+        """Income and expenses per category; with rollup, subcategory totals
+        are added into their top-level category."""
+        summary = self.summarize(year, month if year else None)
+        income = dict(summary['income_by_category'])
+        expenses = dict(summary['expenses_by_category'])
+        if rollup:
+            roots = CategoryManager(self.user_id, self.db).root_names()
+            income = self._roll_up(income, roots)
+            expenses = self._roll_up(expenses, roots)
         return {
-            'income': income_by_category,
-            'expenses': expenses_by_category,
+            'income': income,
+            'expenses': expenses,
             'month': month,
             'year': year
         }
 
+    @staticmethod
+    def _roll_up(totals, roots):
+        rolled = {}
+        for category, amount in totals.items():
+            root = roots.get(category, category)
+            rolled[root] = rolled.get(root, 0) + amount
+        return rolled
 
-    def get_positive_total(self, start_date, end_date):
+    @cached_report
+    def totals_between(self, start_date, end_date):
+        """Income and expense totals for an arbitrary inclusive date range."""
+        start, next_start = custom_range(start_date, end_date)
+        positive = negative = 0
         with self.db._get_cursor() as cursor:
-            cursor.execute('''SELECT COALESCE(SUM(amount), 0)
-                           FROM transactions WHERE user_id = ? AND amount > 0 
-                           AND date BETWEEN ? and ?''', 
-                           (self.user_id, start_date, end_date))
-            return Decimal(cursor.fetchone()[0])   
-        
+            for source, window_start, window_next in self.db.transaction_windows(
+                    cursor, start, next_start):
+                bounds, params = date_filter(window_start, window_next, 'date')
+                cursor.execute(f'''SELECT COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+                               COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0)
+                               FROM {source} AS transactions WHERE user_id = ?{bounds}''',
+                               [self.user_id] + params)
+                window_positive, window_negative = cursor.fetchone()
+                positive += window_positive
+                negative += window_negative
+        return {'income': from_cents(positive), 'expenses': from_cents(negative)}
+
+    def get_positive_total(self, start_date, end_date):
+        return self.totals_between(start_date, end_date)['income']
 
     def get_negative_total(self, start_date, end_date):
-        with self.db._get_cursor() as cursor:
-            cursor.execute('''SELECT COALESCE(SUM(amount), 0)
-                           FROM transactions WHERE user_id = ? AND amount < 0 
-                           AND date BETWEEN ? and ?''', 
-                           (self.user_id, start_date, end_date))
-            return Decimal(cursor.fetchone()[0])   
-        
+        return self.totals_between(start_date, end_date)['expenses']
 
+    @cached_report
     def get_total(self):
+        """Current balance: the latest checkpoint, with future-dated rows."""
         with self.db._get_cursor() as cursor:
-            cursor.execute('''SELECT COALESCE(SUM(amount), 0)
-                        FROM transactions 
-                        WHERE user_id=?''',
-                        (self.user_id,))  
-            total = cursor.fetchone()[0]
-            return float(total) if total is not None else 0.0
-        
+            cursor.execute('''SELECT balance FROM balance_checkpoints
+                        WHERE user_id = ? ORDER BY day DESC LIMIT 1''',
+                        (self.user_id,))
+            row = cursor.fetchone()
+        return from_cents(row[0] if row else 0)
 
+    def balance_at(self, date=None):
+        """Balance at the end of a date (default today)."""
+        with self.db._get_cursor() as cursor:
+            return from_cents(self._balance_at(cursor, parse_date(date)))
 
+    @cached_report
+    def balance_series(self, start_date, end_date, step='month'):
+        """[(date, balance)] at the end of each day, week or month in the
+        inclusive span; one checkpoint seek per point."""
+        with self.db._get_cursor() as cursor:
+            return [(day, from_cents(self._balance_at(cursor, day)))
+                    for day in period_ends(start_date, end_date, step)]
 
+    def _balance_at(self, cursor, day):
+        row = cursor.execute('''SELECT balance FROM balance_checkpoints
+                                WHERE user_id = ? AND day <= ?
+                                ORDER BY day DESC LIMIT 1''', (self.user_id, day)).fetchone()
+        return row[0] if row else 0
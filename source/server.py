@@ -0,0 +1,324 @@
+"""Local multi-user HTTP/JSON API server.
+
+    python main.py serve --port 8080        (or python -m source.server)
+
+The event loop only parses HTTP and routes requests; every SQLite call runs
+on a bounded thread pool, and the connection pool gives each worker thread
+its own connection. Identical GET requests from the same user that arrive
+while one is in flight share its result, and once max_pending requests are
+in progress new ones are answered with 503 instead of queueing without
+bound.
+
+Authenticate with POST /login, then send "Authorization: Bearer <token>".
+
+    POST   /register               {"username", "password"}
+    POST   /login                  {"username", "password"} -> {"token"}
+    GET    /transactions           ?limit&after&type&category&min&max&from&to
+    POST   /transactions           one transaction or {"transactions": [...]}
+    DELETE /transactions/<id>
+    GET    /search                 ?q&limit&type&category&min&max&from&to
+    GET    /balance                ?on, or ?from&to&step for a history
+    GET    /reports/monthly        ?month&year
+    GET    /reports/quarterly      ?quarter&year
+    GET    /reports/yearly         ?year
+    GET    /reports/custom         ?from&to
+    GET    /reports/categories     ?month&year&rollup
+    GET    /budgets                ?month&year
+    POST   /budgets                {"category", "amount", "month", "year"}
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+from source.budget import BudgetManager
+from source.cache import LRUCache
+from source.cli import _plain
+from source.database import get_database
+from source.periods import quarter_of
+from source.reports import ReportGenerator
+from source.transactions import TransactionManager
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+DEFAULT_MAX_PENDING = 256
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class APIServer:
+    def __init__(self, db=None, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        self.db = db or get_database()
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='finance-db')
+        self.max_pending = max_pending
+        self.pending = 0
+        self.in_flight = {}
+        self.tokens = LRUCache(maxsize=4096)
+        self.routes = [
+            ('POST', re.compile(r'/register'), self.register, False),
+            ('POST', re.compile(r'/login'), self.login, False),
+            ('GET', re.compile(r'/transactions'), self.list_transactions, True),
+            ('POST', re.compile(r'/transactions'), self.add_transactions, True),
+            ('DELETE', re.compile(r'/transactions/(\d+)'), self.delete_transaction, True),
+            ('GET', re.compile(r'/search'), self.search, True),
+            ('GET', re.compile(r'/balance'), self.balance, True),
+            ('GET', re.compile(r'/reports/(monthly|quarterly|yearly|custom|categories)'), self.report, True),
+            ('GET', re.compile(r'/budgets'), self.budget_status, True),
+            ('POST', re.compile(r'/budgets'), self.set_budget, True),
+        ]
+
+    # --- HTTP plumbing -------------------------------------------------------
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_SIZE:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                       {'error': 'request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.dispatch(method.upper(), target, headers, body)
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=_plain).encode()
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode() + b"\r\n" + body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, headers, body):
+        if self.pending >= self.max_pending:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'server busy'}
+        self.pending += 1
+        try:
+            url = urlsplit(target)
+            for route_method, pattern, handler, needs_auth in self.routes:
+                match = pattern.fullmatch(url.path)
+                if match and route_method == method:
+                    break
+            else:
+                raise HTTPError(HTTPStatus.NOT_FOUND, 'no such endpoint')
+
+            user_id = await self.authenticate(headers) if needs_auth else None
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            data = json.loads(body) if body else {}
+
+            if method == 'GET':
+                # Coalesce identical reads from the same user into one job
+                key = (user_id, url.path, tuple(sorted(params.items())))
+                future = self.in_flight.get(key)
+                if future is None:
+                    future = asyncio.ensure_future(
+                        self.run(handler, user_id, params, data, *match.groups()))
+                    self.in_flight[key] = future
+                    future.add_done_callback(functools.partial(self._forget_read, key))
+                return HTTPStatus.OK, await asyncio.shield(future)
+
+            # Reads that started before this write finishes must not be
+            # shared with requests made after it returns
+            self._forget_reads(user_id)
+            try:
+                result = await self.run(handler, user_id, params, data, *match.groups())
+            finally:
+                self._forget_reads(user_id)
+            return HTTPStatus.OK, result
+
+        except HTTPError as error:
+            return error.status, {'error': str(error)}
+        except (ValueError, ArithmeticError, TypeError, KeyError) as error:
+            return HTTPStatus.BAD_REQUEST, {'error': str(error) or error.__class__.__name__}
+        except Exception:
+            # Answer rather than drop the connection; the details go to the log
+            print(f"{method} {target} failed:", file=sys.stderr)
+            traceback.print_exc()
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'internal server error'}
+        finally:
+            self.pending -= 1
+
+    def _forget_read(self, key, future):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+
+    def _forget_reads(self, user_id):
+        for key in [key for key in self.in_flight if key[0] == user_id]:
+            del self.in_flight[key]
+
+    async def run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def authenticate(self, headers):
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, 'missing bearer token')
+        user_id = self.tokens.get(token)
+        if user_id is None:
+            user_id = await self.run(self.db.user_for_token, token)
+            if user_id is None:
+                raise HTTPError(HTTPStatus.UNAUTHORIZED, 'invalid token')
+            self.tokens.put(token, user_id)
+        return user_id
+
+    # --- endpoints (run on worker threads) -----------------------------------
+
+    def register(self, user_id, params, data):
+        username = str(data.get('username', '')).strip()
+        password = str(data.get('password', ''))
+        if not username or not password:
+            raise ValueError("username and password are required")
+        if self.db.user_exists(username):
+            raise HTTPError(HTTPStatus.CONFLICT, 'username already exists')
+        self.db.add_user(username, hashlib.sha256(password.encode()).hexdigest())
+        return {'username': username}
+
+    def login(self, user_id, params, data):
+        username = str(data.get('username', ''))
+        hashed = hashlib.sha256(str(data.get('password', '')).encode()).hexdigest()
+        if not self.db.verify_user(username, hashed):
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, 'invalid credentials')
+        return {'token': self.db.create_token(self.db.get_user_id(username))}
+
+    def list_transactions(self, user_id, params, data):
+        after = None
+        if params.get('after'):
+            date, _, trans_id = params['after'].rpartition(':')
+            after = (date, int(trans_id))
+        rows, cursor = TransactionManager(user_id, self.db).get_transactions_page(
+            after=after, limit=min(int(params.get('limit', 50)), 500),
+            trans_type=params.get('type'), category=params.get('category'),
+            min_amount=params.get('min'), max_amount=params.get('max'),
+            start_date=params.get('from'), end_date=params.get('to'))
+        return {
+            'transactions': [row.to_dict() for row in rows],
+            'next': f"{cursor[0]}:{cursor[1]}" if cursor else None,
+        }
+
+    def search(self, user_id, params, data):
+        rows = TransactionManager(user_id, self.db).search(
+            params.get('q', ''), limit=min(int(params.get('limit', 50)), 500),
+            trans_type=params.get('type'), category=params.get('category'),
+            min_amount=params.get('min'), max_amount=params.get('max'),
+            start_date=params.get('from'), end_date=params.get('to'))
+        return {'transactions': [row.to_dict() for row in rows]}
+
+    def add_transactions(self, user_id, params, data):
+        rows = data.get('transactions', [data]) if isinstance(data, dict) else data
+        result = TransactionManager(user_id, self.db).add_transactions(rows)
+        return {
+            'inserted': result['inserted'],
+            'errors': [{'index': index, 'message': message}
+                       for index, message in result['errors']],
+        }
+
+    def delete_transaction(self, user_id, params, data, trans_id):
+        if not TransactionManager(user_id, self.db).delete_transaction(int(trans_id)):
+            raise HTTPError(HTTPStatus.NOT_FOUND, 'no such transaction')
+        return {'deleted': int(trans_id)}
+
+    def balance(self, user_id, params, data):
+        reports = ReportGenerator(user_id, self.db)
+        if 'from' in params or 'to' in params:
+            series = reports.balance_series(params.get('from'), params.get('to'),
+                                            params.get('step', 'month'))
+            return {'balances': [{'date': day, 'balance': balance} for day, balance in series]}
+        if 'on' in params:
+            return {'date': params['on'], 'balance': reports.balance_at(params['on'])}
+        return {'balance': reports.get_total()}
+
+    def report(self, user_id, params, data, kind):
+        reports = ReportGenerator(user_id, self.db)
+        now = datetime.now()
+        month = int(params['month']) if 'month' in params else None
+        year = int(params['year']) if 'year' in params else None
+        if kind == 'monthly':
+            return reports.monthly_salary(month or now.month, year or now.year)
+        if kind == 'quarterly':
+            quarter = int(params['quarter']) if 'quarter' in params else quarter_of(now.month)
+            return reports.quarterly_report(quarter, year or now.year)
+        if kind == 'yearly':
+            return reports.yearly_salary(year or now.year)
+        if kind == 'custom':
+            return reports.custom_report(params.get('from'), params.get('to'))
+        return reports.category_breakdown(month, year or (now.year if month else None),
+                                          rollup=params.get('rollup') in ('1', 'true'))
+
+    def budget_status(self, user_id, params, data):
+        month = int(params['month']) if 'month' in params else None
+        year = int(params['year']) if 'year' in params else None
+        return BudgetManager(user_id, self.db).evaluate_budgets(month, year)
+
+    def set_budget(self, user_id, params, data):
+        if not BudgetManager(user_id, self.db).set_budget(
+                str(data.get('category', '')), data.get('amount', 0),
+                data.get('month'), data.get('year')):
+            raise ValueError("invalid budget")
+        return {'category': data.get('category'), 'amount': data.get('amount')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the finance HTTP/JSON API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db', help="database file (default: $FINANCE_DB or finance.db)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="database worker threads")
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help="in-flight requests before answering 503")
+    args = parser.parse_args(argv)
+
+    server = APIServer(get_database(args.db), args.workers, args.max_pending)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
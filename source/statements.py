@@ -0,0 +1,184 @@
+"""Monthly statements for every user in the database.
+
+    python main.py statements --month 9 --year 2026 --out statements/
+    (or python -m source.statements)
+
+Users are split into chunks and fanned out over a process pool. Each worker
+opens its own read-only connection, so the job runs alongside the app and
+the API server without taking write locks, and scales with the number of
+cores rather than being held to one by the GIL. One file per user is
+written to the output directory as text, CSV or JSON.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+FORMATS = ('txt', 'csv', 'json')
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_WORKERS = os.cpu_count() or 1
+CSV_HEADERS = ('section', 'name', 'amount', 'budget', 'remaining', 'status')
+
+_worker_db = None
+
+
+def statement_filename(user_id, username, month, year, fmt):
+    safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', username)
+    return f"{user_id}_{safe_name}_{year}-{month:02d}.{fmt}"
+
+
+def build_statement(db, user_id, username, month, year):
+    from source.budget import BudgetManager
+    from source.reports import ReportGenerator
+    reports = ReportGenerator(user_id, db)
+    return {
+        'user': username,
+        'month': month,
+        'year': year,
+        'summary': reports.monthly_salary(month, year),
+        'categories': reports.category_breakdown(month, year),
+        'budgets': BudgetManager(user_id, db).evaluate_budgets(month, year),
+    }
+
+
+def write_statement(statement, path, fmt):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        if fmt == 'json':
+            json.dump(statement, file, default=str, indent=2)
+        elif fmt == 'csv':
+            _write_csv(statement, file)
+        else:
+            file.write(render_text(statement))
+
+
+def _write_csv(statement, file):
+    writer = csv.writer(file)
+    writer.writerow(CSV_HEADERS)
+    summary = statement['summary']
+    for name in ('income', 'expenses', 'balance'):
+        writer.writerow(('summary', name, summary[name], '', '', ''))
+    writer.writerow(('summary', 'savings_rate', f"{summary['savings_rate']:.1f}", '', '', ''))
+    for section in ('income', 'expenses'):
+        for category, amount in sorted(statement['categories'][section].items()):
+            writer.writerow((section, category, amount, '', '', ''))
+    for status in statement['budgets']:
+        writer.writerow(('budget', status['category'], status['spent'], status['budget'],
+                         status['remaining'], status['status']))
+
+
+def render_text(statement):
+    from source.budget import format_budget_alerts
+    summary = statement['summary']
+    lines = [
+        f"Statement for {statement['user']} - {statement['month']:02d}/{statement['year']}",
+        "",
+        f"Income:       ${summary['income']:.2f}",
+        f"Expenses:     ${summary['expenses']:.2f}",
+        f"Balance:      ${summary['balance']:.2f}",
+        f"Savings rate: {summary['savings_rate']:.1f}%",
+    ]
+    for section in ('income', 'expenses'):
+        categories = statement['categories'][section]
+        if categories:
+            lines += ["", f"{section.capitalize()} by category:"]
+            lines += [f"  {category}: ${amount:.2f}"
+                      for category, amount in sorted(categories.items())]
+    lines += ["", "Budgets:"]
+    alerts = format_budget_alerts(statement['budgets'])
+    lines += [f"  {alert}" for alert in alerts] or ["  No budgets set for this period."]
+    return "\n".join(lines) + "\n"
+
+
+def _init_worker(db_path):
+    global _worker_db
+    from source.database import Database
+    _worker_db = Database(db_path, read_only=True)
+
+
+def _generate_chunk(users, month, year, out_dir, fmt):
+    """Write statements for one chunk of users; runs in a worker process."""
+    written = 0
+    failures = []
+    for user_id, username in users:
+        try:
+            statement = build_statement(_worker_db, user_id, username, month, year)
+            write_statement(statement, os.path.join(
+                out_dir, statement_filename(user_id, username, month, year, fmt)), fmt)
+            written += 1
+        except Exception as error:
+            failures.append((username, f"{error.__class__.__name__}: {error}"))
+    return len(users), written, failures
+
+
+def generate_statements(db_path, month, year, out_dir, fmt='txt',
+                        workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+                        progress=None):
+    """Write a statement for every user and return {users, written, failures}.
+
+    progress(users_done, users_total) is called as each chunk completes;
+    failures is a list of (username, message) pairs.
+    """
+    from source.database import get_database
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown statement format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if not 1 <= month <= 12:
+        raise ValueError("Month must be between 1 and 12.")
+
+    db = get_database(db_path)   # migrates once, before the read-only workers start
+    with db._get_cursor() as cursor:
+        users = cursor.execute("SELECT id, username FROM users ORDER BY id").fetchall()
+    os.makedirs(out_dir, exist_ok=True)
+
+    chunks = [users[start:start + chunk_size] for start in range(0, len(users), chunk_size)]
+    done = written = 0
+    failures = []
+    # spawn, so workers never inherit the parent's open SQLite handles
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(chunks))),
+                             mp_context=context, initializer=_init_worker,
+                             initargs=(db.db_path,)) as executor:
+        futures = [executor.submit(_generate_chunk, chunk, month, year, out_dir, fmt)
+                   for chunk in chunks]
+        for future in as_completed(futures):
+            count, chunk_written, chunk_failures = future.result()
+            done += count
+            written += chunk_written
+            failures.extend(chunk_failures)
+            if progress:
+                progress(done, len(users))
+    return {'users': len(users), 'written': written, 'failures': failures}
+
+
+def main(argv=None):
+    now = datetime.now()
+    parser = argparse.ArgumentParser(description="Write monthly statements for every user.")
+    parser.add_argument('--db', help="database file (default: $FINANCE_DB or finance.db)")
+    parser.add_argument('--month', type=int, default=now.month)
+    parser.add_argument('--year', type=int, default=now.year)
+    parser.add_argument('--out', default='statements', help="output directory")
+    parser.add_argument('--statement-format', dest='fmt', choices=FORMATS, default='txt')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="users per worker task")
+    args = parser.parse_args(argv)
+
+    def report(done, total):
+        print(f"\rStatements: {done}/{total} users", end='', file=sys.stderr, flush=True)
+
+    result = generate_statements(args.db, args.month, args.year,
+                                 args.out, args.fmt, args.workers,
+                                 args.chunk_size, report)
+    print(file=sys.stderr)
+    for username, message in result['failures']:
+        print(f"Failed: {username}: {message}", file=sys.stderr)
+    print(f"Wrote {result['written']} of {result['users']} statements to {args.out}.")
+    return 1 if result['failures'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
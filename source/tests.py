@@ -1,8 +1,31 @@
 import unittest
+import unittest.mock
+import asyncio
+import gzip
+import hashlib
+import io
+import json
 import os
-from source.database import Database
+from source.database import Database, MAX_ATTACHED_ARCHIVES, MIGRATIONS, get_database
 import sqlite3
+import threading
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import date, datetime
+from decimal import Decimal
 from source.transactions import TransactionManager
+from source.reports import ReportGenerator
+from source.importer import Importer
+from source.budget import BudgetManager
+from source.categories import CategoryManager
+from source import cli
+from source.server import APIServer
+from source.statements import generate_statements
+from source.querystats import query_stats
+try:
+    import numpy
+    from source.analytics import Analytics
+except ImportError:
+    numpy = None
 
 class TestTransactions(unittest.TestCase):
     @classmethod
@@ -11,15 +34,12 @@ class TestTransactions(unittest.TestCase):
         if os.path.exists(cls.test_db):
             os.remove(cls.test_db)
         
-        cls.db = Database()
-        cls.db.conn = sqlite3.connect(cls.test_db)
-        cls.db._init_db()
-        
+        cls.db = Database(cls.test_db)
         cls.db.add_user('testuser', 'testpass')
-        cls.user_id = 1 
+        cls.user_id = cls.db.get_user_id('testuser')
     
     def test_add_transaction(self):
-        tm = TransactionManager(self.user_id)
+        tm = TransactionManager(self.user_id, self.db)
         tm.add_transaction('income', 'salary', 1000)
         transactions = tm.get_transactions()
         self.assertEqual(len(transactions), 1)
@@ -27,8 +47,891 @@ class TestTransactions(unittest.TestCase):
     
     @classmethod
     def tearDownClass(cls):
-        cls.db.conn.close()
-        os.remove(cls.test_db)
+        cls.db.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cls.test_db + suffix):
+                os.remove(cls.test_db + suffix)
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_database.db'
+        self.db = Database(self.test_db)
+
+    def test_connection_is_reused(self):
+        with self.db._get_cursor() as first:
+            first_conn = first.connection
+        with self.db._get_cursor() as second:
+            self.assertIs(second.connection, first_conn)
+            mode = second.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_shared_instance_checks_schema_once(self):
+        shared = get_database(self.test_db)
+        self.assertIs(get_database(self.test_db), shared)
+        with unittest.mock.patch.object(Database, '_init_db') as init_db:
+            TransactionManager(1, shared)
+            Database(self.test_db)
+            get_database(self.test_db)
+        init_db.assert_not_called()
+
+    def test_failed_block_is_rolled_back(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db._get_cursor() as cursor:
+                cursor.execute("INSERT INTO users (username, password) VALUES ('a', 'x')")
+                cursor.execute("INSERT INTO users (username, password) VALUES ('a', 'y')")
+        self.assertFalse(self.db.user_exists('a'))
+
+    def test_query_stats_and_slow_log(self):
+        slow_log = 'test_slow_queries.log'
+        self.db.add_user('a', 'x')
+        query_stats.reset()
+        query_stats.enable(slow_ms=0, slow_log=slow_log)
+        try:
+            for _ in range(3):
+                self.db.get_user_id('a')
+        finally:
+            query_stats.disable()
+        try:
+            entry = query_stats.snapshot()[0]
+            self.assertEqual(entry['sql'], "SELECT id FROM users WHERE username=?")
+            self.assertEqual((entry['count'], entry['rows']), (3, 3))
+            with open(slow_log) as log:
+                self.assertIn('SEARCH users', log.read())
+        finally:
+            query_stats.reset()
+            os.remove(slow_log)
+
+    def test_migrations_upgrade_legacy_file(self):
+        legacy_db = 'test_legacy.db'
+        conn = sqlite3.connect(legacy_db)
+        conn.execute('''CREATE TABLE transactions
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+                        type TEXT, category TEXT, amount DECIMAL(10,2) NOT NULL,
+                        date TEXT NOT NULL, description TEXT)''')
+        conn.execute('''INSERT INTO transactions (user_id, type, category, amount, date)
+                        VALUES (1, 'expense', 'food', '-12.29', '2024-01-05')''')
+        conn.execute('''INSERT INTO transactions (user_id, type, category, amount, date)
+                        VALUES (1, 'expense', 'Food', '-1', '2024-01-06')''')
+        conn.commit()
+        conn.close()
+        try:
+            db = Database(legacy_db)
+            with db._get_cursor() as cursor:
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                plan = cursor.execute('''EXPLAIN QUERY PLAN
+                    SELECT SUM(amount) FROM transactions
+                    WHERE user_id = 1 AND date BETWEEN '2024-01-01' AND '2024-01-31'
+                    ''').fetchall()
+                rows = cursor.execute('''SELECT t.amount, c.name FROM transactions t
+                    JOIN categories c ON c.id = t.category_id ORDER BY t.id''').fetchall()
+            self.assertEqual(version, len(MIGRATIONS))
+            # Spellings merge under the first one used, not the smallest
+            self.assertEqual(rows, [(-1229, 'food'), (-100, 'food')])
+            self.assertIn('COVERING INDEX', ' '.join(row[-1] for row in plan))
+            db.pool.close_all()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(legacy_db + suffix):
+                    os.remove(legacy_db + suffix)
+
+    def test_migration_reads_legacy_dates_and_sets_aside_the_rest(self):
+        legacy_db = 'test_legacy_dates.db'
+        conn = sqlite3.connect(legacy_db)
+        conn.execute('''CREATE TABLE transactions
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+                        type TEXT, category TEXT, amount DECIMAL(10,2) NOT NULL,
+                        date TEXT NOT NULL, description TEXT)''')
+        dates = ['2024-01-05 09:30:00', '2024/01/06', '20240107', '08.01.2024',
+                 'yesterday', '2024-02-30', '01/09/2024']
+        conn.executemany('''INSERT INTO transactions (user_id, type, category, amount, date)
+                            VALUES (1, 'expense', 'food', '-1', ?)''', [(d,) for d in dates])
+        conn.commit()
+        conn.close()
+        try:
+            with redirect_stderr(io.StringIO()) as log:
+                db = Database(legacy_db)
+            self.assertIn('3 transactions with unreadable dates', log.getvalue())
+            with db._get_cursor() as cursor:
+                kept = cursor.execute("SELECT date FROM transactions ORDER BY id").fetchall()
+                rejected = cursor.execute(
+                    "SELECT date FROM rejected_transactions ORDER BY id").fetchall()
+            self.assertEqual([row[0] for row in kept],
+                             ['2024-01-05', '2024-01-06', '2024-01-07', '2024-01-08'])
+            self.assertEqual([row[0] for row in rejected], dates[4:])
+            db.pool.close_all()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(legacy_db + suffix):
+                    os.remove(legacy_db + suffix)
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+class TestReports(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_reports.db'
+        self.db = Database(self.test_db)
+        self.db.add_user('reporter', 'pass')
+        self.user_id = self.db.get_user_id('reporter')
+        self.tm = TransactionManager(self.user_id, self.db)
+        self.reports = ReportGenerator(self.user_id, self.db)
+
+    def test_amounts_are_exact(self):
+        self.tm.add_transaction('income', 'salary', '0.10')
+        self.tm.add_transaction('income', 'salary', '0.20')
+        self.tm.add_transaction('expense', 'food', '0.15')
+        today = datetime.now()
+        report = self.reports.monthly_salary(today.month, today.year)
+        self.assertEqual(report['income'], Decimal('0.30'))
+        self.assertEqual(report['expenses'], Decimal('0.15'))
+        self.assertEqual(self.reports.get_total(), Decimal('0.15'))
+
+    def test_bulk_insert_reports_bad_rows(self):
+        rows = [('income', 'salary', '2500', '2023-01-31', 'January pay'),
+                {'type': 'expense', 'category': 'rent', 'amount': 900, 'date': '2023-02-01'},
+                ('expense', 'food', '-5', '2023-02-02'),
+                ('transfer', 'misc', '10', '2023-02-03'),
+                ('expense', 'food', '12.50', '2023-02-30')]
+        result = self.tm.add_transactions(iter(rows), batch_size=1)
+        self.assertEqual(result['inserted'], 2)
+        self.assertEqual([index for index, _ in result['errors']], [2, 3, 4])
+        report = self.reports.monthly_salary(2, 2023)
+        self.assertEqual(report['expenses'], Decimal('900.00'))
+
+    def test_period_reports_use_half_open_ranges(self):
+        self.tm.add_transactions([('income', 'salary', '3000', '2024-03-31'),
+                                  ('expense', 'rent', '1000', '2024-04-01'),
+                                  ('expense', 'food', '45', '2024-02-29'),
+                                  ('expense', 'food', '10', '2024-12-31'),
+                                  ('expense', 'food', '20', '2025-01-01')])
+        quarter = self.reports.quarterly_report(1, 2024)
+        self.assertEqual((quarter['income'], quarter['expenses']),
+                         (Decimal('3000.00'), Decimal('45.00')))
+        self.assertEqual([month for month, _, _ in quarter['monthly_breakdown']], ['02', '03'])
+
+        custom = self.reports.custom_report('2024-02-29', '2024-04-01')
+        self.assertEqual(custom['expenses'], Decimal('1045.00'))
+        self.assertEqual(custom['expenses_by_category'], {'food': Decimal('45.00'),
+                                                          'rent': Decimal('1000.00')})
+        self.assertEqual(self.reports.get_negative_total('2024-12-31', '2024-12-31'),
+                         Decimal('-10.00'))
+        self.assertEqual(len(self.tm.get_transactions('2024-12-01', '2024-12-31')), 1)
+        with self.assertRaises(ValueError):
+            self.reports.custom_report('2024-05-01', '2024-04-01')
+
+    def test_full_text_search(self):
+        self.tm.add_transactions([('expense', 'shopping', '30', '2023-11-02', 'AMAZON Marketplace'),
+                                  ('expense', 'books', '8', '2024-03-02', 'Amazon Kindle'),
+                                  ('expense', 'food', '5', '2024-02-02', 'Whole Foods market'),
+                                  ('expense', 'food', '7', '2024-02-03', 'foods, whole grain')])
+        self.db.add_user('other', 'pass')
+        TransactionManager(self.db.get_user_id('other'), self.db).add_transaction('expense', 'misc', '1',
+                                                           'amazon', '2024-01-01')
+
+        def ids(text, **filters):
+            return [row[6] for row in self.tm.search(text, **filters)]
+
+        self.assertEqual(sorted(ids('amaz*')), ['AMAZON Marketplace', 'Amazon Kindle'])
+        self.assertEqual(ids('"whole foods"'), ['Whole Foods market'])
+        self.assertEqual(ids('amazon', start_date='2024-01-01'), ['Amazon Kindle'])
+        self.assertEqual(ids('books'), ['Amazon Kindle'])
+        self.assertEqual(ids('NEAR( OR'), [])
+        # Rows written outside _insert_batch are indexed by the trigger
+        with self.db._get_cursor() as cursor:
+            cursor.execute('''INSERT INTO transactions (user_id, type, amount, date, description)
+                              VALUES (1, 'expense', -100, '2024-04-01', 'zebra crossing')''')
+        self.assertEqual(ids('zebra'), ['zebra crossing'])
+        self.assertEqual(len(self.tm.search('amazon')), 2)
+
+        kindle = self.tm.search('kindle')[0][0]
+        self.tm.delete_transaction(kindle)
+        self.assertEqual(ids('kindle'), [])
+        with self.assertRaises(ValueError):
+            self.tm.search('  "" ')
+        with self.assertRaises(ValueError):
+            self.tm.search('amazon', limit=0)
+
+    def test_malformed_dates_are_rejected(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db._get_cursor() as cursor:
+                cursor.execute('''INSERT INTO transactions (user_id, type, amount, date)
+                                  VALUES (?, 'expense', -100, '2024-2-5')''',
+                               (self.user_id,))
+
+    def test_streaming_export(self):
+        self.tm.add_transactions([('income', 'salary', '100', '2023-01-01'),
+                                  ('expense', 'food', '2.50', '2023-01-05', 'lunch'),
+                                  ('expense', 'food', '3', '2023-02-01')])
+        progress = []
+        filename = 'test_export.csv.gz'
+        try:
+            written = self.db.export_transactions(self.user_id, filename,
+                                                  start_date='2023-01-02',
+                                                  columns=['date', 'amount'],
+                                                  progress=progress.append, chunk_size=1)
+            with gzip.open(filename, 'rt') as file:
+                lines = file.read().splitlines()
+        finally:
+            os.remove(filename)
+        self.assertEqual(written, 2)
+        self.assertEqual(progress, [1, 2])
+        self.assertEqual(lines, ['Date,Amount', '2023-01-05,-2.50', '2023-02-01,-3.00'])
+
+    def test_rollup_tracks_writes(self):
+        self.tm.add_transactions([('income', 'salary', '3000', '2023-01-31'),
+                                  ('expense', 'food', '20', '2023-01-15'),
+                                  ('expense', 'food', '30', '2023-02-10'),
+                                  ('expense', 'rent', '1000', '2023-02-01')])
+        food_id = self.tm.get_transactions_page(category='food')[0][0][0]
+        self.tm.delete_transaction(food_id)
+        with self.db._get_cursor() as cursor:
+            ids = self.tm.categories.resolve(cursor, ['housing', 'rent'])
+            cursor.execute("UPDATE transactions SET category_id = ? WHERE category_id = ?",
+                           (ids['housing'], ids['rent']))
+            live = cursor.execute("SELECT * FROM monthly_rollup ORDER BY 1, 2, 3, 4, 5").fetchall()
+        self.db.rebuild_rollups()
+        with self.db._get_cursor() as cursor:
+            rebuilt = cursor.execute("SELECT * FROM monthly_rollup ORDER BY 1, 2, 3, 4, 5").fetchall()
+        self.assertEqual(live, rebuilt)
+
+        report = self.reports.yearly_salary(2023)
+        self.assertEqual(report['expenses'], Decimal('1020.00'))
+        self.assertEqual(report['monthly_breakdown'],
+                         [('01', Decimal('3000.00'), Decimal('20.00')),
+                          ('02', Decimal('0.00'), Decimal('1000.00'))])
+        breakdown = self.reports.category_breakdown(2, 2023)
+        self.assertEqual(breakdown['expenses'], {'housing': Decimal('1000.00')})
+        self.assertEqual(self.reports.get_negative_total('2023-01-01', '2023-01-31'),
+                         Decimal('-20.00'))
+        self.assertEqual(self.reports.get_positive_total('2023-01-01', '2023-01-31'),
+                         Decimal('3000.00'))
+
+    def test_report_cache_invalidation(self):
+        self.tm.add_transaction('income', 'salary', '100', date='2023-04-01')
+        first = self.reports.summarize(2023, 4)
+        self.assertIs(self.reports.summarize(2023, 4), first)
+
+        self.tm.add_transaction('expense', 'food', '40', date='2023-04-02')
+        second = self.reports.monthly_salary(4, 2023)
+        self.assertEqual(second['expenses'], Decimal('40.00'))
+
+        # A write from another connection is picked up via PRAGMA data_version
+        other = sqlite3.connect(self.test_db)
+        other.execute('''DELETE FROM transactions
+                         WHERE category_id = (SELECT id FROM categories WHERE key = 'food')''')
+        other.commit()
+        other.close()
+        self.assertEqual(self.reports.monthly_salary(4, 2023)['expenses'], Decimal('0.00'))
+
+    def test_report_cache_sees_external_writes_from_any_thread(self):
+        self.tm.add_transaction('income', 'salary', '100', date='2023-04-01')
+
+        def in_thread(function):
+            results = []
+            thread = threading.Thread(target=lambda: results.append(function()))
+            thread.start()
+            thread.join()
+            return results[0]
+
+        self.assertEqual(in_thread(self.reports.get_total), Decimal('100.00'))
+        other = sqlite3.connect(self.test_db)
+        other.execute("UPDATE transactions SET amount = 99999")
+        other.commit()
+        other.close()
+        # A fresh thread's connection cannot compare data_version with the
+        # one that cached the report, so the entry must not be reused
+        self.assertEqual(in_thread(self.reports.get_total), Decimal('999.99'))
+        self.assertEqual(self.reports.get_total(), Decimal('999.99'))
+
+    def test_keyset_pagination(self):
+        rows = [('expense', 'food', str(n + 1), f'2023-03-{n // 3 + 1:02d}') for n in range(10)]
+        rows.append(('income', 'salary', '50', '2023-03-02'))
+        self.tm.add_transactions(rows)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = self.tm.get_transactions_page(after=cursor, limit=4,
+                                                         trans_type='expense')
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(seen, sorted(seen, key=lambda t: (t[5], t[0]), reverse=True))
+
+        page, cursor = self.tm.get_transactions_page(min_amount=3, max_amount='4.00',
+                                                     end_date='2023-03-02')
+        self.assertEqual(sorted(t[4] for t in page), [-400, -300])
+        self.assertIsNone(cursor)
+        with self.assertRaises(ValueError):
+            self.tm.get_transactions_page(limit=0)
+
+    def test_transaction_records_and_batches(self):
+        self.tm.add_transactions([('income', 'salary', '100.50', '2023-01-31', 'pay'),
+                                  ('expense', 'food', '2.25', '2023-02-01'),
+                                  ('expense', 'Food', '1', '2023-02-02')])
+        first = self.tm.get_transactions('2023-01-01', '2023-01-31')[0]
+        self.assertEqual((first.type, first.cents, first.amount, first.date),
+                         ('income', 10050, Decimal('100.50'), date(2023, 1, 31)))
+        self.assertEqual((first[3], first[4], first[5]), ('salary', 10050, '2023-01-31'))
+        self.assertEqual(first[:3], (first.id, self.user_id, 'income'))
+        with self.assertRaises(AttributeError):
+            first.note = 'no per-record __dict__'
+
+        batch = self.tm.get_batch()
+        self.assertEqual(batch.amounts.tolist(), [10050, -225, -100])
+        self.assertEqual(batch.categories, ['salary', 'food'])
+        self.assertEqual(batch.category_codes.tolist(), [0, 1, 1])
+        self.assertEqual(batch.totals_by_category(), {'salary': 10050, 'food': -325})
+        self.assertEqual(batch.days[0], first.day)
+        self.assertEqual(list(batch), sorted(self.tm.get_transactions(), key=lambda t: t.id))
+        self.assertEqual(len(self.tm.get_batch('2023-02-02', '2023-12-31')), 1)
+
+    def test_balance_checkpoints(self):
+        self.tm.add_transaction('income', 'salary', '100', date='2024-01-10')
+        self.tm.add_transaction('expense', 'rent', '30', date='2024-03-05')
+        # Backdated single and batch inserts shift every later checkpoint
+        self.tm.add_transaction('expense', 'food', '5', date='2024-02-01')
+        self.tm.add_transactions([('expense', 'food', '1', '2023-12-31'),
+                                  ('income', 'gift', '2', '2024-02-01'),
+                                  ('expense', 'food', '4', '2024-04-01')])
+
+        self.assertEqual(self.reports.balance_at('2023-12-30'), Decimal('0.00'))
+        self.assertEqual(self.reports.balance_at('2024-02-15'), Decimal('96.00'))
+        self.assertEqual(self.reports.get_total(), Decimal('62.00'))
+        self.assertEqual(self.reports.balance_series('2024-01-01', '2024-03-10'),
+                         [('2024-01-31', Decimal('99.00')), ('2024-02-29', Decimal('96.00')),
+                          ('2024-03-10', Decimal('66.00'))])
+        self.assertEqual([day for day, _ in self.reports.balance_series(
+            '2024-01-01', '2024-01-10', 'week')], ['2024-01-07', '2024-01-10'])
+        with self.assertRaises(ValueError):
+            self.reports.balance_series('2024-01-01', '2024-01-10', 'hour')
+
+        rent = next(row for row in self.tm.get_transactions() if row.category == 'rent')
+        self.tm.delete_transaction(rent.id)
+        self.assertEqual(self.reports.balance_at('2024-03-31'), Decimal('96.00'))
+        with self.db._get_cursor() as cursor:
+            cursor.execute("UPDATE transactions SET date = '2024-01-01' WHERE amount = -400")
+        for _ in range(2):
+            self.assertEqual(self.reports.balance_series('2024-01-05', '2024-04-01'),
+                             [('2024-01-31', Decimal('95.00')), ('2024-02-29', Decimal('92.00')),
+                              ('2024-03-31', Decimal('92.00')), ('2024-04-01', Decimal('92.00'))])
+            self.db.rebuild_balances()
+
+    def test_archive_closed_years(self):
+        self.tm.add_transactions([('expense', 'food', '10', '2021-03-01'),
+                                  ('income', 'salary', '100', '2021-12-31'),
+                                  ('expense', 'food', '5', '2022-01-01')])
+        archive = self.db.archive_path(2021)
+        try:
+            self.assertEqual(self.db.archive_before(2022), {2021: 2})
+            self.tm.add_transaction('expense', 'food', '1', date='2021-05-05')
+            with self.db._get_cursor() as cursor:
+                hot = cursor.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+            self.assertEqual(hot, 2)
+
+            self.assertEqual(len(self.tm.get_transactions()), 4)
+            self.assertEqual(len(self.tm.get_transactions('2022-01-01', '2022-12-31')), 1)
+            page, cursor = self.tm.get_transactions_page(limit=3)
+            self.assertEqual([row[5] for row in page], ['2022-01-01', '2021-12-31', '2021-05-05'])
+            self.assertEqual(self.reports.summarize(2021)['expenses'], Decimal('11.00'))
+            self.assertEqual(self.reports.custom_report('2021-01-01', '2022-12-31')['expenses'],
+                             Decimal('16.00'))
+            self.assertEqual(self.reports.get_negative_total('2021-03-01', '2021-03-31'),
+                             Decimal('-10.00'))
+
+            with self.db._get_cursor() as cursor:
+                live = cursor.execute("SELECT * FROM monthly_rollup ORDER BY 1, 2, 3, 4, 5").fetchall()
+            self.db.rebuild_rollups()
+            with self.db._get_cursor() as cursor:
+                rebuilt = cursor.execute("SELECT * FROM monthly_rollup ORDER BY 1, 2, 3, 4, 5").fetchall()
+            self.assertEqual(live, rebuilt)
+            self.assertEqual(self.reports.balance_at('2021-12-31'), Decimal('89.00'))
+            with self.db._get_cursor() as cursor:
+                live = cursor.execute("SELECT * FROM balance_checkpoints").fetchall()
+            self.db.rebuild_balances()
+            with self.db._get_cursor() as cursor:
+                rebuilt = cursor.execute("SELECT * FROM balance_checkpoints").fetchall()
+            self.assertEqual(live, rebuilt)
+
+            # Re-archiving picks up late entries; the current year stays open
+            self.assertEqual(self.db.archive_year(2021), 1)
+            with self.assertRaises(ValueError):
+                self.db.archive_year(datetime.now().year)
+        finally:
+            self.db.pool.close_all()
+            if os.path.exists(archive):
+                os.remove(archive)
+
+    def test_archive_more_years_than_can_be_attached(self):
+        years = range(2000, 2000 + MAX_ATTACHED_ARCHIVES + 3)
+        self.tm.add_transactions([('expense', 'food', str(n + 1), f'{year}-06-15')
+                                  for n, year in enumerate(years)])
+        self.tm.add_transaction('income', 'salary', '500', date=f'{years[-1] + 1}-01-01')
+        archives = [self.db.archive_path(year) for year in years]
+        export = 'test_archive_windows.csv'
+        try:
+            self.assertEqual(self.db.archive_before(years[-1] + 1), {year: 1 for year in years})
+            self.assertEqual(self.db.pool.attached(), {})
+
+            dates = sorted(row[5] for row in self.tm.get_transactions())
+            self.assertEqual(dates, [f'{year}-06-15' for year in years] + ['2013-01-01'])
+            self.assertEqual(list(self.tm.get_batch().amounts), [-100 * (n + 1) for n in
+                                                                range(len(years))] + [50000])
+            pages, after = [], None
+            while True:
+                page, after = self.tm.get_transactions_page(after=after, limit=4)
+                pages += [row[5] for row in page]
+                if after is None:
+                    break
+            self.assertEqual(pages, dates[::-1])
+            self.assertLessEqual(len(self.db.pool.attached()), MAX_ATTACHED_ARCHIVES)
+
+            self.assertEqual(self.db.export_transactions(self.user_id, export), len(dates))
+            self.assertEqual(self.reports.custom_report('2000-01-01', '2013-12-31')['expenses'],
+                             Decimal('91.00'))
+            self.assertEqual(self.reports.get_negative_total('2000-01-01', '2012-12-31'),
+                             Decimal('-91.00'))
+            self.assertEqual(self.reports.balance_at('2012-12-31'), Decimal('-91.00'))
+            for table, rebuild in (('monthly_rollup', self.db.rebuild_rollups),
+                                   ('balance_checkpoints', self.db.rebuild_balances)):
+                with self.db._get_cursor() as cursor:
+                    live = cursor.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3").fetchall()
+                rebuild()
+                with self.db._get_cursor() as cursor:
+                    rebuilt = cursor.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3").fetchall()
+                self.assertEqual(live, rebuilt)
+        finally:
+            self.db.pool.close_all()
+            for path in archives + [export]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_backup_rotation_and_restore(self):
+        backup = 'test_reports.backup.gz'
+        names = [backup, 'test_reports.backup.1.gz', 'test_reports.backup.2.gz']
+        try:
+            self.tm.add_transaction('income', 'salary', '10', date='2023-01-01')
+            steps = []
+            for _ in range(4):
+                self.db.backup_data(backup, compress=True, keep=3,
+                                    progress=lambda done, total: steps.append((done, total)),
+                                    pages=1)
+            self.assertTrue(all(os.path.exists(name) for name in names))
+            self.assertFalse(os.path.exists('test_reports.backup.3.gz'))
+            self.assertEqual(steps[-1][0], steps[-1][1])
+
+            self.tm.add_transaction('income', 'bonus', '5', date='2023-01-02')
+            self.assertTrue(self.db.restore_data(backup))
+            self.assertEqual(self.reports.get_total(), Decimal('10.00'))
+        finally:
+            for name in names:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def test_backup_finishes_under_concurrent_writes(self):
+        self.tm.add_transactions([('income', 'salary', '1', '2023-01-01', 'x' * 200)] * 200)
+        backup = 'test_reports.backup'
+        writer = sqlite3.connect(self.test_db)
+        steps, writes = [], []
+
+        def write(done, total):
+            # Every commit from another connection restarts a stepped backup
+            steps.append(done)
+            writes.append(done)
+            writer.execute("INSERT INTO users (username, password) VALUES (?, 'x')",
+                           (f"writer{len(writes)}",))
+            writer.commit()
+
+        try:
+            self.db.backup_data(backup, keep=1, progress=write, pages=1)
+            self.assertLess(len(steps), 20)
+            steps.clear()
+            self.db.backup_data(backup, keep=1, progress=write)
+            self.assertEqual(len(steps), 1)
+        finally:
+            writer.close()
+            if os.path.exists(backup):
+                os.remove(backup)
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+
+class TestBudget(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_budget.db'
+        self.db = Database(self.test_db)
+        self.db.add_user('budgeter', 'pass')
+        self.user_id = self.db.get_user_id('budgeter')
+        self.tm = TransactionManager(self.user_id, self.db)
+        self.budget = BudgetManager(self.user_id, self.db)
+
+    def test_evaluate_budgets(self):
+        self.budget.set_budget('food', 100, 12, 2023)
+        self.budget.set_budget('rent', 500, 12, 2023)
+        self.budget.set_budget('fun', 50, 12, 2023)
+        self.tm.add_transactions([('expense', 'food', '85', '2023-12-31'),
+                                  ('expense', 'food', '40', '2024-01-01'),
+                                  ('expense', 'rent', '600', '2023-12-01'),
+                                  ('income', 'fun', '1000', '2023-12-05')])
+        statuses = {s['category']: s for s in self.budget.evaluate_budgets(12, 2023)}
+        self.assertEqual(statuses['food']['spent'], Decimal('85.00'))
+        self.assertEqual(statuses['food']['status'], 'warning')
+        self.assertEqual(statuses['rent']['remaining'], Decimal('-100.00'))
+        self.assertEqual(statuses['rent']['status'], 'exceeded')
+        self.assertEqual(statuses['fun']['spent'], Decimal('0.00'))
+        self.assertEqual(statuses['fun']['status'], 'ok')
+
+        alerts = self.budget.check_budgets(12, 2023)
+        self.assertIn("rent: EXCEEDED by $100.00 (Budget: $500.00, Spent: $600.00)", alerts)
+
+    def test_categories_are_canonical_and_hierarchical(self):
+        self.tm.add_transactions([('expense', 'Food', '10', '2023-12-01'),
+                                  ('expense', 'food ', '5', '2023-12-02'),
+                                  ('expense', '  FOOD', '1', '2023-12-03'),
+                                  ('expense', 'Groceries', '20', '2023-12-04'),
+                                  ('expense', 'rent', '500', '2023-12-05')])
+        categories = CategoryManager(self.user_id, self.db)
+        self.assertEqual([c['name'] for c in categories.get_categories()],
+                         ['Food', 'Groceries', 'rent'])
+        self.assertTrue(categories.set_parent('groceries', 'FOOD'))
+        self.assertFalse(categories.set_parent('food', 'Groceries'))   # would be a cycle
+
+        reports = ReportGenerator(self.user_id, self.db)
+        self.assertEqual(reports.category_breakdown(12, 2023)['expenses'],
+                         {'Food': Decimal('16.00'), 'Groceries': Decimal('20.00'),
+                          'rent': Decimal('500.00')})
+        self.assertEqual(reports.category_breakdown(12, 2023, rollup=True)['expenses'],
+                         {'Food': Decimal('36.00'), 'rent': Decimal('500.00')})
+
+        self.budget.set_budget('food', 40, 12, 2023)
+        self.assertEqual(self.budget.evaluate_budgets(12, 2023)[0]['spent'], Decimal('36.00'))
+        self.assertEqual(self.budget.get_category_spending('FOOD', 12, 2023), Decimal('-36.00'))
+        self.assertEqual(len(self.tm.get_transactions_page(category='food ')[0]), 3)
+
+        self.assertTrue(categories.rename('groceries', 'Supermarket'))
+        self.assertEqual([row[3] for row in self.tm.search('supermarket')], ['Supermarket'])
+        self.assertEqual(self.tm.search('groceries'), [])
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_analytics.db'
+        self.db = Database(self.test_db)
+        self.tm = TransactionManager(1, self.db)
+
+    def test_trends_and_forecast(self):
+        rows = []
+        for month in range(1, 13):
+            rows.append(('income', 'salary', 1000 + 100 * month, f'2023-{month:02d}-01'))
+            rows.append(('expense', 'heating', 300 if month in (1, 12) else 50,
+                         f'2023-{month:02d}-15'))
+        self.tm.add_transactions(rows)
+
+        analytics = Analytics(1, self.db)
+        trends = analytics.load().trends()
+        self.assertEqual(trends['months'][0], '2023-01')
+        self.assertEqual(trends['net'][0], 800.0)
+        self.assertTrue(numpy.isnan(trends['rolling_3'][1]))
+        self.assertAlmostEqual(trends['rolling_3'][2], (800 + 1150 + 1250) / 3)
+        self.assertEqual(trends['mom_delta'][1], 350.0)
+
+        self.assertEqual(analytics.seasonality()['heating'][0], 300.0)
+
+        forecast = analytics.forecast(2)
+        self.assertEqual(forecast['months'], ['2024-01', '2024-02'])
+        self.assertGreater(forecast['net'][1], forecast['net'][0])
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+
+class TestCLI(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_cli.db'
+        self.db = Database(self.test_db)
+        self.db.add_user('scripted', hashlib.sha256(b'secret').hexdigest())
+        self.token = self.db.create_token(self.db.get_user_id('scripted'))
+
+    def run_cli(self, *argv):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = cli.main(['--db', self.test_db, '--token', self.token, *argv])
+        return status, output.getvalue()
+
+    def test_add_list_report(self):
+        self.assertEqual(self.run_cli('add', 'income', 'salary', '1500', '--date', '2024-05-01')[0], 0)
+        self.assertEqual(self.run_cli('add', 'expense', 'food', '20', '--date', '2024-05-02')[0], 0)
+
+        status, output = self.run_cli('list', '--limit', '1')
+        page = json.loads(output)
+        self.assertEqual(page['transactions'][0]['amount'], '-20.00')
+        self.assertTrue(page['next'].startswith('2024-05-02:'))
+
+        status, output = self.run_cli('report', 'monthly', '--month', '5', '--year', '2024')
+        self.assertEqual(json.loads(output)['balance'], '1480.00')
+
+        this_month = datetime.now()
+        self.run_cli('add', 'expense', 'rent', '700', '--date', this_month.strftime('%Y-%m-01'))
+        status, output = self.run_cli('report', 'categories', '--month', str(this_month.month))
+        breakdown = json.loads(output)
+        self.assertEqual((breakdown['year'], breakdown['expenses']),
+                         (this_month.year, {'rent': '700.00'}))
+
+        status, output = self.run_cli('report', 'balance', '--on', '2024-05-01')
+        self.assertEqual(json.loads(output)['balance'], '1500.00')
+        status, output = self.run_cli('--format', 'csv', 'report', 'balance', '--step', 'day',
+                                      '--from', '2024-04-30', '--to', '2024-05-02')
+        self.assertEqual(output.split(), ['date,balance', '2024-04-30,0.00',
+                                          '2024-05-01,1500.00', '2024-05-02,1480.00'])
+
+        status, output = self.run_cli('--format', 'csv', 'list')
+        self.assertEqual(output.splitlines()[0], 'id,type,category,amount,date,description')
+
+        with redirect_stderr(io.StringIO()) as errors:
+            self.assertEqual(self.run_cli('budget', 'check', '--month', '13')[0], 1)
+            self.assertEqual(self.run_cli('stats', '--month', '13')[0], 1)
+        self.assertEqual(errors.getvalue().count('Month must be between 1 and 12'), 2)
+
+    def test_rejects_bad_token(self):
+        with redirect_stderr(io.StringIO()):
+            self.assertEqual(cli.main(['--db', self.test_db, '--token', 'nope', 'list']), 1)
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+
+class TestStatements(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_statements.db'
+        self.out_dir = 'test_statements_out'
+        self.db = Database(self.test_db)
+        for name in ('ann', 'bob/smith'):
+            self.db.add_user(name, hashlib.sha256(b'pw').hexdigest())
+        ann = self.db.get_user_id('ann')
+        TransactionManager(ann, self.db).add_transactions([
+            ('income', 'salary', '1000', '2024-09-01'),
+            ('expense', 'rent', '400', '2024-09-03')])
+        with redirect_stdout(io.StringIO()):
+            BudgetManager(ann, self.db).set_budget('rent', '450', 9, 2024)
+
+    def test_statements_for_every_user(self):
+        progress = []
+        result = generate_statements(self.test_db, 9, 2024, self.out_dir, 'json', workers=2,
+                                     chunk_size=1, progress=lambda *step: progress.append(step))
+        self.assertEqual((result['users'], result['written'], result['failures']), (2, 2, []))
+        self.assertEqual(progress[-1], (2, 2))
+        self.assertEqual(sorted(os.listdir(self.out_dir)),
+                         ['1_ann_2024-09.json', '2_bob_smith_2024-09.json'])
+        with open(os.path.join(self.out_dir, '1_ann_2024-09.json')) as file:
+            statement = json.load(file)
+        self.assertEqual(statement['summary']['balance'], '600.00')
+        self.assertEqual(statement['budgets'][0]['status'], 'warning')
+
+    def test_read_only_database_refuses_writes(self):
+        reader = Database(self.test_db, read_only=True)
+        with self.assertRaises(sqlite3.OperationalError):
+            with reader._get_cursor() as cursor:
+                cursor.execute("DELETE FROM transactions")
+        reader.pool.close_all()
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        if os.path.isdir(self.out_dir):
+            for name in os.listdir(self.out_dir):
+                os.remove(os.path.join(self.out_dir, name))
+            os.rmdir(self.out_dir)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_server.db'
+        self.db = Database(self.test_db)
+
+    async def call(self, port, method, path, payload=None, token=None):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n"
+        if token:
+            head += f"Authorization: Bearer {token}\r\n"
+        writer.write(head.encode() + b"\r\n" + body)
+        response = await reader.read()
+        writer.close()
+        status = int(response.split(b' ', 2)[1])
+        return status, json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+    async def scenario(self):
+        api = APIServer(self.db, workers=2)
+        server = await asyncio.start_server(api.handle_connection, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        credentials = {'username': 'web', 'password': 'pw'}
+        try:
+            self.assertEqual((await self.call(port, 'POST', '/register', credentials))[0], 200)
+            status, login = await self.call(port, 'POST', '/login', credentials)
+            token = login['token']
+            status, added = await self.call(port, 'POST', '/transactions',
+                                            {'type': 'income', 'category': 'pay',
+                                             'amount': '12.34', 'date': '2024-01-02'}, token)
+            self.assertEqual(added['inserted'], 1)
+            balances = await asyncio.gather(*(self.call(port, 'GET', '/balance', token=token)
+                                              for _ in range(5)))
+            self.assertEqual({body['balance'] for _, body in balances}, {'12.34'})
+            # A read still running from before a write is not shared after it
+            stale = asyncio.get_running_loop().create_future()
+            api.in_flight[(self.db.user_for_token(token), '/balance', ())] = stale
+            await self.call(port, 'POST', '/transactions',
+                            {'type': 'income', 'category': 'pay', 'amount': '1',
+                             'date': '2024-01-03'}, token)
+            stale.set_result({'balance': '12.34'})
+            status, body = await self.call(port, 'GET', '/balance', token=token)
+            self.assertEqual(body['balance'], '13.34')
+            self.assertEqual((await self.call(port, 'GET', '/balance'))[0], 401)
+            self.assertEqual((await self.call(port, 'GET', '/nope', token=token))[0], 404)
+            self.assertEqual((await self.call(port, 'GET', '/transactions?limit=0',
+                                              token=token))[0], 400)
+            with redirect_stderr(io.StringIO()) as log:
+                status, body = await self.call(port, 'POST', '/register', ['not', 'an', 'object'])
+            self.assertEqual((status, body), (500, {'error': 'internal server error'}))
+            self.assertIn('AttributeError', log.getvalue())
+
+            api.max_pending = 0
+            self.assertEqual((await self.call(port, 'GET', '/balance', token=token))[0], 503)
+        finally:
+            server.close()
+            await server.wait_closed()
+            api.executor.shutdown()
+
+    def test_api_round_trip(self):
+        asyncio.run(self.scenario())
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        self.test_db = 'test_importer.db'
+        self.db = Database(self.test_db)
+        self.db.add_user('importer', 'pass')
+        self.user_id = self.db.get_user_id('importer')
+        self.importer = Importer(self.user_id, self.db)
+        self.files = []
+
+    def write(self, name, content):
+        with open(name, 'w') as file:
+            file.write(content)
+        self.files.append(name)
+        return name
+
+    def test_reimport_skips_duplicates(self):
+        path = self.write('test_statement.csv',
+                          "Date,Amount,Description\n"
+                          "2024-03-01,-4.50,Coffee\n"
+                          "2024-03-01,-4.50,Coffee\n"
+                          "2024-03-02,1200.00,Payroll\n"
+                          "not a date,1.00,Broken\n")
+        first = self.importer.import_file(path)
+        self.assertEqual((first['inserted'], first['duplicates']), (3, 0))
+        self.assertEqual(len(first['errors']), 1)
+
+        second = self.importer.import_file(path)
+        self.assertEqual((second['inserted'], second['duplicates']), (0, 3))
+
+    def test_unsorted_repeats_and_bad_cells_are_per_row(self):
+        path = self.write('test_statement.csv',
+                          "Date,Debit,Credit,Description\n"
+                          "2024-03-01,4.50,,Coffee\n"
+                          "2024-03-02,,1200.00,Payroll\n"
+                          "2024-03-01,4.50,,Coffee\n"
+                          "2024-03-03,abc,,Broken\n")
+        first = self.importer.import_file(path)
+        self.assertEqual((first['inserted'], first['duplicates']), (3, 0))
+        self.assertEqual(len(first['errors']), 1)
+        second = self.importer.import_file(path)
+        self.assertEqual((second['inserted'], second['duplicates']), (0, 3))
+
+    def test_slashed_dates_are_read_one_way_per_file(self):
+        day_first = self.write('test_statement.csv',
+                               "Date,Amount,Description\n"
+                               "03/04/2024,-1.00,Early\n"
+                               "13/04/2024,-2.00,Late\n")
+        self.assertEqual(self.importer.import_file(day_first)['inserted'], 2)
+        ambiguous = self.write('test_ambiguous.csv',
+                               "Date,Amount,Description\n"
+                               "05/06/2024,-3.00,Unclear\n"
+                               "07/07/2024,-4.00,Same either way\n")
+        result = self.importer.import_file(ambiguous)
+        self.assertEqual(result['inserted'], 1)
+        self.assertIn('Ambiguous date', result['errors'][0][1])
+        self.assertEqual(self.importer.import_file(ambiguous, date_order='dmy')['inserted'], 1)
+        with self.db._get_cursor() as cursor:
+            dates = [row[0] for row in cursor.execute(
+                "SELECT date FROM transactions ORDER BY date").fetchall()]
+        self.assertEqual(dates, ['2024-04-03', '2024-04-13', '2024-06-05', '2024-07-07'])
+
+    def test_bank_type_column(self):
+        path = self.write('test_statement.csv',
+                          "Date,Type,Amount,Description\n"
+                          "2024-03-01,DEBIT,-4.50,Coffee\n"
+                          "2024-03-02,CREDIT,1200.00,Payroll\n"
+                          "2024-03-03,POS,-9.99,Books\n"
+                          "2024-03-04,,5.00,Refund\n")
+        result = self.importer.import_file(path)
+        self.assertEqual((result['inserted'], result['errors']), (4, []))
+        with self.db._get_cursor() as cursor:
+            rows = cursor.execute("SELECT type, amount FROM transactions ORDER BY date").fetchall()
+        self.assertEqual(rows, [('expense', -450), ('income', 120000),
+                                ('expense', -999), ('income', 500)])
+
+    def test_ofx_and_qif(self):
+        ofx = self.write('test_statement.ofx',
+                         "<OFX><BANKTRANLIST><STMTTRN><TRNTYPE>DEBIT"
+                         "<DTPOSTED>20240305120000<TRNAMT>-20.00<FITID>A1"
+                         "<NAME>Grocer</STMTTRN></BANKTRANLIST></OFX>")
+        qif = self.write('test_statement.qif',
+                         "!Type:Bank\nD03/06/2024\nT-7.25\nPBakery\nLFood\n^\n")
+        self.assertEqual(self.importer.import_file(ofx)['inserted'], 1)
+        self.assertEqual(self.importer.import_file(qif, date_order='mdy')['inserted'], 1)
+        self.assertEqual(self.importer.import_file(ofx)['duplicates'], 1)
+        with self.db._get_cursor() as cursor:
+            rows = cursor.execute('''SELECT c.name, t.amount, t.date FROM transactions t
+                                     JOIN categories c ON c.id = t.category_id
+                                     ORDER BY t.date''').fetchall()
+        self.assertEqual(rows, [('Uncategorized', -2000, '2024-03-05'),
+                                ('Food', -725, '2024-03-06')])
+
+    def tearDown(self):
+        self.db.pool.close_all()
+        for name in self.files:
+            os.remove(name)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,33 +1,119 @@
-from datetime import datetime
-from source.database import Database
-from decimal import Decimal
+import re
+import sqlite3
+import unicodedata
+from decimal import InvalidOperation
+from source.categories import CategoryManager, canonical_category
+from source.database import SEARCH_BATCH_SQL, SEARCH_ROWID_SPAN, date_filter, get_database
+from source.money import to_cents
+from source.periods import custom_range, parse_date
+from source.records import Transaction, TransactionBatch
+from source.cache import bump_data_version
+
+BATCH_SIZE = 1000
+PAGE_SIZE = 20
+
+INSERT_SQL = '''INSERT INTO transactions
+                (user_id, type, category_id, amount, date, description)
+                VALUES (?, ?, ?, ?, ?, ?)'''
+
+# Rows are read back as (id, user_id, type, category name, amount, date,
+# description), the category resolved from its id
+COLUMNS = "t.id, t.user_id, t.type, COALESCE(c.name, ''), t.amount, t.date, t.description"
+CATEGORY_JOIN = "LEFT JOIN categories c ON c.id = t.category_id"
+SELECT_SQL = f"SELECT {COLUMNS} FROM {{source}} t {CATEGORY_JOIN}"
+
+SEARCH_TERM = re.compile(r'"([^"]*)"|(\S+)')
+SEARCH_TOKEN = re.compile(r'\w+')
+SEARCH_CANDIDATES = 200           # newest matches considered for ranking
+SEARCH_WEIGHTS = (1.0, 0.5)       # description, category
+BM25_K1, BM25_B = 1.2, 0.75
+
+
+def search_tokens(text):
+    """Split text the way the index does: lower case, accents removed."""
+    text = str(text or '').lower()
+    if not text.isascii():
+        text = ''.join(char for char in unicodedata.normalize('NFKD', text)
+                       if not unicodedata.combining(char))
+    return SEARCH_TOKEN.findall(text)
+
+
+def parse_search(text):
+    """Parse search text into (tokens, is_prefix) terms, all of which must match.
+
+    Plain words match anywhere, "quoted words" match as a phrase and a
+    trailing * matches a prefix (amaz*).
+    """
+    terms = []
+    for phrase, word in SEARCH_TERM.findall(text or ''):
+        tokens = tuple(search_tokens(phrase or word))
+        if tokens:
+            terms.append((tokens, bool(word) and word.endswith('*') and len(tokens) == 1))
+    if not terms:
+        raise ValueError("Search text is empty")
+    return terms
+
+
+def search_expression(terms):
+    """FTS5 MATCH expression for parsed terms; every token is quoted, so
+    user input can never inject FTS5 operators."""
+    return ' '.join('"' + ' '.join(tokens) + '"' + ('*' if prefix else '')
+                    for tokens, prefix in terms)
+
+
+def _term_frequency(tokens, term):
+    words, prefix = term
+    if prefix:
+        return sum(token.startswith(words[0]) for token in tokens)
+    if len(words) == 1:
+        return tokens.count(words[0])
+    size = len(words)
+    return sum(tuple(tokens[i:i + size]) == words for i in range(len(tokens) - size + 1))
+
+
+def rank_matches(rows, terms):
+    """Order matching rows by a BM25-style score, best first.
+
+    FTS5's own bm25() computes term rarity over the whole table, which for
+    a common word means reading its entire doclist on every search. All
+    candidates here contain every term, so rarity barely changes the order;
+    only term frequency and column length are scored, with descriptions
+    weighted above categories. Ties go to the newest transaction.
+    """
+    columns = [(search_tokens(row[6]), search_tokens(row[3])) for row in rows]
+    average = [max(1.0, sum(len(tokens[column]) for tokens in columns) / len(columns))
+               for column in (0, 1)] if rows else [1.0, 1.0]
+
+    def score(tokens):
+        total = 0.0
+        for column, weight in enumerate(SEARCH_WEIGHTS):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens[column]) / average[column])
+            for term in terms:
+                frequency = _term_frequency(tokens[column], term)
+                total += weight * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return total
+
+    # rows arrive newest first and sorted() is stable, so ties stay newest first
+    scores = [score(tokens) for tokens in columns]
+    order = sorted(range(len(rows)), key=lambda index: -scores[index])
+    return [rows[index] for index in order]
+
 
 class TransactionManager:
-    def __init__(self, user_id):
+    def __init__(self, user_id, db=None):
         self.user_id = user_id
-        self.db = Database()
+        self.db = db or get_database()
+        self.categories = CategoryManager(user_id, self.db)
 
 
-    def add_transaction(self, trans_type, category, amount, description=""):   
+    def add_transaction(self, trans_type, category, amount, description="", date=None):
         try:
-            trans_type = trans_type.lower()
-            if trans_type not in ('income', 'expense'):
-                raise ValueError("Type must be 'income' or 'expense'")
-            
-            amount = Decimal(str(amount))
-            if amount <= Decimal('0'):
-                raise ValueError("Amount must be positive")
-
-            db_amount = amount if trans_type == 'income' else -amount
-                                                                     
-            date = datetime.now().date().isoformat()
+            row = self._validate(trans_type, category, amount, date, description)
             with self.db._get_cursor() as cursor:
-                cursor.execute('''INSERT INTO transactions 
-                            (user_id, type, category, amount, date, description)
-                            VALUES (?, ?, ?, ?, ?, ?)''',
-                            (self.user_id, trans_type, category.strip(), 
-                             str(db_amount), date, description.strip()))
+                self._insert_batch(cursor, [row])
+            bump_data_version(self.db, self.user_id)
             print("Transaction added successfully!")
+            return True
 
         except ValueError as e:
             print(f"Error: {e}")
@@ -37,30 +123,236 @@ class TransactionManager:
             return False
 
 
+    def add_transactions(self, rows, batch_size=BATCH_SIZE):
+        """Insert many transactions in a single database transaction.
+
+        rows is any iterable of dicts (type, category, amount, date,
+        description) or tuples in that order; it is consumed lazily and
+        written with executemany every batch_size rows. Invalid rows are
+        skipped and reported as (row_index, message) pairs.
+        """
+        inserted = 0
+        errors = []
+        batch = []
+        try:
+            with self.db._get_cursor() as cursor:
+                for index, row in enumerate(rows):
+                    if isinstance(row, dict):
+                        row = (row.get('type'), row.get('category'), row.get('amount'),
+                               row.get('date'), row.get('description', ''))
+                    try:
+                        trans_type, category, amount, date, *rest = row
+                        description = rest[0] if rest else ""
+                        batch.append(self._validate(trans_type, category, amount,
+                                                    date, description))
+                    except ValueError as e:
+                        errors.append((index, str(e)))
+                        continue
+
+                    if len(batch) >= batch_size:
+                        inserted += self._insert_batch(cursor, batch)
+                        batch = []
+
+                if batch:
+                    inserted += self._insert_batch(cursor, batch)
+
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return {'inserted': 0, 'errors': errors + [(None, str(e))]}
+
+        if inserted:
+            bump_data_version(self.db, self.user_id)
+        return {'inserted': inserted, 'errors': errors}
+
+
+    def _insert_batch(self, cursor, batch):
+        """Insert validated rows, replacing category names with their ids.
+
+        The per-row balance and search triggers are switched off for the
+        batch. The search index is filled with one statement, and the
+        checkpoints are updated once from the net of each day, so a
+        backdated import does not rewrite the later balances row by row.
+        """
+        ids = self.categories.resolve(cursor, [row[2] for row in batch])
+        last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+        cursor.execute("INSERT INTO maintenance (flag) VALUES ('batching')")
+        cursor.executemany(INSERT_SQL, [row[:2] + (ids[row[2]],) + row[3:] for row in batch])
+        cursor.execute("DELETE FROM maintenance WHERE flag = 'batching'")
+        cursor.execute(SEARCH_BATCH_SQL, (last_id,))
+        deltas = {}
+        for row in batch:
+            deltas[row[4]] = deltas.get(row[4], 0) + row[3]
+        self.db.add_to_balances(cursor, self.user_id, deltas)
+        return len(batch)
+
+
+    def _validate(self, trans_type, category, amount, date=None, description=""):
+        """Return a row for _insert_batch, raising ValueError if invalid."""
+        trans_type = str(trans_type or '').strip().lower()
+        if trans_type not in ('income', 'expense'):
+            raise ValueError("Type must be 'income' or 'expense'")
+
+        try:
+            cents = to_cents(amount)
+        except (InvalidOperation, TypeError):
+            raise ValueError(f"Invalid amount: {amount!r}")
+        if cents <= 0:
+            raise ValueError("Amount must be positive")
+
+        db_amount = cents if trans_type == 'income' else -cents
+        return (self.user_id, trans_type, str(category or '').strip(), db_amount,
+                parse_date(date), str(description or '').strip())
+
+
     def get_transactions(self, start_date = None, end_date = None):
-        query = "SELECT * FROM transactions WHERE user_id = ?"
+        """Return the user's transactions as Transaction records."""
+        start, next_start = custom_range(start_date, end_date)
+        transactions = []
+        with self.db._get_cursor() as cursor:
+            for source, window_start, window_next in self.db.transaction_windows(
+                    cursor, start, next_start):
+                bounds, params = date_filter(window_start, window_next)
+                cursor.execute(SELECT_SQL.format(source=source) + " WHERE t.user_id = ?" + bounds,
+                               [self.user_id] + params)
+                transactions += [Transaction.from_row(row) for row in cursor.fetchall()]
+        return transactions
+
+
+    def get_batch(self, start_date=None, end_date=None):
+        """Return the user's transactions in date order as a TransactionBatch.
+
+        Day numbers are computed by SQLite, so no per-row date objects are
+        built; use this for large result sets.
+        """
+        query = f'''SELECT t.id, t.amount, CAST(julianday(t.date) - 2440587.5 AS INTEGER),
+                           COALESCE(c.name, ''), t.description
+                    FROM {{source}} t {CATEGORY_JOIN}
+                    WHERE t.user_id = ?{{bounds}} ORDER BY t.date, t.id'''
+
+        start, next_start = custom_range(start_date, end_date)
+        batch = TransactionBatch(self.user_id)
+        with self.db._get_cursor() as cursor:
+            for source, window_start, window_next in self.db.transaction_windows(
+                    cursor, start, next_start):
+                bounds, params = date_filter(window_start, window_next)
+                for row in cursor.execute(query.format(source=source, bounds=bounds),
+                                          [self.user_id] + params):
+                    batch.append(*row)
+        return batch
+
+
+    def get_transactions_page(self, after=None, limit=PAGE_SIZE, trans_type=None,
+                              category=None, min_amount=None, max_amount=None,
+                              start_date=None, end_date=None):
+        """Return one page of Transaction records, newest first, and the next cursor.
+
+        Pages are addressed by keyset: pass the returned (date, id) cursor as
+        `after` to fetch the following page. The cursor is None on the last
+        page. Amount bounds apply to the absolute amount. Archived years are
+        only read once the page reaches back past the newest one.
+        """
+        if limit < 1:
+            raise ValueError("Page size must be at least 1.")
+        query = SELECT_SQL + " WHERE t.user_id = ?"
         params = [self.user_id]
 
-        if start_date and end_date:
-            query += "AND date BETWEEN ? AND ?"
-            params.extend([start_date, end_date])
+        if after is not None:
+            query += " AND (t.date, t.id) < (?, ?)"
+            params.extend(after)
+        filters, filter_params = self._filters(trans_type, category, min_amount,
+                                               max_amount, start_date, end_date)
+        query += filters + "{bounds} ORDER BY t.date DESC, t.id DESC LIMIT ?"
+        params += filter_params
 
+        start, next_start = custom_range(start_date, end_date)
         with self.db._get_cursor() as cursor:
-            cursor.execute(query, params)
-            return cursor.fetchall()
+            archives = self.db.archived_years(cursor, start, next_start)
+            rows = cursor.execute(query.format(source='transactions', bounds=''),
+                                  params + [limit + 1]).fetchall()
+            # Archived rows are all older than the start of the year after
+            # the newest archive, so a full page newer than that is final
+            if archives and not (len(rows) > limit
+                                 and rows[limit - 1][5] >= f"{archives[0][0] + 1}-01-01"):
+                rows = []
+                for source, window_start, window_next in self.db.transaction_windows(
+                        cursor, start, next_start, newest_first=True):
+                    bounds, bound_params = date_filter(window_start, window_next)
+                    rows += cursor.execute(query.format(source=source, bounds=bounds),
+                                           params + bound_params + [limit + 1 - len(rows)]).fetchall()
+                    if len(rows) > limit:
+                        break
+
+        page = [Transaction.from_row(row) for row in rows[:limit]]
+        if len(rows) > limit:
+            return page, (page[-1].iso_date, page[-1].id)
+        return page, None
+
+
+    def search(self, text, limit=PAGE_SIZE, trans_type=None, category=None,
+               min_amount=None, max_amount=None, start_date=None, end_date=None):
+        """Full-text search over description and category, best match first.
+
+        See parse_search() for the query syntax; the filters are the same
+        as for get_transactions_page. The index is read newest first and
+        the SEARCH_CANDIDATES most recent matches are ranked, so the cost
+        stays bounded however common the words are. Archived years are not
+        indexed.
+        """
+        if limit < 1:
+            raise ValueError("Result limit must be at least 1.")
+        terms = parse_search(text)
+        base = self.user_id * SEARCH_ROWID_SPAN
+        query = f'''SELECT {COLUMNS} FROM transactions_fts f
+                    JOIN transactions t ON t.id = f.rowid - ?
+                    {CATEGORY_JOIN}
+                    WHERE transactions_fts MATCH ? AND f.rowid >= ? AND f.rowid < ?'''
+        params = [base, search_expression(terms), base, base + SEARCH_ROWID_SPAN]
+        filters, filter_params = self._filters(trans_type, category, min_amount,
+                                               max_amount, start_date, end_date)
+        query += filters + " ORDER BY f.rowid DESC LIMIT ?"
+        params += filter_params + [max(limit, SEARCH_CANDIDATES)]
+
+        with self.db._get_cursor() as cursor:
+            rows = cursor.execute(query, params).fetchall()
+        return [Transaction.from_row(row) for row in rank_matches(rows, terms)[:limit]]
+
+
+    def _filters(self, trans_type, category, min_amount, max_amount, start_date, end_date):
+        """SQL conditions on transactions t for the optional listing filters."""
+        query = ""
+        params = []
+        if trans_type:
+            query += " AND t.type = ?"
+            params.append(trans_type.lower())
+        if category:
+            query += " AND t.category_id = (SELECT id FROM categories WHERE user_id = ? AND key = ?)"
+            params += [self.user_id, canonical_category(category)]
+        if min_amount is not None:
+            query += " AND ABS(t.amount) >= ?"
+            params.append(to_cents(min_amount))
+        if max_amount is not None:
+            query += " AND ABS(t.amount) <= ?"
+            params.append(to_cents(max_amount))
+        start, next_start = custom_range(start_date, end_date)
+        if start:
+            query += " AND t.date >= ?"
+            params.append(start)
+        if next_start:
+            query += " AND t.date < ?"
+            params.append(next_start)
+        return query, params
 
 
     def delete_transaction(self, trans_id):
         with self.db._get_cursor() as cursor:
             cursor.execute("DELETE FROM transactions WHERE id = ? AND user_id = ?", 
                            (trans_id, self.user_id))
-            
-            if cursor.rowcount > 0:
-                print("Transaction deleted!")
-            
-            else:
-                print("No transaction found with that ID.")
-
+            deleted = cursor.rowcount > 0
 
-    
-        
+        if deleted:
+            # Only after commit, so no reader can cache the pre-delete state
+            bump_data_version(self.db, self.user_id)
+            print("Transaction deleted!")
+        else:
+            print("No transaction found with that ID.")
+        return deleted